@@ -1,22 +1,24 @@
 #!/usr/bin/env python3
 
 """
-Example to remove all asset filters, and upload a filter with MAC addresses.
+Example to set a single asset filter with MAC addresses.
+Only changes are sent: the filter is not uploaded again when it's already on the Crownstone, and other filters are removed.
 """
-import math
 import argparse
 import os
 import asyncio
 
-from crownstone_core.packets.assetFilter.FilterMetaDataPackets import *
-from crownstone_core.util import AssetFilterUtil
-from crownstone_core.util.AssetFilterUtil import get_filter_crc
-from crownstone_core.util.Cuckoofilter import CuckooFilter
+from crownstone_core.packets.assetFilter.AssetFilterPackets import AssetFilterPacket
+from crownstone_core.packets.assetFilter.FilterMetaDataPackets import FilterMetaData
+from crownstone_core.packets.assetFilter.FilterOutputPackets import FilterOutputDescription, FilterOutputDescriptionType
+from crownstone_core.packets.assetFilter.InputDescriptionPackets import InputDescriptionMacAddress
 from crownstone_uart import CrownstoneUart
-import itertools
 
 from bluenet_logs import BluenetLogs
 
+import asset_filter_planner
+import asset_filter_sync
+
 import logging
 #logging.basicConfig(format='%(asctime)s %(levelname)-7s: %(message)s', level=logging.DEBUG)
 
@@ -46,6 +48,16 @@ argParser.add_argument('--sourceFilesDir',
                        type=str,
                        default=f"{defaultSourceFilesDir}",
                        help='The path with the bluenet source code files on your system.')
+argParser.add_argument('--maxFilterSize',
+                       dest='maxFilterSize',
+                       type=int,
+                       default=asset_filter_planner.DEFAULT_MAX_FILTER_SIZE,
+                       help='The max size of the filter in bytes, the smallest filter type that fits is used.')
+argParser.add_argument('--maxFalsePositiveRate',
+                       dest='maxFalsePositiveRate',
+                       type=float,
+                       default=asset_filter_planner.DEFAULT_MAX_FALSE_POSITIVE_RATE,
+                       help='The max fraction of other MAC addresses that may pass the filter.')
 args = argParser.parse_args()
 
 sourceFilesDir = args.sourceFilesDir
@@ -66,110 +78,35 @@ async def main():
 		print(f"Listening for logs and using files in \"{sourceFilesDir}\" to find the log formats.")
 		await uart.initialize_usb(port=args.device, writeChunkMaxSize=64)
 
-		filters = await uart.control.getFilterSummaries()
-		masterVersion = filters.masterVersion.val
-
-		##############################################################################################
-		##################################### Remove all filters #####################################
-		##############################################################################################
-
-		print("Remove all filters")
-		for f in filters.summaries.val:
-			print(f"    Remove id={f.filterId}")
-			await uart.control.removeFilter(f.filterId)
-
-		masterVersion += 1
-		filtersAndIds = []
-		masterCrc = AssetFilterUtil.get_master_crc_from_filters(filtersAndIds)
-		print("Master CRC:", masterCrc)
-		print("Commit")
-		await uart.control.commitFilterChanges(masterVersion, masterCrc)
-
 		#############################################################################################
 		##################################### Create new filter #####################################
 		#############################################################################################
 
-		filter = AssetFilter()
-
-		filterInput = FilterInputDescription()
-		filterInput.format.type = AdvertisementSubdataType.MAC_ADDRESS
-
-		filterOutputDescription = FilterOutputDescription()
-		filterOutputDescription.out_format.type = FilterOutputFormat.MAC_ADDRESS
-		# filterOutputDescription.in_format = None
-
-		metadata = FilterMetaData()
+		print(f"MACs={args.assetMacAddresses}")
 
-		# Using the EXACT_MATCH filter takes up more space, but has no false positives.
-		metadata.type = FilterType.EXACT_MATCH
+		# Use the smallest filter type that fits, with an acceptable false positive rate.
+		# The EXACT_MATCH filter takes up more space, but has no false positives.
+		plan = asset_filter_planner.planFilter(args.assetMacAddresses, args.maxFilterSize, args.maxFalsePositiveRate)
+		if plan is None:
+			raise Exception(f"No filter of at most {args.maxFilterSize} bytes for {len(args.assetMacAddresses)} assets")
+		print(f"Filter plan: {plan}")
 
 		# Setting profile ID 0 will make the asset also trigger behaviours.
-		metadata.profileId = 0
+		metadata = FilterMetaData(plan.filterType,
+		                          InputDescriptionMacAddress(),
+		                          FilterOutputDescription(FilterOutputDescriptionType.MAC_ADDRESS, None),
+		                          profileId=0)
 
-		metadata.inputDescription = filterInput
-		metadata.outputDescription = filterOutputDescription
-		filter.metadata = metadata
+		filter = asset_filter_sync.SerializedFilter(0, AssetFilterPacket(metadata, plan.filterData).serialize())
+		print("Filter size:", len(filter.serialize()))
+		print("Filter CRC:", filter.getCrc())
 
-		print(f"MACs={args.assetMacAddresses}")
-		macAddressesAsBytes = []
-		for a in args.assetMacAddresses:
-			print(f"Adding asset MAC {a} to filter.")
-			buf = Conversion.address_to_uint8_array(a)
-			if not buf:
-				raise Exception(f"Invalid MAC: {a}")
-			macAddressesAsBytes.append(list(buf))
-
-		if metadata.type == FilterType.CUCKOO:
-			# Create the cuckoo filter
-			max_buckets_log2 = int(math.log2(len(macAddressesAsBytes))) + 1
-			nests_per_bucket = 2
-			cuckooFilter = CuckooFilter(max_buckets_log2, nests_per_bucket)
-			max_items = cuckooFilter.fingerprintcount()
-			for a in macAddressesAsBytes:
-				if not cuckooFilter.add(a):
-					print("Failed to add to cuckoo filter")
-					raise Exception("Failed to add to cuckoo filter")
-			cuckooFilterData = cuckooFilter.getData()
-			filter.filterdata.val = cuckooFilterData
-
-		elif metadata.type == FilterType.EXACT_MATCH:
-			# Create the exact filter
-			exactFilter = ExactMatchFilterData(len(macAddressesAsBytes), 6)
-			exactFilter.itemArray.val = list(itertools.chain.from_iterable(macAddressesAsBytes))
-			filter.filterdata.val = exactFilter
-
-		else:
-			raise Exception("Invalid filter type")
-
-		print("Filter size:", len(filter.getPacket()))
-		print("Filter CRC:", get_filter_crc(filter))
-
-
-		###########################################################################################
-		##################################### Uploade filters #####################################
-		###########################################################################################
-
-		filters = [filter]
-
-		filterId = 0
-		masterVersion += 1
-
-		filtersAndIds = []
-		for f in filters:
-			filtersAndIds.append(AssetFilterAndId(filterId, filter))
-			filterId += 1
-
-		masterCrc = AssetFilterUtil.get_master_crc_from_filters(filtersAndIds)
-		print("Master CRC:", masterCrc)
-		print("Master version:", masterVersion)
-
-		filterId = 0
-		for f in filters:
-			print(f"Upload filter {filterId}")
-			await uart.control.uploadFilter(filterId, f)
-			filterId += 1
-		print("Commit")
-		await uart.control.commitFilterChanges(masterVersion, masterCrc)
+		##########################################################################################
+		##################################### Upload filters #####################################
+		##########################################################################################
+
+		stats = await asset_filter_sync.syncFilters(uart.control, [filter])
+		print("Sync:", stats)
 		print("Done!")
 		print("Press ctrl-c to exit.")
 
@@ -6,6 +6,7 @@ Example to upload asset filters via UART or BLE.
 import argparse
 import os
 import asyncio
+import time
 from datetime import datetime
 
 import crownstone_core
@@ -23,7 +24,9 @@ import logging
 from crownstone_uart.core.uart.uartPackets.AssetMacReport import AssetMacReport
 from crownstone_uart.core.uart.uartPackets.AssetIdReport import AssetIdReport
 
-from Crc32 import crc32_table
+import asset_ids
+import asset_filter_sync
+from asset_monitor import AssetMonitor
 
 mac_addresses = [
 	"d0:2b:1d:2c:de:0a",
@@ -414,21 +417,11 @@ mac_addresses = [
 ]
 #mac_addresses = mac_addresses[0:50]
 
-assetIds = {}
-for mac in mac_addresses:
-	crc = crc32_table(Conversion.address_to_uint8_array(mac))
-	# assetIds[mac] = [
-	# 	(crc >>  0) & 0xFF,
-	# 	(crc >>  8) & 0xFF,
-	# 	(crc >> 16) & 0xFF]
-	assetIds[mac] = crc & 0x00FFFFFF
-
-unique_and_sorted_mac_addresses = []
-for mac in mac_addresses:
-	if mac not in unique_and_sorted_mac_addresses:
-		unique_and_sorted_mac_addresses.append(mac)
-unique_and_sorted_mac_addresses.sort()
+assetIds = asset_ids.getAssetIdMap(mac_addresses)
+unique_and_sorted_mac_addresses = sorted(assetIds.keys())
 print(f"{len(unique_and_sorted_mac_addresses)} unique MAC addresses")
+for assetId, collidingMacs in asset_ids.findCollisions(assetIds).items():
+	print(f"Asset id collision: id={assetId} macs={collidingMacs}")
 
 defaultSourceFilesDir = os.path.abspath(f"{os.path.dirname(os.path.abspath(__file__))}/../source")
 
@@ -453,6 +446,26 @@ argParser.add_argument('--address',
                        type=str,
                        default=None,
                        help='The MAC address/handle of the Crownstone you want to connect to')
+argParser.add_argument('--statsInterval',
+                       dest='statsInterval',
+                       type=float,
+                       default=10.0,
+                       help='Interval in seconds to print the asset statistics, 0 to only print them on exit.')
+argParser.add_argument('--jsonPort',
+                       dest='jsonPort',
+                       type=int,
+                       default=None,
+                       help='Serve the asset statistics as JSON on this port.')
+argParser.add_argument('--saveFilters',
+                       dest='saveFilters',
+                       type=str,
+                       default=None,
+                       help='Save the uploaded filters to this file, for asset_filter_simulator.py and asset_filter_rollout.py.')
+argParser.add_argument('--quiet',
+                       '-q',
+                       dest='quiet',
+                       action='store_true',
+                       help='Do not print every report.')
 argParser.add_argument('--verbose',
                        '-v',
                        dest='verbose',
@@ -485,7 +498,14 @@ print("core version:", crownstone_core.__version__)
 print("ble version: ", ble.__version__)
 print("uart version:", uart.__version__)
 
+monitor = AssetMonitor(assetIds)
+
 async def main():
+	jsonServer = None
+	if args.jsonPort is not None:
+		jsonServer = monitor.serveJson(args.jsonPort)
+		print(f"Serving asset statistics on http://localhost:{args.jsonPort}/")
+
 	# The try except part is just to catch a control+c to gracefully stop the libs.
 	try:
 		print(f"Listening for logs and using files in \"{sourceFilesDir}\" to find the log formats.")
@@ -566,6 +586,10 @@ async def main():
 		# filters = [filter1, filter2, filter3, filter4, filter5]
 		filters = [filter3, filter6]
 
+		if args.saveFilters is not None:
+			asset_filter_sync.writeFilters(args.saveFilters, filters)
+			print(f"Saved filters to {args.saveFilters}")
+
 		if args.address is not None:
 			print("Set filters via BLE.")
 			await ble.connect(args.address)
@@ -580,66 +604,44 @@ async def main():
 
 		##### Listen for results #####
 
-		# Usage: received_mac_addresses[asset_mac][filter_id][crownstone_id] = [timestamp, timestamp, ...]
-		received_mac_addresses = {}
-		for mac in mac_addresses:
-			received_mac_addresses[mac] = {}
-			# for f in filters:
-			# 	filter_id = f.getFilterId()
-			for filter_id in range(0, 8):
-				received_mac_addresses[mac][filter_id] = {}
+		# Filters that output the MAC address.
+		mac_filter_ids = [f.getFilterId() for f in filters if f._outputType == FilterOutputDescriptionType.MAC_ADDRESS]
 
 		def onAssetMac(report: AssetMacReport):
-			print(f"onAssetMac mac={report.assetMacAddress} crownstoneId={report.crownstoneId} rssi={report.rssi} channel={report.channel}")
-			mac = report.assetMacAddress
-			for f in filters:
-				if f._outputType == FilterOutputDescriptionType.MAC_ADDRESS:
-					if mac in received_mac_addresses:
-						received_mac_addresses[mac][f.getFilterId()].setdefault(report.crownstoneId, []).append(datetime.now())
+			if not args.quiet:
+				print(f"onAssetMac mac={report.assetMacAddress} crownstoneId={report.crownstoneId} rssi={report.rssi} channel={report.channel}")
+			for filter_id in mac_filter_ids:
+				monitor.addReport(report.assetMacAddress, filter_id, report.crownstoneId)
 
 		def onAssetId(report: AssetIdReport):
+			macs = monitor.addIdReport(report.assetId, report.passedFilterIds, report.crownstoneId)
+			if args.quiet:
+				return
 			print(f"onAssetId id={report.assetId} crownstoneId={report.crownstoneId} rssi={report.rssi} channel={report.channel} passedFilterIds={report.passedFilterIds}")
-
-			found = False
-			for mac, assetId in assetIds.items():
-				if assetId == report.assetId:
-					found = True
-					for filter_id in report.passedFilterIds:
-						received_mac_addresses[mac][filter_id].setdefault(report.crownstoneId, []).append(datetime.now())
-
-					# Output a format that the log parser can handle.
-					# Example: [2021-06-28 13:42:03.142532] asset mac=60:c0:bf:27:e5:67 scanned by id=96
-					timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S.%f]")
-					print(f"{timestamp} asset mac={mac} scanned by id={report.crownstoneId}")
-					break
-			if not found:
+			if not macs:
 				print("Asset not found")
-
-			# print(f"  MAC={mac_addresses_in_filter[report.assetId]}")
+				return
+			# Output a format that the log parser can handle.
+			# Example: [2021-06-28 13:42:03.142532] asset mac=60:c0:bf:27:e5:67 scanned by id=96
+			timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S.%f]")
+			print(f"{timestamp} asset mac={macs[0]} scanned by id={report.crownstoneId}")
 
 		UartEventBus.subscribe(UartTopics.assetTrackingReport, onAssetMac)
 		UartEventBus.subscribe(UartTopics.assetIdReport, onAssetId)
 
-		# Simply keep the program running.
+		# Keep the program running, and print the statistics periodically.
+		lastPrintTime = time.time()
 		while True:
 			await asyncio.sleep(0.1)
+			if args.statsInterval > 0 and time.time() - lastPrintTime >= args.statsInterval:
+				lastPrintTime = time.time()
+				monitor.printTable()
 	except KeyboardInterrupt:
 		pass
 	finally:
-		for mac in received_mac_addresses.keys():
-			print(f"MAC {mac}")
-			for filter_id in received_mac_addresses[mac].keys():
-				print(f"    Filter ID {filter_id}")
-				for crownstone_id in received_mac_addresses[mac][filter_id].keys():
-					timestamps = received_mac_addresses[mac][filter_id][crownstone_id]
-
-					dts = []
-					if len(timestamps) > 1:
-						for i in range(1, len(timestamps)):
-							dt = (timestamps[i] - timestamps[i - 1]).total_seconds()
-							dts.append(dt)
-
-					print(f"        Crownstone ID {crownstone_id} len={len(timestamps)} dts={dts}")
+		monitor.printTable()
+		if jsonServer is not None:
+			jsonServer.shutdown()
 
 		print("\nStopping UART..")
 		uart.stop()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Chooses the smallest asset filter for a list of MAC addresses.
+
+Both filter types are built:
+- EXACT_MATCH: stores all MAC addresses, no false positives.
+- CUCKOO: stores a 16 bit fingerprint per MAC address, in 2^bucketCountLog2 buckets of nestsPerBucket fingerprints.
+  Every bucket configuration that can hold all addresses, and fits in the size budget, is tried.
+
+For each candidate the serialized size is measured, whether all addresses could be inserted, and the false positive
+rate: the fraction of random MAC addresses that pass the filter. The cheapest candidate that is valid is chosen.
+
+The false positive rate is measured on the serialized filter data, as the Crownstone has it, with all random
+addresses at once: the fingerprints and bucket hashes are calculated with numpy, instead of per address.
+
+Usage:
+	./asset_filter_planner.py macs.txt [-m 512] [-f 0.001] [-n 100000]
+"""
+
+import argparse
+
+import numpy as np
+
+from crownstone_core.packets.assetFilter.ExactMatchFilter import ExactMatchFilter
+from crownstone_core.packets.assetFilter.FilterMetaDataPackets import FilterType
+from crownstone_core.util.Cuckoofilter import CuckooFilter
+
+import asset_ids
+
+# Default max size in bytes of a filter, including the meta data.
+DEFAULT_MAX_FILTER_SIZE = 512
+
+# Size in bytes of the meta data of a filter with MAC address input and output.
+META_DATA_SIZE = 5
+
+DEFAULT_MAX_FALSE_POSITIVE_RATE = 0.001
+DEFAULT_NUM_SAMPLES = 100000
+
+# The bucket indices and counts are uint8 on the Crownstone.
+MAX_BUCKET_COUNT_LOG2 = 8
+MAX_NESTS_PER_BUCKET = 255
+MAX_EXACT_MATCH_ITEMS = 255
+
+# Table of the CRC-16-CCITT (polynomial 0x1021), as used for cuckoo filter fingerprints.
+def _makeCrc16Table():
+	table = np.arange(256, dtype=np.uint32) << 8
+	for i in range(0, 8):
+		table = np.where(table & 0x8000, (table << 1) ^ 0x1021, table << 1) & 0xFFFF
+	return table.astype(np.uint16)
+
+CRC16_TABLE = _makeCrc16Table()
+
+class FilterCandidate:
+	def __init__(self, filterType, filterData, numAssets, inserted, bucketCountLog2=None, nestsPerBucket=None):
+		self.filterType = filterType
+		self.filterData = filterData
+		self.numAssets = numAssets
+		self.inserted = inserted
+		self.bucketCountLog2 = bucketCountLog2
+		self.nestsPerBucket = nestsPerBucket
+		self.size = META_DATA_SIZE + len(filterData.serialize())
+		self.falsePositiveRate = 0.0
+
+	def isValid(self, maxSize, maxFalsePositiveRate):
+		return self.inserted and self.size <= maxSize and self.falsePositiveRate <= maxFalsePositiveRate
+
+	def __str__(self):
+		if self.filterType == FilterType.CUCKOO:
+			config = f"buckets=2^{self.bucketCountLog2} nests={self.nestsPerBucket}"
+		else:
+			config = f"items={self.numAssets}"
+		return f"{self.filterType.name:11s} {config:22s} size={self.size:4d} inserted={self.inserted} " \
+		       f"falsePositiveRate={self.falsePositiveRate:.2e}"
+
+def crc16(data, lengths=None):
+	"""
+	Table driven CRC-16-CCITT of all rows at once, like crownstone_core.util.CRC.crc16ccitt().
+
+	:param data:    Array of bytes, shape (N, M).
+	:param lengths: Number of bytes of each row to use, shape (N,). None to use all bytes.
+	:return:        Array with the CRC of each row, shape (N,).
+	"""
+	crc = np.full(data.shape[0], 0xFFFF, dtype=np.uint16)
+	for column in range(0, data.shape[1]):
+		updated = CRC16_TABLE[((crc >> 8) ^ data[:, column]) & 0xFF] ^ (crc << 8)
+		crc = updated if lengths is None else np.where(column < lengths, updated, crc)
+	return crc
+
+def djb2(data, lengths=None):
+	"""
+	16 bit djb2 hash of all rows at once, like crownstone_core.util.CRC.djb2_hash().
+	"""
+	hashes = np.full(data.shape[0], 5381, dtype=np.uint32)
+	for column in range(0, data.shape[1]):
+		updated = (hashes * 33 + data[:, column]) & 0xFFFF
+		hashes = updated if lengths is None else np.where(column < lengths, updated, hashes)
+	return hashes
+
+def getRandomMacBytes(numSamples, excludeBytes, seed=None):
+	"""
+	:return: Array of shape (N, 6) with random MAC addresses that are not in excludeBytes, N is about numSamples.
+	"""
+	rng = np.random.default_rng(seed)
+	samples = rng.integers(0, 256, size=(numSamples, 6), dtype=np.uint8)
+	if len(excludeBytes):
+		samples = samples[~np.isin(_bytesToInt(samples), _bytesToInt(excludeBytes))]
+	return samples
+
+def _bytesToInt(macBytes):
+	return np.asarray(macBytes, dtype=np.uint64) @ (np.uint64(1) << (np.arange(6, dtype=np.uint64) * np.uint64(8)))
+
+def buildExactMatch(macBytes):
+	filterData = ExactMatchFilter()
+	for mac in macBytes.tolist():
+		filterData.add(mac)
+	return FilterCandidate(FilterType.EXACT_MATCH, filterData, len(macBytes), len(macBytes) <= MAX_EXACT_MATCH_ITEMS)
+
+def buildCuckoo(macBytes, bucketCountLog2, nestsPerBucket):
+	cuckooFilter = CuckooFilter(bucketCountLog2, nestsPerBucket)
+	inserted = True
+	for mac in macBytes.tolist():
+		if not cuckooFilter.add(mac):
+			inserted = False
+			break
+	return FilterCandidate(FilterType.CUCKOO, cuckooFilter.getData(), len(macBytes), inserted, bucketCountLog2, nestsPerBucket)
+
+def getCuckooSize(bucketCountLog2, nestsPerBucket):
+	return META_DATA_SIZE + CuckooFilter.getsize(1 << bucketCountLog2, nestsPerBucket)
+
+def getCuckooConfigs(numAssets, maxSize):
+	"""
+	:return: List of (bucketCountLog2, nestsPerBucket) that can hold numAssets and fit in maxSize, smallest first.
+	"""
+	configs = []
+	for bucketCountLog2 in range(0, MAX_BUCKET_COUNT_LOG2 + 1):
+		bucketCount = 1 << bucketCountLog2
+		minNests = max(1, -(-numAssets // bucketCount))
+		for nestsPerBucket in range(minNests, MAX_NESTS_PER_BUCKET + 1):
+			if getCuckooSize(bucketCountLog2, nestsPerBucket) > maxSize:
+				break
+			configs.append((bucketCountLog2, nestsPerBucket))
+	configs.sort(key=lambda config: (getCuckooSize(*config), config[0]))
+	return configs
+
+def cuckooContains(filterData, fingerprints, bucketHashes):
+	"""
+	:param filterData:   CuckooFilterData, empty nests are 0, like on the Crownstone.
+	:param fingerprints: Fingerprints of the keys, see crc16().
+	:param bucketHashes: Bucket hashes of the keys, see djb2().
+	:return:             Array with for each key whether it is contained in the filter.
+	"""
+	bucketCount = 1 << filterData.bucketCountLog2
+	buckets = np.array(filterData.bucketArray, dtype=np.uint16).reshape(bucketCount, filterData.nestsPerBucket)
+	bucketA = bucketHashes % bucketCount
+	bucketB = (bucketHashes ^ fingerprints) % bucketCount
+	fingerprints = fingerprints[:, np.newaxis]
+	contained = np.any(buckets[bucketA] == fingerprints, axis=1) | np.any(buckets[bucketB] == fingerprints, axis=1)
+	if filterData.victim.fingerprint != 0:
+		victim = filterData.victim
+		contained |= (fingerprints[:, 0] == victim.fingerprint) & (
+				((bucketA == victim.bucketA) & (bucketB == victim.bucketB)) |
+				((bucketA == victim.bucketB) & (bucketB == victim.bucketA)))
+	return contained
+
+def calcCuckooFalsePositiveRate(filterData, fingerprints, bucketHashes):
+	"""
+	:return: Fraction of the samples that is contained in the filter.
+	"""
+	contained = cuckooContains(filterData, fingerprints, bucketHashes)
+	return float(np.mean(contained)) if len(contained) else 0.0
+
+def getCandidates(macs, maxSize=DEFAULT_MAX_FILTER_SIZE, maxFalsePositiveRate=DEFAULT_MAX_FALSE_POSITIVE_RATE,
+		numSamples=DEFAULT_NUM_SAMPLES, seed=None):
+	"""
+	Builds the candidate filters, smallest first. Building stops at the first valid cuckoo filter, as all remaining
+	cuckoo filters are larger.
+
+	:param macs: List of MAC addresses, like "12:34:56:78:AB:CD".
+	:return:     List of FilterCandidate.
+	"""
+	macBytes = asset_ids.macsToBytes(sorted(set(mac.lower() for mac in macs)))
+	candidates = [buildExactMatch(macBytes)]
+
+	samples = getRandomMacBytes(numSamples, macBytes, seed)
+	fingerprints = crc16(samples)
+	bucketHashes = djb2(samples)
+	for bucketCountLog2, nestsPerBucket in getCuckooConfigs(len(macBytes), maxSize):
+		candidate = buildCuckoo(macBytes, bucketCountLog2, nestsPerBucket)
+		candidate.falsePositiveRate = calcCuckooFalsePositiveRate(candidate.filterData, fingerprints, bucketHashes)
+		candidates.append(candidate)
+		if candidate.isValid(maxSize, maxFalsePositiveRate):
+			break
+	candidates.sort(key=lambda candidate: candidate.size)
+	return candidates
+
+def planFilter(macs, maxSize=DEFAULT_MAX_FILTER_SIZE, maxFalsePositiveRate=DEFAULT_MAX_FALSE_POSITIVE_RATE,
+		numSamples=DEFAULT_NUM_SAMPLES, seed=None):
+	"""
+	:return: The smallest valid FilterCandidate, or None when no filter is valid.
+	         Of equally sized filters, the one with the lowest false positive rate is chosen.
+	"""
+	return chooseCandidate(getCandidates(macs, maxSize, maxFalsePositiveRate, numSamples, seed), maxSize, maxFalsePositiveRate)
+
+def chooseCandidate(candidates, maxSize, maxFalsePositiveRate):
+	"""
+	:return: The smallest valid candidate, or None when no candidate is valid.
+	"""
+	valid = [candidate for candidate in candidates if candidate.isValid(maxSize, maxFalsePositiveRate)]
+	if not valid:
+		return None
+	return min(valid, key=lambda candidate: (candidate.size, candidate.falsePositiveRate))
+
+def main():
+	parser = argparse.ArgumentParser(description='Choose the smallest asset filter for a list of MAC addresses')
+	parser.add_argument('-m', '--maxSize', dest='maxSize', type=int, default=DEFAULT_MAX_FILTER_SIZE,
+			help='Max size of the filter in bytes, including meta data')
+	parser.add_argument('-f', '--maxFalsePositiveRate', dest='maxFalsePositiveRate', type=float, default=DEFAULT_MAX_FALSE_POSITIVE_RATE,
+			help='Max fraction of other MAC addresses that may pass the filter')
+	parser.add_argument('-n', '--numSamples', dest='numSamples', type=int, default=DEFAULT_NUM_SAMPLES,
+			help='Number of random MAC addresses to measure the false positive rate with')
+	parser.add_argument('fileName',
+			help='File with one MAC address per line')
+	args = parser.parse_args()
+
+	macs = asset_ids.readMacs(args.fileName)
+	candidates = getCandidates(macs, args.maxSize, args.maxFalsePositiveRate, args.numSamples)
+	for candidate in candidates:
+		print(("valid    " if candidate.isValid(args.maxSize, args.maxFalsePositiveRate) else "invalid  ") + str(candidate))
+	best = chooseCandidate(candidates, args.maxSize, args.maxFalsePositiveRate)
+	if best is None:
+		print(f"No valid filter for {len(set(macs))} MAC addresses")
+		exit(1)
+	print("Best:", best)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+Rolls out asset filters to many Crownstones, using multiple BLE adapters at the same time.
+
+The filter CRCs and the master CRC are calculated once. Each adapter runs a worker that takes Crownstones from a shared
+queue. For each Crownstone the worker:
+- Connects, and gets the filter summaries. When the master CRC already matches, nothing is uploaded: the filters
+  may have reached it via the mesh.
+- Otherwise uploads the changed filters and commits, see asset_filter_sync.py.
+- Polls the filter summaries until the master CRC matches, or the verify timeout passes.
+A Crownstone that fails is retried with exponential backoff, see retry_queue.py. The time of each step is reported
+per Crownstone.
+
+Without a given master version, the master version is one higher than the highest master version seen so far: when a
+Crownstone reports a master version that is not lower, the master version is raised for it and all Crownstones after
+it. Otherwise a higher, stale, master version would win the mesh sync.
+With a given master version, a Crownstone that already has that version or higher fails without retries.
+
+With --simulate, a simulated mesh of Crownstones is used instead, see simulated_mesh.py.
+
+Usage:
+	./asset_filter_rollout.py keys.json filters.txt AA:BB:CC:DD:EE:01 AA:BB:CC:DD:EE:02 [-A adapter] [--simulate]
+
+The filters file can be written with asset-filter-test.py --saveFilters, see asset_filter_sync.writeFilters().
+"""
+
+import argparse
+import asyncio
+import time
+
+from crownstone_core.packets.assetFilter.util import AssetFilterMasterCrc
+
+import asset_filter_sync
+from retry_queue import RetryQueue, NonRetryableError
+
+class RolloutTarget:
+	def __init__(self, address):
+		self.address = address
+		self.attempts = 0
+		self.status = "pending"
+		self.error = None
+		self.adapterName = None
+		self.syncStats = None
+		self.numPolls = 0
+		# Duration in seconds per step, of the last attempt.
+		self.durations = {}
+
+class Adapter:
+	def __init__(self, name, core):
+		self.name = name
+		self.core = core
+		self.numTargets = 0
+		self.numFailures = 0
+
+class Rollout:
+	def __init__(self, adapters, filters, masterVersion=None, retries=3, pollInterval=1.0, verifyTimeout=30.0):
+		"""
+		:param adapters:      List of Adapter.
+		:param filters:       List of AssetFilter or SerializedFilter.
+		:param masterVersion: Master version to set, None for one higher than the current version.
+		"""
+		self.adapters = adapters
+		self.filters = filters
+		self.masterCrc = AssetFilterMasterCrc.get_master_crc_from_filters(filters)
+		self.masterVersion = masterVersion
+		self.fixedMasterVersion = masterVersion is not None
+		self.retries = retries
+		self.pollInterval = pollInterval
+		self.verifyTimeout = verifyTimeout
+		self.queue = RetryQueue(self.rollOut, retries, self.onError)
+		self.targets = []
+
+	async def run(self, addresses):
+		self.targets = [RolloutTarget(address) for address in addresses]
+		for target in await self.queue.run(self.adapters, self.targets):
+			target.status = "failed"
+		return self.targets
+
+	def onError(self, adapter, target, err, retry):
+		adapter.numFailures += 1
+		target.error = repr(err)
+		target.status = "retrying" if retry else "failed"
+		print(adapter.name, "failed to roll out to", target.address, ":", err)
+
+	async def rollOut(self, adapter, target):
+		target.adapterName = adapter.name
+		adapter.numTargets += 1
+		target.durations = {}
+		startTime = time.perf_counter()
+		core = adapter.core
+		await core.connect(target.address)
+		target.durations["connect"] = time.perf_counter() - startTime
+		try:
+			stepTime = time.perf_counter()
+			summaries = await core.control.getFilterSummaries()
+			if summaries.masterCrc == self.masterCrc:
+				target.status = "upToDate"
+			else:
+				self.checkMasterVersion(summaries.masterVersion)
+				target.syncStats = await asset_filter_sync.syncFilters(core.control, self.filters, self.masterVersion)
+				target.status = "updated"
+			target.durations["sync"] = time.perf_counter() - stepTime
+
+			stepTime = time.perf_counter()
+			await self.verify(core, target)
+			target.durations["verify"] = time.perf_counter() - stepTime
+		finally:
+			await core.disconnect()
+		target.durations["total"] = time.perf_counter() - startTime
+		target.error = None
+
+	def checkMasterVersion(self, currentVersion):
+		"""
+		Makes sure the master version to set is higher than the current master version of a Crownstone.
+		"""
+		if self.masterVersion is not None and self.masterVersion > currentVersion:
+			return
+		if self.fixedMasterVersion:
+			raise NonRetryableError(f"Master version {self.masterVersion} is not higher than {currentVersion}")
+		self.masterVersion = currentVersion + 1
+
+	async def verify(self, core, target):
+		"""
+		Polls the filter summaries until the master CRC matches.
+		"""
+		deadline = time.perf_counter() + self.verifyTimeout
+		while True:
+			summaries = await core.control.getFilterSummaries()
+			target.numPolls += 1
+			if summaries.masterCrc == self.masterCrc:
+				return
+			if time.perf_counter() >= deadline:
+				raise Exception(f"Master CRC {summaries.masterCrc} does not match {self.masterCrc} "
+				                f"after {self.verifyTimeout}s")
+			await asyncio.sleep(self.pollInterval)
+
+def printTargets(targets):
+	print(f"{'address':17s} {'status':9s} {'adapter':8s} {'tries':>5s} {'connect':>8s} {'sync':>8s} {'verify':>8s} {'total':>8s} {'bytes':>6s}")
+	for target in targets:
+		durations = " ".join("{:8s}".format("-") if step not in target.durations else "{:7.2f}s".format(target.durations[step])
+		                     for step in ["connect", "sync", "verify", "total"])
+		bytesSent = target.syncStats.bytesSent if target.syncStats is not None else 0
+		print(f"{target.address:17s} {target.status:9s} {str(target.adapterName):8s} {target.attempts:5d} {durations} {bytesSent:6d}")
+		if target.status == "failed":
+			print("    ", target.error)
+
+def createAdapters(args):
+	if args.simulate:
+		from simulated_mesh import SimulatedMesh, SimulatedMeshBle
+		mesh = SimulatedMesh(args.bleAddresses, propagationDelay=args.simulatedPropagationDelay,
+		                     bytesPerSecond=args.simulatedBytesPerSecond)
+		names = args.adapterAddresses or ["sim" + str(i) for i in range(0, args.numSimulatedAdapters)]
+		return [Adapter(name, SimulatedMeshBle(mesh, connectFailureRate=args.simulatedFailureRate, seed=i))
+		        for i, name in enumerate(names)]
+	from crownstone_ble import CrownstoneBle
+	adapters = []
+	for adapterAddress in (args.adapterAddresses or [None]):
+		core = CrownstoneBle(bleAdapterAddress=adapterAddress)
+		core.loadSettingsFromFile(args.keyFile)
+		adapters.append(Adapter(adapterAddress or "default", core))
+	return adapters
+
+async def main():
+	parser = argparse.ArgumentParser(description='Roll out asset filters to many Crownstones')
+	parser.add_argument('-A', '--adapterAddress', dest='adapterAddresses', type=str, action='append',
+			help='Adapter MAC address of a bluetooth chip to use, can be given multiple times. You can get a list by running: hcitool dev')
+	parser.add_argument('-m', '--masterVersion', dest='masterVersion', type=int, default=None,
+			help='Master version to set, by default one higher than the current version')
+	parser.add_argument('-R', '--retries', dest='retries', type=int, default=3,
+			help='Number of times to retry a Crownstone that failed')
+	parser.add_argument('-p', '--pollInterval', dest='pollInterval', type=float, default=1.0,
+			help='Time in seconds between polls of the filter summaries')
+	parser.add_argument('-t', '--verifyTimeout', dest='verifyTimeout', type=float, default=30.0,
+			help='Time in seconds to wait for the master CRC to match')
+	parser.add_argument('--simulate', dest='simulate', action='store_true',
+			help='Use a simulated mesh of Crownstones. The key file is ignored.')
+	parser.add_argument('--simulatedAdapters', dest='numSimulatedAdapters', type=int, default=2,
+			help='Number of simulated adapters, when no adapter addresses are given')
+	parser.add_argument('--simulatedFailureRate', dest='simulatedFailureRate', type=float, default=0.1,
+			help='Probability that connecting to a simulated Crownstone fails')
+	parser.add_argument('--simulatedPropagationDelay', dest='simulatedPropagationDelay', type=float, default=2.0,
+			help='Time in seconds for filters to spread over the simulated mesh, negative for no mesh sync')
+	parser.add_argument('--simulatedBytesPerSecond', dest='simulatedBytesPerSecond', type=float, default=2000,
+			help='Emulated transfer speed of a simulated connection')
+	parser.add_argument('keyFile',
+			help='The json file with key information, expected values: admin, member, guest, basic,' +
+			'serviceDataKey, localizationKey, meshApplicationKey, and meshNetworkKey')
+	parser.add_argument('filtersFile',
+			help='File with one filter per line: the filter id and the serialized filter as hex')
+	parser.add_argument('bleAddresses', type=str, nargs='+',
+			help='The BLE addresses of the Crownstones to roll out the filters to')
+	args = parser.parse_args()
+	if args.simulatedPropagationDelay < 0:
+		args.simulatedPropagationDelay = None
+
+	filters = asset_filter_sync.readFilters(args.filtersFile)
+	adapters = createAdapters(args)
+	rollout = Rollout(adapters, filters, args.masterVersion, args.retries, args.pollInterval, args.verifyTimeout)
+	print(f"Rolling out {len(filters)} filters, master CRC {rollout.masterCrc}, to {len(args.bleAddresses)} Crownstones")
+	startTime = time.perf_counter()
+	try:
+		targets = await rollout.run(args.bleAddresses)
+	finally:
+		for adapter in adapters:
+			await adapter.core.shutDown()
+	printTargets(targets)
+	print(f"Master version: {rollout.masterVersion}")
+	for adapter in adapters:
+		print(f"Adapter {adapter.name}: targets={adapter.numTargets} failures={adapter.numFailures}")
+	numFailed = sum(1 for target in targets if target.status == "failed")
+	print(f"Done in {time.perf_counter() - startTime:.2f}s, {len(targets) - numFailed} of {len(targets)} Crownstones up to date")
+
+if __name__ == '__main__':
+	try:
+		asyncio.run(main())
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+"""
+Offline asset filter simulator: evaluates serialized asset filters on recorded advertisements, like a Crownstone does.
+
+For each advertisement it calculates:
+- Which filters pass. When an exclude filter passes, no filter passes.
+- Whether a MAC report is sent: when a filter with MAC address output passes.
+- Which asset id is reported: the id of the first filter with asset id output that passes.
+
+All advertisements are evaluated at once: the AD structures are parsed, the filter input is selected, and the
+fingerprints, hashes and asset ids are calculated with numpy. So a day of scans is evaluated in seconds.
+
+Filters file: one filter per line, the filter id and the serialized filter as hex, see asset_filter_sync.writeFilters().
+
+Advertisements file: one json object per line, or an .npz file saved with saveAdvertisements(). Example:
+	{"time": 1624887723.142, "address": "60:c0:bf:27:e5:67", "rssi": -70, "payload": "0201061107..."}
+Where payload is the advertisement data (the AD structures) as hex.
+
+Usage:
+	./asset_filter_simulator.py filters.txt advertisements.jsonl [-o results.csv]
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from crownstone_core.packets.assetFilter.CuckooFilterPackets import CuckooFilterData
+from crownstone_core.packets.assetFilter.ExactMatchFilter import ExactMatchFilter
+from crownstone_core.packets.assetFilter.FilterMetaDataPackets import FilterType, FilterMetaData, FilterFlags
+from crownstone_core.packets.assetFilter.FilterOutputPackets import FilterOutputDescription, FilterOutputDescriptionType
+from crownstone_core.packets.assetFilter.InputDescriptionPackets import *
+from crownstone_core.util.BufferReader import BufferReader
+
+import asset_filter_planner
+import asset_filter_sync
+import asset_ids
+
+# Max size of the advertisement data.
+MAX_PAYLOAD_SIZE = 31
+
+# Each AD structure is at least 2 bytes.
+MAX_AD_STRUCTURES = MAX_PAYLOAD_SIZE // 2
+
+ASSET_ID_OUTPUT_TYPES = (FilterOutputDescriptionType.ASSET_ID, FilterOutputDescriptionType.ASSET_ID_NEAREST_CROWNSTONE)
+
+class SimulatedFilter:
+	def __init__(self, filterId, metaData, filterData):
+		"""
+		:param metaData:   FilterMetaData
+		:param filterData: CuckooFilterData or ExactMatchFilter
+		"""
+		self.filterId = filterId
+		self.metaData = metaData
+		self.filterData = filterData
+
+	def isExclude(self):
+		return self.metaData.flags.exclude
+
+	def getOutputType(self):
+		return self.metaData.filterOutput.outFormat
+
+	def __str__(self):
+		return f"SimulatedFilter(filterId={self.filterId} metaData={self.metaData})"
+
+def _parseInputDescription(reader):
+	inputType = reader.getUInt8()
+	if inputType == InputDescriptionType.MAC_ADDRESS:
+		return InputDescriptionMacAddress()
+	if inputType == InputDescriptionType.AD_DATA:
+		return InputDescriptionFullAdData(reader.getUInt8())
+	if inputType == InputDescriptionType.MASKED_AD_DATA:
+		adType = reader.getUInt8()
+		return InputDescriptionMaskedAdData(adType, reader.getUInt32())
+	raise ValueError(f"Unknown input description type: {inputType}")
+
+def parseFilter(filterId, data):
+	"""
+	Parses a serialized filter, as uploaded to the Crownstones.
+
+	:param data: Serialized filter, list of bytes.
+	:return:     SimulatedFilter
+	"""
+	reader = BufferReader(list(data))
+	filterType = FilterType(reader.getUInt8())
+	flags = FilterFlags(exclude=bool(reader.getUInt8() & 1))
+	profileId = reader.getUInt8()
+	filterInput = _parseInputDescription(reader)
+	outFormat = FilterOutputDescriptionType(reader.getUInt8())
+	inFormat = None
+	if outFormat in ASSET_ID_OUTPUT_TYPES:
+		inFormat = _parseInputDescription(reader)
+	metaData = FilterMetaData(filterType, filterInput, FilterOutputDescription(outFormat, inFormat), profileId, flags)
+
+	if filterType == FilterType.CUCKOO:
+		filterData = CuckooFilterData()
+		filterData.bucketCountLog2 = reader.getUInt8()
+		filterData.nestsPerBucket = reader.getUInt8()
+		filterData.victim.fingerprint = reader.getUInt16()
+		filterData.victim.bucketA = reader.getUInt8()
+		filterData.victim.bucketB = reader.getUInt8()
+		numFingerprints = (1 << filterData.bucketCountLog2) * filterData.nestsPerBucket
+		filterData.bucketArray = [reader.getUInt16() for i in range(0, numFingerprints)]
+	else:
+		filterData = ExactMatchFilter()
+		itemCount = reader.getUInt8()
+		filterData.itemSize = reader.getUInt8()
+		filterData.items = [reader.getBytes(filterData.itemSize) for i in range(0, itemCount)]
+		filterData.itemCount = itemCount
+	return SimulatedFilter(filterId, metaData, filterData)
+
+def readFilters(fileName):
+	"""
+	:return: List of SimulatedFilter, sorted by filter id.
+	"""
+	return [parseFilter(f.getFilterId(), f.serialize()) for f in asset_filter_sync.readFilters(fileName)]
+
+def makeAdvertisements(times, addresses, rssis, payloads):
+	"""
+	:param addresses: List of MAC addresses, like "12:34:56:78:AB:CD".
+	:param payloads:  List of advertisement data, as bytes.
+	:return:          Dict with the advertisements as arrays.
+	"""
+	numAdvertisements = len(addresses)
+	payloadLengths = np.fromiter((len(payload) for payload in payloads), dtype=np.int64, count=numAdvertisements)
+	if np.any(payloadLengths > MAX_PAYLOAD_SIZE):
+		raise ValueError(f"Advertisement data larger than {MAX_PAYLOAD_SIZE} bytes")
+	padded = b"".join(payload.ljust(MAX_PAYLOAD_SIZE, b"\0") for payload in payloads)
+	return {
+		"time": np.asarray(times, dtype=np.float64),
+		"mac": asset_ids.macsToBytes([address.lower() for address in addresses]) if numAdvertisements else np.zeros((0, 6), dtype=np.uint8),
+		"rssi": np.asarray(rssis, dtype=np.int8),
+		"payload": np.frombuffer(padded, dtype=np.uint8).reshape(numAdvertisements, MAX_PAYLOAD_SIZE),
+		"payloadLength": payloadLengths,
+	}
+
+def loadAdvertisements(fileName):
+	"""
+	Loads an .npz file saved with saveAdvertisements(), or reads a json advertisements file.
+	"""
+	if fileName.endswith(".npz"):
+		with np.load(fileName) as data:
+			return {key: data[key] for key in data.files}
+	times = []
+	addresses = []
+	rssis = []
+	payloads = []
+	with open(fileName, 'r') as file:
+		for line in file:
+			line = line.strip()
+			if not line:
+				continue
+			advertisement = json.loads(line)
+			times.append(advertisement["time"])
+			addresses.append(advertisement["address"])
+			rssis.append(advertisement.get("rssi", 0))
+			payloads.append(bytes.fromhex(advertisement["payload"]))
+	return makeAdvertisements(times, addresses, rssis, payloads)
+
+def saveAdvertisements(fileName, advertisements):
+	np.savez(fileName, **advertisements)
+
+def findAdData(advertisements, adType):
+	"""
+	Finds the first AD structure of the given type in each advertisement.
+
+	:return: Tuple of (start, length): index of the AD data in the payload, and its length, -1 when not found.
+	"""
+	payload = advertisements["payload"]
+	payloadLength = advertisements["payloadLength"]
+	numAdvertisements = len(payload)
+	rows = np.arange(numAdvertisements)
+	# Pad, so that the type of an AD structure at the end can always be read.
+	padded = np.zeros((numAdvertisements, MAX_PAYLOAD_SIZE + 2), dtype=np.int64)
+	padded[:, :MAX_PAYLOAD_SIZE] = payload
+	position = np.zeros(numAdvertisements, dtype=np.int64)
+	start = np.zeros(numAdvertisements, dtype=np.int64)
+	length = np.full(numAdvertisements, -1, dtype=np.int64)
+	for i in range(0, MAX_AD_STRUCTURES):
+		active = (position + 1 < payloadLength) & (length < 0)
+		if not np.any(active):
+			break
+		fieldLength = padded[rows, position]
+		fieldType = padded[rows, position + 1]
+		# A malformed AD structure ends the parsing.
+		active &= (fieldLength > 0) & (position + 1 + fieldLength <= payloadLength)
+		found = active & (fieldType == adType)
+		start[found] = position[found] + 2
+		length[found] = fieldLength[found] - 1
+		position = np.where(active, position + 1 + fieldLength, MAX_PAYLOAD_SIZE)
+	return start, length
+
+def getInputData(advertisements, inputDescription):
+	"""
+	Selects the data of each advertisement that the filter uses as input.
+
+	:return: Tuple of (data, lengths, valid): the data with shape (N, M), zero padded, the length of the data of each
+	         advertisement, and whether the advertisement has the data at all.
+	"""
+	if inputDescription.type == InputDescriptionType.MAC_ADDRESS:
+		numAdvertisements = len(advertisements["mac"])
+		return advertisements["mac"], np.full(numAdvertisements, 6), np.ones(numAdvertisements, dtype=bool)
+
+	start, length = findAdData(advertisements, inputDescription.adType)
+	valid = length >= 0
+	columns = np.arange(MAX_PAYLOAD_SIZE)
+	indices = np.minimum(start[:, np.newaxis] + columns, MAX_PAYLOAD_SIZE - 1)
+	data = np.take_along_axis(advertisements["payload"], indices, axis=1)
+	selected = columns < length[:, np.newaxis]
+
+	if inputDescription.type == InputDescriptionType.MASKED_AD_DATA:
+		# Only bytes with their bit set in the mask are used, concatenated.
+		maskBits = ((inputDescription.mask >> columns) & 1).astype(bool)
+		selected &= maskBits
+		order = np.argsort(~selected, axis=1, kind='stable')
+		data = np.take_along_axis(data, order, axis=1)
+		length = np.where(valid, np.count_nonzero(selected, axis=1), -1)
+		selected = columns < length[:, np.newaxis]
+
+	data = np.where(selected, data, 0).astype(np.uint8)
+	return data, np.maximum(length, 0), valid
+
+def _rowsAsKeys(data):
+	return np.ascontiguousarray(data, dtype=np.uint8).view(np.dtype((np.void, data.shape[1]))).ravel()
+
+def evaluateFilter(simulatedFilter, advertisements):
+	"""
+	:return: Array with for each advertisement whether it passes the filter, not taking exclude filters into account.
+	"""
+	data, lengths, valid = getInputData(advertisements, simulatedFilter.metaData.filterInput)
+	filterData = simulatedFilter.filterData
+	if simulatedFilter.metaData.type == FilterType.EXACT_MATCH:
+		itemSize = filterData.itemSize
+		if filterData.itemCount == 0 or itemSize > data.shape[1]:
+			return np.zeros(len(valid), dtype=bool)
+		items = np.array(filterData.items, dtype=np.uint8).reshape(filterData.itemCount, itemSize)
+		if itemSize == 0:
+			return valid & (lengths == 0)
+		return valid & (lengths == itemSize) & np.isin(_rowsAsKeys(data[:, :itemSize]), _rowsAsKeys(items))
+	fingerprints = asset_filter_planner.crc16(data, lengths)
+	bucketHashes = asset_filter_planner.djb2(data, lengths)
+	return valid & asset_filter_planner.cuckooContains(filterData, fingerprints, bucketHashes)
+
+def calcAssetIds(simulatedFilter, advertisements):
+	"""
+	:return: Tuple of (assetIds, valid): the asset id of each advertisement, and whether it has the data for an id.
+	"""
+	data, lengths, valid = getInputData(advertisements, simulatedFilter.metaData.filterOutput.inFormat)
+	return asset_ids.crc32(data, lengths) & np.uint32(asset_ids.ASSET_ID_MASK), valid
+
+def simulate(filters, advertisements):
+	"""
+	:param filters: List of SimulatedFilter.
+	:return:        Dict with per advertisement:
+	                  passed:   Array of shape (N, number of filters), whether each filter passed.
+	                  excluded: Whether an exclude filter passed.
+	                  macReport: Whether a MAC report is sent.
+	                  assetId:  The reported asset id, -1 for none.
+	                And filterIds: the filter id of each column of passed.
+	"""
+	numAdvertisements = len(advertisements["payload"])
+	passed = np.zeros((numAdvertisements, len(filters)), dtype=bool)
+	excluded = np.zeros(numAdvertisements, dtype=bool)
+	for column, simulatedFilter in enumerate(filters):
+		passed[:, column] = evaluateFilter(simulatedFilter, advertisements)
+		if simulatedFilter.isExclude():
+			excluded |= passed[:, column]
+	passed[excluded] = False
+	for column, simulatedFilter in enumerate(filters):
+		if simulatedFilter.isExclude():
+			passed[:, column] = False
+
+	macReport = np.zeros(numAdvertisements, dtype=bool)
+	assetId = np.full(numAdvertisements, -1, dtype=np.int64)
+	for column, simulatedFilter in enumerate(filters):
+		outputType = simulatedFilter.getOutputType()
+		if outputType == FilterOutputDescriptionType.MAC_ADDRESS:
+			macReport |= passed[:, column]
+		elif outputType in ASSET_ID_OUTPUT_TYPES:
+			ids, valid = calcAssetIds(simulatedFilter, advertisements)
+			report = passed[:, column] & valid & (assetId < 0)
+			assetId[report] = ids[report]
+
+	return {
+		"filterIds": [simulatedFilter.filterId for simulatedFilter in filters],
+		"passed": passed,
+		"excluded": excluded,
+		"macReport": macReport,
+		"assetId": assetId,
+	}
+
+def printSummary(filters, advertisements, result):
+	macKeys = _rowsAsKeys(advertisements["mac"])
+	print(f"{len(macKeys)} advertisements of {len(np.unique(macKeys))} MAC addresses")
+	for column, simulatedFilter in enumerate(filters):
+		if simulatedFilter.isExclude():
+			passedRows = evaluateFilter(simulatedFilter, advertisements)
+			description = "exclude"
+		else:
+			passedRows = result["passed"][:, column]
+			description = simulatedFilter.getOutputType().name
+		print(f"Filter {simulatedFilter.filterId:3d} {simulatedFilter.metaData.type.name:11s} {description:27s} "
+		      f"passed={np.count_nonzero(passedRows):8d} macs={len(np.unique(macKeys[passedRows])):6d}")
+	print(f"Excluded advertisements: {np.count_nonzero(result['excluded'])}")
+	print(f"MAC reports: {np.count_nonzero(result['macReport'])}")
+	assetIds = result["assetId"][result["assetId"] >= 0]
+	print(f"Asset id reports: {len(assetIds)} of {len(np.unique(assetIds))} ids")
+
+def writeResults(fileName, advertisements, result):
+	# Format each MAC address only once.
+	uniqueMacs, macIndices = np.unique(_rowsAsKeys(advertisements["mac"]), return_inverse=True)
+	addresses = [":".join("{:02X}".format(b) for b in reversed(bytes(mac))) for mac in uniqueMacs]
+	with open(fileName, 'w') as file:
+		file.write("time,address,rssi,passedFilterIds,macReport,assetId\n")
+		filterIds = np.array(result["filterIds"])
+		for i in range(0, len(advertisements["payload"])):
+			address = addresses[macIndices[i]]
+			passedFilterIds = " ".join(str(filterId) for filterId in filterIds[result["passed"][i]])
+			file.write(f"{advertisements['time'][i]},{address},{advertisements['rssi'][i]},{passedFilterIds},"
+			           f"{int(result['macReport'][i])},{result['assetId'][i]}\n")
+
+def main():
+	parser = argparse.ArgumentParser(description='Evaluate asset filters on recorded advertisements')
+	parser.add_argument('-o', '--output', dest='outputFile', default=None,
+			help='Write the result of each advertisement to this csv file')
+	parser.add_argument('filtersFile',
+			help='File with one filter per line: the filter id and the serialized filter as hex')
+	parser.add_argument('advertisementsFile',
+			help='File with one json advertisement per line, or an .npz file')
+	args = parser.parse_args()
+
+	filters = readFilters(args.filtersFile)
+	advertisements = loadAdvertisements(args.advertisementsFile)
+	result = simulate(filters, advertisements)
+	printSummary(filters, advertisements, result)
+	if args.outputFile is not None:
+		writeResults(args.outputFile, advertisements, result)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+Incremental asset filter upload: only filters that changed are uploaded, and only filters that are no longer wanted
+are removed, followed by a single commit.
+
+The filter summaries are fetched from the Crownstone, and the CRC of each filter is compared with the CRC of the
+desired filter locally. The number of commands, the bytes sent and received, and the time of each step are recorded.
+
+The control can be uart.control, ble.control, or a MockFilterEndpoint. The mock keeps the filters like a Crownstone
+does: it assembles the uploaded chunks, checks the master CRC on commit, and counts the bytes it receives. Run this
+file to compare an incremental sync with removing and uploading all filters, on the mock.
+
+Usage:
+	./asset_filter_sync.py [-n 8] [-c 1] [-b 11520]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from crownstone_core.Exceptions import CrownstoneException, CrownstoneError
+from crownstone_core.packets.assetFilter.FilterCommandPackets import FilterSummariesPacket, FilterSummaryPacket
+from crownstone_core.packets.assetFilter.builders.AssetFilter import AssetFilter
+from crownstone_core.packets.assetFilter.util import AssetFilterMasterCrc
+from crownstone_core.packets.assetFilter.util.AssetFilterChunker import FilterChunker
+from crownstone_core.packets.assetFilter.util.AssetFilterSyncer import AssetFilterSyncer
+from crownstone_core.protocol.ControlPackets import ControlPacketsGenerator
+from crownstone_core.util.BufferReader import BufferReader
+from crownstone_core.util.CRC import crc32
+
+# Chunk size used by the libs to upload a filter.
+UPLOAD_CHUNK_SIZE = 128
+
+# Size of the filter summaries, and of the summary of each filter.
+SUMMARIES_HEADER_SIZE = 1 + 2 + 4 + 2
+SUMMARY_SIZE = 1 + 4
+
+class SerializedFilter:
+	"""
+	A filter that is already serialized, can be used instead of an AssetFilter by the libs.
+	"""
+	def __init__(self, filterId, data):
+		self.filterId = filterId
+		self.data = list(data)
+		self.crc = crc32(self.data)
+
+	def getFilterId(self):
+		return self.filterId
+
+	def getCrc(self):
+		return self.crc
+
+	def serialize(self):
+		return self.data
+
+class SyncStats:
+	def __init__(self):
+		self.uploadIds = []
+		self.removeIds = []
+		self.unchangedIds = []
+		self.commandCount = 0
+		self.bytesSent = 0
+		self.bytesReceived = 0
+		self.masterVersion = None
+		# Duration in seconds per step.
+		self.durations = {}
+
+	def addCommand(self, packet):
+		self.commandCount += 1
+		self.bytesSent += len(packet)
+
+	def __str__(self):
+		durations = " ".join(f"{step}={duration * 1000:.1f}ms" for step, duration in self.durations.items())
+		return f"uploaded={self.uploadIds} removed={self.removeIds} unchanged={self.unchangedIds} " \
+		       f"masterVersion={self.masterVersion} commands={self.commandCount} " \
+		       f"bytesSent={self.bytesSent} bytesReceived={self.bytesReceived} {durations}"
+
+def writeFilters(fileName, filters):
+	"""
+	Writes AssetFilter or SerializedFilter objects to a filters file.
+	"""
+	with open(fileName, 'w') as file:
+		for assetFilter in filters:
+			file.write(f"{assetFilter.getFilterId()} {bytes(assetFilter.serialize()).hex()}\n")
+
+def readFilters(fileName):
+	"""
+	Reads a filters file: one filter per line, the filter id and the serialized filter as hex.
+
+	:return: List of SerializedFilter, sorted by filter id.
+	"""
+	filters = []
+	with open(fileName, 'r') as file:
+		for line in file:
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			filterId, data = line.split()
+			filters.append(SerializedFilter(int(filterId), bytes.fromhex(data)))
+	filters.sort(key=lambda f: f.getFilterId())
+	return filters
+
+def getUploadPackets(assetFilter):
+	"""
+	:return: List of control packets, as the libs send them to upload the filter.
+	"""
+	chunker = FilterChunker(assetFilter, UPLOAD_CHUNK_SIZE)
+	return [ControlPacketsGenerator.getUploadFilterPacket(chunker.getChunk()) for i in range(0, chunker.getAmountOfChunks())]
+
+def getCommitPacket(masterVersion, filters):
+	return ControlPacketsGenerator.getCommitFilterChangesPacket(masterVersion, AssetFilterMasterCrc.get_master_crc_from_filters(filters))
+
+async def syncFilters(control, filters, masterVersion=None):
+	"""
+	Makes sure the given filters, and only those, are on the Crownstone.
+
+	:param control:       uart.control, ble.control, or a MockFilterEndpoint.
+	:param filters:       List of AssetFilter or SerializedFilter.
+	:param masterVersion: The new master version. If None, the master version will be increased by 1 when anything changed.
+	:return:              SyncStats
+	"""
+	stats = SyncStats()
+	startTime = time.perf_counter()
+
+	stepTime = time.perf_counter()
+	summaries = await control.getFilterSummaries()
+	stats.addCommand(ControlPacketsGenerator.getGetFilterSummariesPacket())
+	stats.bytesReceived += SUMMARIES_HEADER_SIZE + SUMMARY_SIZE * len(summaries.summaries)
+	stats.durations["summaries"] = time.perf_counter() - stepTime
+
+	syncer = AssetFilterSyncer(summaries, filters, masterVersion)
+	stats.uploadIds = sorted(syncer.uploadIds)
+	stats.removeIds = sorted(syncer.removeIds)
+	stats.unchangedIds = sorted(f.getFilterId() for f in filters if f.getFilterId() not in syncer.uploadIds)
+	stats.masterVersion = syncer.masterVersion
+	if not syncer.commitRequired:
+		stats.durations["total"] = time.perf_counter() - startTime
+		return stats
+
+	stepTime = time.perf_counter()
+	for filterId in stats.removeIds:
+		await control.removeFilter(filterId)
+		stats.addCommand(ControlPacketsGenerator.getRemoveFilterPacket(filterId))
+	stats.durations["remove"] = time.perf_counter() - stepTime
+
+	stepTime = time.perf_counter()
+	for assetFilter in filters:
+		if assetFilter.getFilterId() in syncer.uploadIds:
+			await control.uploadFilter(assetFilter)
+			for packet in getUploadPackets(assetFilter):
+				stats.addCommand(packet)
+	stats.durations["upload"] = time.perf_counter() - stepTime
+
+	stepTime = time.perf_counter()
+	await control.commitFilterChanges(syncer.masterVersion, filters)
+	stats.addCommand(getCommitPacket(syncer.masterVersion, filters))
+	stats.durations["commit"] = time.perf_counter() - stepTime
+
+	stats.durations["total"] = time.perf_counter() - startTime
+	return stats
+
+async def replaceFilters(control, filters):
+	"""
+	Removes all filters, and uploads all given filters, like asset-filter-example-mac.py used to do.
+	Only used to compare with syncFilters().
+
+	:return: SyncStats
+	"""
+	stats = SyncStats()
+	startTime = time.perf_counter()
+	summaries = await control.getFilterSummaries()
+	stats.addCommand(ControlPacketsGenerator.getGetFilterSummariesPacket())
+	stats.bytesReceived += SUMMARIES_HEADER_SIZE + SUMMARY_SIZE * len(summaries.summaries)
+	masterVersion = summaries.masterVersion + 1
+	for summary in summaries.summaries:
+		await control.removeFilter(summary.id)
+		stats.addCommand(ControlPacketsGenerator.getRemoveFilterPacket(summary.id))
+		stats.removeIds.append(summary.id)
+	await control.commitFilterChanges(masterVersion, [])
+	stats.addCommand(getCommitPacket(masterVersion, []))
+
+	masterVersion += 1
+	for assetFilter in filters:
+		await control.uploadFilter(assetFilter)
+		for packet in getUploadPackets(assetFilter):
+			stats.addCommand(packet)
+		stats.uploadIds.append(assetFilter.getFilterId())
+	await control.commitFilterChanges(masterVersion, filters)
+	stats.addCommand(getCommitPacket(masterVersion, filters))
+	stats.masterVersion = masterVersion
+	stats.durations["total"] = time.perf_counter() - startTime
+	return stats
+
+class MockFilterEndpoint:
+	"""
+	Stand in for uart.control, that keeps the filters like a Crownstone.
+	"""
+	def __init__(self, capacity=1024, bytesPerSecond=None, commandDelay=0.0, onCommit=None):
+		"""
+		:param capacity:       Number of bytes available for filters.
+		:param bytesPerSecond: Emulated transfer speed, None for no delay.
+		:param commandDelay:   Emulated time in seconds it takes the Crownstone to handle a command.
+		:param onCommit:       Function that is called with this endpoint, after changes are committed.
+		"""
+		self.capacity = capacity
+		self.bytesPerSecond = bytesPerSecond
+		self.commandDelay = commandDelay
+		self.onCommit = onCommit
+		# Committed filters: filter id -> serialized filter.
+		self.filters = {}
+		self.masterVersion = 0
+		self.masterCrc = AssetFilterMasterCrc.get_master_crc_from_filter_crcs([])
+		# Changes that are not committed yet.
+		self.pendingFilters = None
+		self.uploadBuffers = {}
+		self.commandCount = 0
+		self.bytesReceived = 0
+		self.bytesSent = 0
+
+	async def _receive(self, packet):
+		self.commandCount += 1
+		self.bytesReceived += len(packet)
+		delay = self.commandDelay
+		if self.bytesPerSecond:
+			delay += len(packet) / self.bytesPerSecond
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+	def _getPendingFilters(self):
+		if self.pendingFilters is None:
+			self.pendingFilters = dict(self.filters)
+		return self.pendingFilters
+
+	def getFreeSpace(self):
+		return self.capacity - sum(len(data) for data in self.filters.values())
+
+	async def getFilterSummaries(self):
+		await self._receive(ControlPacketsGenerator.getGetFilterSummariesPacket())
+		summaries = FilterSummariesPacket()
+		summaries.masterVersion = self.masterVersion
+		summaries.masterCrc = self.masterCrc
+		summaries.freeSpace = self.getFreeSpace()
+		for filterId in sorted(self.filters.keys()):
+			summary = FilterSummaryPacket()
+			summary.id = filterId
+			summary.crc = crc32(self.filters[filterId])
+			summaries.summaries.append(summary)
+		self.bytesSent += SUMMARIES_HEADER_SIZE + SUMMARY_SIZE * len(summaries.summaries)
+		return summaries
+
+	async def uploadFilter(self, assetFilter):
+		chunker = FilterChunker(assetFilter, UPLOAD_CHUNK_SIZE)
+		for i in range(0, chunker.getAmountOfChunks()):
+			chunkPacket = chunker.getChunk()
+			await self._receive(ControlPacketsGenerator.getUploadFilterPacket(chunkPacket))
+			reader = BufferReader(chunkPacket)
+			reader.getUInt8()
+			filterId = reader.getUInt8()
+			chunkStartIndex = reader.getUInt16()
+			totalSize = reader.getUInt16()
+			chunkSize = reader.getUInt16()
+			chunk = reader.getBytes(chunkSize)
+			buffer = self.uploadBuffers.setdefault(filterId, [None] * totalSize)
+			if len(buffer) != totalSize or chunkStartIndex + chunkSize > totalSize:
+				raise CrownstoneException(CrownstoneError.INVALID_SIZE, f"Chunk does not fit filter {filterId}")
+			buffer[chunkStartIndex:chunkStartIndex + chunkSize] = chunk
+			if None not in buffer:
+				pendingFilters = self._getPendingFilters()
+				usedSpace = sum(len(data) for otherId, data in pendingFilters.items() if otherId != filterId)
+				if usedSpace + totalSize > self.capacity:
+					raise CrownstoneException(CrownstoneError.INVALID_SIZE, f"No space for filter {filterId}")
+				pendingFilters[filterId] = buffer
+				del self.uploadBuffers[filterId]
+
+	async def removeFilter(self, filterId):
+		await self._receive(ControlPacketsGenerator.getRemoveFilterPacket(filterId))
+		self._getPendingFilters().pop(filterId, None)
+
+	async def commitFilterChanges(self, masterVersion, filters, filterSummaries=None):
+		masterCrc = AssetFilterMasterCrc.get_master_crc_from_filters(filters, filterSummaries)
+		await self._receive(ControlPacketsGenerator.getCommitFilterChangesPacket(masterVersion, masterCrc))
+		pendingFilters = self._getPendingFilters()
+		expectedCrc = AssetFilterMasterCrc.get_master_crc_from_filter_crcs(
+				[[filterId, crc32(data)] for filterId, data in pendingFilters.items()])
+		if masterCrc != expectedCrc:
+			raise CrownstoneException(CrownstoneError.INVALID_INPUT, f"Master CRC mismatch: {masterCrc} != {expectedCrc}")
+		if masterVersion <= self.masterVersion:
+			raise CrownstoneException(CrownstoneError.INVALID_INPUT, f"Master version {masterVersion} is not higher than {self.masterVersion}")
+		self.filters = pendingFilters
+		self.pendingFilters = None
+		self.masterVersion = masterVersion
+		self.masterCrc = masterCrc
+		if self.onCommit is not None:
+			self.onCommit(self)
+
+def getRandomFilters(numFilters, numMacs, seed=None):
+	"""
+	:return: List of MAC address filters with random MAC addresses.
+	"""
+	rng = random.Random(seed)
+	filters = []
+	for filterId in range(0, numFilters):
+		macs = [":".join("{:02X}".format(rng.randrange(256)) for i in range(0, 6)) for j in range(0, numMacs)]
+		filters.append(AssetFilter(filterId).filterByMacAddress(macs).outputMacRssiReport())
+	return filters
+
+async def compare(numFilters, numChanged, bytesPerSecond):
+	filters = getRandomFilters(numFilters, 10, seed=0)
+	for name, method in [("Replace all", replaceFilters), ("Incremental", syncFilters)]:
+		endpoint = MockFilterEndpoint(capacity=4096, bytesPerSecond=bytesPerSecond)
+		await syncFilters(endpoint, filters)
+		# Change some filters, and add a new one.
+		changed = getRandomFilters(numFilters + 1, 10, seed=1)
+		newFilters = [changed[i] if i < numChanged or i == numFilters else filters[i] for i in range(0, numFilters + 1)]
+		endpoint.bytesReceived = 0
+		stats = await method(endpoint, newFilters)
+		expectedCrcs = {f.getFilterId(): f.getCrc() for f in newFilters}
+		storedCrcs = {filterId: crc32(data) for filterId, data in endpoint.filters.items()}
+		print(f"{name}: {stats}")
+		print(f"    mock received {endpoint.bytesReceived} bytes, filters match: {expectedCrcs == storedCrcs}")
+
+def main():
+	parser = argparse.ArgumentParser(description='Compare incremental filter upload with replacing all filters, on a mock Crownstone')
+	parser.add_argument('-n', '--numFilters', dest='numFilters', type=int, default=8,
+			help='Number of filters on the Crownstone')
+	parser.add_argument('-c', '--numChanged', dest='numChanged', type=int, default=1,
+			help='Number of filters that change')
+	parser.add_argument('-b', '--bytesPerSecond', dest='bytesPerSecond', type=float, default=11520,
+			help='Emulated transfer speed, 0 for none')
+	args = parser.parse_args()
+	asyncio.run(compare(args.numFilters, args.numChanged, args.bytesPerSecond or None))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Calculates the 24 bit asset ids of MAC addresses, and analyses id collisions.
+
+The asset id of a MAC address is the CRC32 of the address bytes (in reversed order, as the firmware has them),
+truncated to 24 bits. Different MAC addresses can have the same id, in which case they can't be distinguished in
+asset id reports. This tool reports the collisions of a set of MAC addresses, and the probability of collisions
+for a number of assets, so that deployments can be sized.
+
+Usage:
+	./asset_ids.py macs.txt [-o ids.csv] [-p 0.01]
+
+The input file has one MAC address per line, lines starting with # are ignored.
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+ASSET_ID_BITS = 24
+ASSET_ID_MASK = (1 << ASSET_ID_BITS) - 1
+
+# Table of the standard (reflected, polynomial 0xEDB88320) CRC32, as used by the firmware.
+def _makeCrc32Table():
+	table = np.arange(256, dtype=np.uint32)
+	for i in range(0, 8):
+		table = np.where(table & 1, (table >> 1) ^ np.uint32(0xEDB88320), table >> 1).astype(np.uint32)
+	return table
+
+CRC32_TABLE = _makeCrc32Table()
+
+def readMacs(fileName):
+	"""
+	:return: List of MAC addresses in lower case, in order of the file, including duplicates.
+	"""
+	macs = []
+	with open(fileName, 'r') as file:
+		for line in file:
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			macs.append(line.lower())
+	return macs
+
+def macsToBytes(macs):
+	"""
+	:return: Array of shape (len(macs), 6) with the bytes of each MAC address in reversed order, like
+	         Conversion.address_to_uint8_array().
+	"""
+	hexString = "".join(mac.replace(":", "") for mac in macs)
+	macBytes = np.frombuffer(bytes.fromhex(hexString), dtype=np.uint8).reshape(len(macs), 6)
+	return macBytes[:, ::-1]
+
+def crc32(data, lengths=None):
+	"""
+	Table driven CRC32 of all rows at once.
+
+	:param data:    Array of bytes, shape (N, M).
+	:param lengths: Number of bytes of each row to use, shape (N,). None to use all bytes.
+	:return:        Array with the CRC32 of each row, shape (N,).
+	"""
+	crc = np.full(data.shape[0], 0xFFFFFFFF, dtype=np.uint32)
+	for column in range(0, data.shape[1]):
+		updated = CRC32_TABLE[(crc ^ data[:, column]) & 0xFF] ^ (crc >> 8)
+		crc = updated if lengths is None else np.where(column < lengths, updated, crc)
+	return crc ^ np.uint32(0xFFFFFFFF)
+
+def calcAssetIds(macs):
+	"""
+	:return: Array with the asset id of each MAC address.
+	"""
+	if len(macs) == 0:
+		return np.zeros(0, dtype=np.uint32)
+	return crc32(macsToBytes(macs)) & np.uint32(ASSET_ID_MASK)
+
+def getAssetIdMap(macs):
+	"""
+	:return: Dict with MAC address as key, and asset id as value.
+	"""
+	uniqueMacs = sorted(set(macs))
+	return dict(zip(uniqueMacs, calcAssetIds(uniqueMacs).tolist()))
+
+def findCollisions(assetIdMap):
+	"""
+	:return: Dict with asset id as key, and sorted list of the MAC addresses with that id as value,
+	         only for ids that are shared by multiple MAC addresses.
+	"""
+	macs = np.array(list(assetIdMap.keys()))
+	ids = np.array(list(assetIdMap.values()), dtype=np.uint32)
+	uniqueIds, counts = np.unique(ids, return_counts=True)
+	collisions = {}
+	collidingIds = uniqueIds[counts > 1]
+	mask = np.isin(ids, collidingIds)
+	for mac, assetId in zip(macs[mask], ids[mask]):
+		collisions.setdefault(int(assetId), []).append(str(mac))
+	for assetId in collisions:
+		collisions[assetId].sort()
+	return collisions
+
+def collisionProbability(numAssets, bits=ASSET_ID_BITS):
+	"""
+	:return: Probability that at least 2 of numAssets random MAC addresses have the same id (birthday problem).
+	"""
+	numIds = 2.0 ** bits
+	return -math.expm1(-numAssets * (numAssets - 1) / (2 * numIds))
+
+def expectedCollidingAssets(numAssets, bits=ASSET_ID_BITS):
+	"""
+	:return: Expected number of assets that share their id with at least one other asset.
+	"""
+	numIds = 2.0 ** bits
+	return numAssets * -math.expm1((numAssets - 1) * math.log1p(-1 / numIds))
+
+def maxAssetsForProbability(probability, bits=ASSET_ID_BITS):
+	"""
+	:return: Max number of assets, for which the probability of any collision is at most the given probability.
+	"""
+	numIds = 2.0 ** bits
+	return int(math.floor(0.5 + math.sqrt(0.25 - 2 * numIds * math.log1p(-probability))))
+
+def main():
+	parser = argparse.ArgumentParser(description='Calculate asset ids of MAC addresses, and analyse collisions')
+	parser.add_argument('-o', '--output', dest='outputFile', default=None,
+			help='Write the MAC addresses and their asset ids to this csv file')
+	parser.add_argument('-p', '--probability', dest='probability', type=float, default=0.01,
+			help='Print the max number of assets for which the collision probability is at most this')
+	parser.add_argument('fileName',
+			help='File with one MAC address per line')
+	args = parser.parse_args()
+
+	macs = readMacs(args.fileName)
+	assetIdMap = getAssetIdMap(macs)
+	numAssets = len(assetIdMap)
+	print(f"{len(macs)} MAC addresses, {numAssets} unique")
+
+	collisions = findCollisions(assetIdMap)
+	for assetId, collidingMacs in sorted(collisions.items()):
+		print(f"Collision: id={assetId:06X} macs={' '.join(collidingMacs)}")
+	numColliding = sum(len(collidingMacs) for collidingMacs in collisions.values())
+	print(f"{len(collisions)} ids shared by {numColliding} MAC addresses")
+	print(f"Expected for {numAssets} random MAC addresses: "
+	      f"probability of any collision={collisionProbability(numAssets):.4g}, "
+	      f"assets sharing an id={expectedCollidingAssets(numAssets):.4g}")
+	print(f"Max number of assets for a collision probability of at most {args.probability}: "
+	      f"{maxAssetsForProbability(args.probability)}")
+
+	if args.outputFile is not None:
+		with open(args.outputFile, 'w') as outputFile:
+			outputFile.write("mac,assetId\n")
+			for mac, assetId in assetIdMap.items():
+				outputFile.write(f"{mac},{assetId}\n")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+Statistics of the time between scans of assets, for all (stone, asset) pairs at once.
+
+Works on the sorted columns of an AssetReportStore (see asset_report_store.py): the time between scans is a single
+np.diff over all reports, and statistics per group are calculated on arrays sorted by group.
+
+Usage:
+	./asset_interval_stats.py log.txt|store.npz [expected scan interval in seconds]
+"""
+
+import sys
+
+import numpy as np
+
+import asset_report_store
+
+# Times between scans above this are considered outliers, and are clipped.
+MAX_DELTA_TIME = 3600
+
+# Percentiles that are calculated by default.
+DEFAULT_PERCENTILES = (0, 5, 25, 50, 75, 95, 100)
+
+# Default histogram bin edges in seconds.
+DEFAULT_BIN_EDGES = (0, 1, 2, 5, 10, 30, 60, 300, MAX_DELTA_TIME)
+
+def calcDeltaTimes(store, maxDeltaTime=MAX_DELTA_TIME):
+	"""
+	:return: Array with, for each report, the time in seconds since the previous report of the same (stone, asset) pair.
+	         NaN for the first report of each pair. Values are clipped to maxDeltaTime.
+	"""
+	deltaTimes = np.empty(len(store))
+	if len(store) == 0:
+		return deltaTimes
+	deltaTimes[1:] = np.diff(store.time) / 1000.0
+	deltaTimes[store.pairStarts] = np.nan
+	np.minimum(deltaTimes, maxDeltaTime, out=deltaTimes)
+	return deltaTimes
+
+def groupPercentiles(groups, values, numGroups, percentiles):
+	"""
+	Calculates percentiles of values per group, with linear interpolation like np.percentile.
+
+	:param groups:      Group index of each value.
+	:param values:      Values, without NaN.
+	:param numGroups:   Number of groups.
+	:param percentiles: List of percentiles, in the range [0, 100].
+	:return:            Tuple of (counts, percentiles), with shapes (numGroups,) and (numGroups, len(percentiles)).
+	                    Percentiles of empty groups are NaN.
+	"""
+	order = np.lexsort((values, groups))
+	sortedValues = values[order]
+	counts = np.bincount(groups, minlength=numGroups)
+	starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+	result = np.full((numGroups, len(percentiles)), np.nan)
+	nonEmpty = counts > 0
+	for column, percentile in enumerate(percentiles):
+		position = percentile / 100.0 * (counts[nonEmpty] - 1)
+		lower = np.floor(position).astype(np.int64)
+		upper = np.minimum(lower + 1, counts[nonEmpty] - 1)
+		fraction = position - lower
+		lowerValues = sortedValues[starts[nonEmpty] + lower]
+		upperValues = sortedValues[starts[nonEmpty] + upper]
+		result[nonEmpty, column] = lowerValues + (upperValues - lowerValues) * fraction
+	return counts, result
+
+def groupHistograms(groups, values, numGroups, binEdges):
+	"""
+	:return: Counts per group per bin, shape (numGroups, len(binEdges) - 1).
+	         Values outside the bin edges are counted in the first or last bin.
+	"""
+	numBins = len(binEdges) - 1
+	bins = np.clip(np.searchsorted(binEdges, values, side='right') - 1, 0, numBins - 1)
+	return np.bincount(groups * numBins + bins, minlength=numGroups * numBins).reshape(numGroups, numBins)
+
+def groupMissRates(groups, values, numGroups, expectedInterval):
+	"""
+	Estimates the fraction of missed scans per group: a time between scans of N expected intervals means N - 1 misses.
+
+	:return: Miss rate per group, NaN for empty groups.
+	"""
+	expectedScans = np.maximum(np.round(values / expectedInterval), 1)
+	missed = np.bincount(groups, weights=expectedScans - 1, minlength=numGroups)
+	total = np.bincount(groups, weights=expectedScans, minlength=numGroups)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return missed / total
+
+def calcGroupStats(groups, values, numGroups, expectedInterval=None, percentiles=DEFAULT_PERCENTILES, binEdges=DEFAULT_BIN_EDGES):
+	"""
+	:return: Dict with count, percentiles, histogram, and missRate (when an expected interval is given) per group.
+	"""
+	counts, percentileValues = groupPercentiles(groups, values, numGroups, percentiles)
+	stats = {
+		"count": counts,
+		"percentiles": percentileValues,
+		"percentileLevels": np.array(percentiles),
+		"histogram": groupHistograms(groups, values, numGroups, np.array(binEdges)),
+		"binEdges": np.array(binEdges),
+	}
+	if expectedInterval is not None:
+		stats["missRate"] = groupMissRates(groups, values, numGroups, expectedInterval)
+	return stats
+
+def _getValidDeltas(store, maxDeltaTime):
+	deltaTimes = calcDeltaTimes(store, maxDeltaTime)
+	valid = ~np.isnan(deltaTimes)
+	return deltaTimes, valid
+
+def calcPairStats(store, expectedInterval=None, maxDeltaTime=MAX_DELTA_TIME, **kwargs):
+	"""
+	Statistics of the time between scans per (stone, asset) pair, in the order of store.pairStone and store.pairAsset.
+	"""
+	deltaTimes, valid = _getValidDeltas(store, maxDeltaTime)
+	pairOfReport = np.repeat(np.arange(store.getNumPairs()), store.pairEnds - store.pairStarts)
+	stats = calcGroupStats(pairOfReport[valid], deltaTimes[valid], store.getNumPairs(), expectedInterval, **kwargs)
+	stats["stone"] = store.pairStone
+	stats["asset"] = store.pairAsset
+	return stats
+
+def calcStoneStats(store, expectedInterval=None, maxDeltaTime=MAX_DELTA_TIME, **kwargs):
+	"""
+	Statistics of the time between scans per stone, of all assets combined, in the order of stones.
+	"""
+	deltaTimes, valid = _getValidDeltas(store, maxDeltaTime)
+	stones, stoneOfReport = np.unique(store.stone, return_inverse=True)
+	stats = calcGroupStats(stoneOfReport[valid], deltaTimes[valid], len(stones), expectedInterval, **kwargs)
+	stats["stone"] = stones
+	return stats
+
+def getBoxStats(stats, index, label):
+	"""
+	:return: Dict for matplotlib's Axes.bxp(): a box from the 25th to 75th percentile, and whiskers at the 5th and 95th.
+	"""
+	levels = list(stats["percentileLevels"])
+	row = stats["percentiles"][index]
+	return {
+		"label": label,
+		"med": row[levels.index(50)],
+		"q1": row[levels.index(25)],
+		"q3": row[levels.index(75)],
+		"whislo": row[levels.index(5)],
+		"whishi": row[levels.index(95)],
+		"fliers": [row[levels.index(0)], row[levels.index(100)]],
+	}
+
+def printPairStats(stats):
+	levels = stats["percentileLevels"]
+	print("stone  asset              count " + " ".join("{:>7}".format("p" + str(level)) for level in levels) +
+	      ("   miss" if "missRate" in stats else ""))
+	for i in range(0, len(stats["count"])):
+		line = "{:5d}  {:17s} {:6d} ".format(int(stats["stone"][i]), asset_report_store.assetName(stats["asset"][i]), stats["count"][i])
+		line += " ".join("{:7.1f}".format(value) for value in stats["percentiles"][i])
+		if "missRate" in stats:
+			line += " {:6.1f}%".format(stats["missRate"][i] * 100)
+		print(line)
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print("Usage:", sys.argv[0], "log.txt|store.npz [expected scan interval in seconds]")
+		exit(1)
+	store = asset_report_store.loadOrIngest(sys.argv[1])
+	expectedInterval = float(sys.argv[2]) if len(sys.argv) > 2 else None
+	stats = calcPairStats(store, expectedInterval)
+	printPairStats(stats)
+	numWithoutIntervals = np.count_nonzero(stats["count"] == 0)
+	if numWithoutIntervals:
+		print(numWithoutIntervals, "pairs have no time between scans: they have a single report, or only outliers")
@@ -0,0 +1,164 @@
+"""
+Live statistics of asset reports, for as long as the monitor runs.
+
+Reports are kept up per (asset, filter, stone) slot, in preallocated arrays:
+- The number of reports, and the time of the last report.
+- The last WINDOW_SIZE times between reports, in a ring per slot, for a rolling median and percentiles.
+So memory use doesn't grow with the number of reports, and each report is handled in constant time.
+
+Asset id reports are mapped back to a MAC address with a precomputed reverse map, instead of a scan over all assets.
+
+The statistics can be printed as table, or served as JSON over HTTP.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import numpy as np
+
+# Number of times between reports kept per slot.
+WINDOW_SIZE = 32
+
+# Default max number of (asset, filter, stone) slots.
+DEFAULT_MAX_SLOTS = 16384
+
+class AssetMonitor:
+	def __init__(self, assetIds, maxSlots=DEFAULT_MAX_SLOTS):
+		"""
+		:param assetIds: Dict with MAC address as key, and asset id as value.
+		:param maxSlots: Max number of (asset, filter, stone) combinations, reports of more combinations are only counted.
+		"""
+		# Reverse map, an id can belong to multiple MAC addresses when there is a collision.
+		self.macsById = {}
+		for mac, assetId in assetIds.items():
+			self.macsById.setdefault(assetId, []).append(mac)
+		self.maxSlots = maxSlots
+		self.slots = {}
+		self.slotKeys = []
+		self.counts = np.zeros(maxSlots, dtype=np.int64)
+		self.lastTimes = np.zeros(maxSlots)
+		self.intervals = np.full((maxSlots, WINDOW_SIZE), np.nan)
+		self.numReports = 0
+		self.numUnknownIds = 0
+		self.numDropped = 0
+		self.startTime = time.time()
+		# Reports arrive on the UART thread, while the statistics are read by another thread.
+		self.lock = threading.Lock()
+
+	def getMacs(self, assetId):
+		"""
+		:return: List of MAC addresses with this asset id, empty when unknown.
+		"""
+		return self.macsById.get(assetId, [])
+
+	def addReport(self, mac, filterId, stoneId, timestamp=None):
+		if timestamp is None:
+			timestamp = time.time()
+		key = (mac, filterId, stoneId)
+		with self.lock:
+			self.numReports += 1
+			slot = self.slots.get(key)
+			if slot is None:
+				if len(self.slotKeys) >= self.maxSlots:
+					self.numDropped += 1
+					return
+				slot = len(self.slotKeys)
+				self.slots[key] = slot
+				self.slotKeys.append(key)
+			count = self.counts[slot]
+			if count > 0:
+				self.intervals[slot, (count - 1) % WINDOW_SIZE] = timestamp - self.lastTimes[slot]
+			self.counts[slot] = count + 1
+			self.lastTimes[slot] = timestamp
+
+	def addIdReport(self, assetId, filterIds, stoneId, timestamp=None):
+		"""
+		:return: List of MAC addresses the id was mapped to.
+		"""
+		macs = self.getMacs(assetId)
+		if not macs:
+			with self.lock:
+				self.numUnknownIds += 1
+			return macs
+		for mac in macs:
+			for filterId in filterIds:
+				self.addReport(mac, filterId, stoneId, timestamp)
+		return macs
+
+	def getStats(self):
+		"""
+		:return: List of dicts with the statistics per (asset, filter, stone), sorted by key.
+		"""
+		with self.lock:
+			numSlots = len(self.slotKeys)
+			keys = list(self.slotKeys)
+			counts = self.counts[:numSlots].copy()
+			lastTimes = self.lastTimes[:numSlots].copy()
+			intervals = self.intervals[:numSlots].copy()
+		now = time.time()
+		stats = []
+		if numSlots == 0:
+			return stats
+		hasIntervals = ~np.all(np.isnan(intervals), axis=1)
+		percentiles = np.full((numSlots, 3), np.nan)
+		if np.any(hasIntervals):
+			percentiles[hasIntervals] = np.nanpercentile(intervals[hasIntervals], [5, 50, 95], axis=1).T
+		for slot in sorted(range(0, numSlots), key=lambda i: keys[i]):
+			mac, filterId, stoneId = keys[slot]
+			stats.append({
+				"mac": mac,
+				"filterId": filterId,
+				"stoneId": stoneId,
+				"count": int(counts[slot]),
+				"lastSeen": round(now - lastTimes[slot], 3),
+				"p5": None if np.isnan(percentiles[slot, 0]) else round(percentiles[slot, 0], 3),
+				"median": None if np.isnan(percentiles[slot, 1]) else round(percentiles[slot, 1], 3),
+				"p95": None if np.isnan(percentiles[slot, 2]) else round(percentiles[slot, 2], 3),
+			})
+		return stats
+
+	def getSummary(self):
+		with self.lock:
+			elapsed = max(time.time() - self.startTime, 1e-9)
+			return {
+				"reports": self.numReports,
+				"reportsPerSecond": round(self.numReports / elapsed, 2),
+				"unknownIds": self.numUnknownIds,
+				"dropped": self.numDropped,
+				"slots": len(self.slotKeys),
+			}
+
+	def printTable(self):
+		summary = self.getSummary()
+		print(f"reports={summary['reports']} rate={summary['reportsPerSecond']}/s unknownIds={summary['unknownIds']} "
+		      f"dropped={summary['dropped']} slots={summary['slots']}")
+		print(f"{'MAC':17s} {'filter':>6s} {'stone':>5s} {'count':>7s} {'last':>8s} {'p5':>8s} {'median':>8s} {'p95':>8s}")
+		for row in self.getStats():
+			values = " ".join("{:8s}".format("-") if row[key] is None else "{:8.2f}".format(row[key]) for key in ["lastSeen", "p5", "median", "p95"])
+			print(f"{row['mac']:17s} {row['filterId']:6d} {row['stoneId']:5d} {row['count']:7d} {values}")
+
+	def serveJson(self, port):
+		"""
+		Serves the statistics as JSON on http://localhost:<port>/ in a background thread.
+
+		:return: The server, call shutdown() to stop it.
+		"""
+		monitor = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = json.dumps({"summary": monitor.getSummary(), "stats": monitor.getStats()}).encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		server = ThreadingHTTPServer(("", port), Handler)
+		threading.Thread(target=server.serve_forever, name="assetMonitorServer", daemon=True).start()
+		return server
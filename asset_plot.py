@@ -0,0 +1,291 @@
+"""
+Plots of the time between scans of assets, shared by asset-log-parser.py and asset-bluenet-log-parser.py
+
+The boxplots are drawn from statistics calculated by asset_interval_stats.py, instead of from all times between scans.
+
+For large sites, writeReport() renders paged summary figures to files instead:
+heatmaps of the median time between scans and of the coverage per stone and asset,
+and a decimated time series of the time between scans per stone.
+"""
+
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import cycle
+
+import matplotlib.pyplot as plt
+import matplotlib.dates
+import numpy as np
+
+import asset_report_store
+import asset_interval_stats
+
+def getStonePairs(store, stone_id):
+	"""
+	:return: Range of the pair indices of a stone.
+	"""
+	start = np.searchsorted(store.pairStone, stone_id, side='left')
+	end = np.searchsorted(store.pairStone, stone_id, side='right')
+	return range(start, end)
+
+def plotBoxes(ax, box_data):
+	"""
+	Draws the boxplots, or a note when there are no times between scans, as Axes.bxp() fails on empty data.
+	"""
+	if len(box_data) == 0:
+		ax.text(0.5, 0.5, "no intervals", horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
+		ax.set_yticks([])
+		return
+	ax.bxp(box_data, vert=False, showfliers=True)
+
+def plotIntervals(store, too_many_assets_limit=20):
+	"""
+	Plots the time between scans, per stone.
+
+	:param store:                 AssetReportStore.
+	:param too_many_assets_limit: With more assets than this, all assets of a stone are combined.
+	"""
+	# Calculate time between scans
+	outlier_delta_time = asset_interval_stats.MAX_DELTA_TIME
+	print("------------------------- Warning -------------------------")
+	print(f"Removing outliers: any time between scans above {outlier_delta_time}")
+	print("-----------------------------------------------------------")
+	delta_times = asset_interval_stats.calcDeltaTimes(store, outlier_delta_time)
+
+	# Sorted, for nicer plotting
+	stones = [int(stone_id) for stone_id in store.getStones()]
+	assets = store.getAssets()
+	if len(stones) == 0:
+		print("No asset reports")
+		return
+
+	too_many_assets = len(assets) > too_many_assets_limit
+
+	if too_many_assets:
+		stones_per_figure = 20
+	else:
+		stones_per_figure = 2 * int(np.ceil(18 / len(assets)))
+
+	if too_many_assets:
+		stone_stats = asset_interval_stats.calcStoneStats(store, maxDeltaTime=outlier_delta_time)
+		i = 0
+		box_data = []
+		for stone_index, stone_id in enumerate(stones):
+			if i == 0:
+				plt.figure()
+				plt.xlabel("Time between scans (s)")
+
+			if stone_stats["count"][stone_index]:
+				box_data.append(asset_interval_stats.getBoxStats(stone_stats, stone_index, f"stone {stone_id}"))
+			i += 1
+			if i == stones_per_figure:
+				plotBoxes(plt.gca(), box_data)
+				i = 0
+				box_data = []
+		if i != 0:
+			plotBoxes(plt.gca(), box_data)
+		plt.show()
+
+	else:
+		pair_stats = asset_interval_stats.calcPairStats(store, maxDeltaTime=outlier_delta_time)
+		i = 0
+		j = 0
+		xlim = ()
+		fig_counter = 0
+		for stone_id in stones:
+			if i == 0 and j == 0:
+				# Start a new figure
+				subplot_row_count = int(stones_per_figure / 2)
+				fig, axs = plt.subplots(nrows=subplot_row_count, ncols=2, sharex=True, squeeze=False)
+				if fig_counter != 0:
+					plt.xlim(xlim)
+
+				for col in range(0, 2):
+					axs[subplot_row_count - 1][col].set_xlabel("Time between scans (s)")
+
+			box_data = []
+			for pair_index in getStonePairs(store, stone_id):
+				if pair_stats["count"][pair_index]:
+					asset_id = asset_report_store.assetName(store.pairAsset[pair_index])
+					box_data.append(asset_interval_stats.getBoxStats(pair_stats, pair_index, f"{asset_id}"))
+
+			plotBoxes(axs[i][j], box_data)
+			axs[i][j].set_title(f"stone {stone_id}")
+			i += 1
+			if i == subplot_row_count:
+				i = 0
+				j += 1
+				if j == 2:
+					j = 0
+					if fig_counter == 0:
+						xlim = plt.xlim()
+					fig_counter += 1
+		plt.show()
+
+	marker_styles = ['o', 'x', '+', 's', 'v', 'D', '2', '*']
+
+	for stone_id in stones:
+		plt.figure()
+		plt.title(f"Scanned assets by crownstone {stone_id}")
+		plt.ylabel("Time since previous scan (s)")
+		plt.xlabel("Time")
+		ax = plt.gca()
+		xfmt = matplotlib.dates.DateFormatter('%Y-%m-%d\n%H:%M:%S')
+		ax.xaxis.set_major_formatter(xfmt)
+		marker_style_cycler = cycle(marker_styles)
+
+		if too_many_assets:
+			# All assets of the stone in one go: skip the first report of each pair, as it has no time between scans.
+			stone_slice = store.getStoneSlice(stone_id)
+			valid = ~np.isnan(delta_times[stone_slice])
+			x = [datetime.datetime.fromtimestamp(t / 1000.0) for t in store.time[stone_slice][valid]]
+			plt.plot(x, delta_times[stone_slice][valid], 'o')
+		else:
+			for pair_index in getStonePairs(store, stone_id):
+				pair_slice = slice(store.pairStarts[pair_index] + 1, store.pairEnds[pair_index])
+				x = [datetime.datetime.fromtimestamp(t / 1000.0) for t in store.time[pair_slice]]
+				asset_id = asset_report_store.assetName(store.pairAsset[pair_index])
+				plt.plot(x, delta_times[pair_slice], next(marker_style_cycler), label=f"{asset_id}")
+			plt.legend()
+		plt.show()
+
+# Number of stones and assets per page of the report.
+REPORT_STONES_PER_PAGE = 100
+REPORT_ASSETS_PER_PAGE = 100
+
+# Number of stones per page of the report time series.
+REPORT_TIMELINES_PER_PAGE = 20
+
+# Number of time bins of the report: coverage and time series are calculated per bin.
+REPORT_NUM_TIME_BINS = 200
+
+def calcReportData(store, max_delta_time=asset_interval_stats.MAX_DELTA_TIME, num_time_bins=REPORT_NUM_TIME_BINS):
+	"""
+	Calculates the summary data of the report, all other data can be discarded before rendering.
+
+	:return: Dict with:
+	         stones, assets:   Sorted ids.
+	         median:           Median time between scans, shape (stones, assets), NaN for pairs without reports.
+	         coverage:         Fraction of time bins in which the pair was scanned, shape (stones, assets).
+	         binTimes:         Start time of each time bin in seconds.
+	         timeline:         5th, 50th, and 95th percentile of the time between scans per stone per time bin,
+	                           shape (stones, bins, 3).
+	"""
+	stones, pair_stone_index = np.unique(store.pairStone, return_inverse=True)
+	assets, pair_asset_index = np.unique(store.pairAsset, return_inverse=True)
+	pair_stats = asset_interval_stats.calcPairStats(store, maxDeltaTime=max_delta_time, percentiles=(50,))
+	median = np.full((len(stones), len(assets)), np.nan)
+	median[pair_stone_index, pair_asset_index] = pair_stats["percentiles"][:, 0]
+
+	# Time bin of each report.
+	start_time = store.time.min()
+	bin_size = max(int(np.ceil((store.time.max() - start_time + 1) / num_time_bins)), 1)
+	time_bin = (store.time - start_time) // bin_size
+	pair_of_report = np.repeat(np.arange(store.getNumPairs()), store.pairEnds - store.pairStarts)
+
+	# Count the number of distinct bins per pair.
+	pair_bins = np.unique(pair_of_report * num_time_bins + time_bin)
+	bins_per_pair = np.bincount(pair_bins // num_time_bins, minlength=store.getNumPairs())
+	coverage = np.zeros((len(stones), len(assets)))
+	coverage[pair_stone_index, pair_asset_index] = bins_per_pair / num_time_bins
+
+	delta_times = asset_interval_stats.calcDeltaTimes(store, max_delta_time)
+	valid = ~np.isnan(delta_times)
+	stone_of_report = pair_stone_index[pair_of_report]
+	groups = stone_of_report[valid] * num_time_bins + time_bin[valid]
+	counts, timeline = asset_interval_stats.groupPercentiles(groups, delta_times[valid], len(stones) * num_time_bins, (5, 50, 95))
+
+	return {
+		"stones": stones,
+		"assets": assets,
+		"median": median,
+		"coverage": coverage,
+		"binTimes": (start_time + np.arange(num_time_bins) * bin_size) / 1000.0,
+		"timeline": timeline.reshape(len(stones), num_time_bins, 3),
+	}
+
+def renderMatrixPage(file_name, title, stone_labels, asset_labels, median, coverage):
+	plt.switch_backend('Agg')
+	fig, axs = plt.subplots(ncols=2, figsize=(20, 10), constrained_layout=True)
+	fig.suptitle(title)
+	for ax, data, label, cmap in [(axs[0], median, "Median time between scans (s)", 'viridis'),
+	                              (axs[1], coverage, "Coverage (fraction of time bins scanned)", 'magma')]:
+		image = ax.imshow(data, aspect='auto', interpolation='nearest', cmap=cmap)
+		fig.colorbar(image, ax=ax, label=label)
+		ax.set_yticks(range(0, len(stone_labels)))
+		ax.set_yticklabels(stone_labels, fontsize=6)
+		ax.set_xticks(range(0, len(asset_labels)))
+		ax.set_xticklabels(asset_labels, fontsize=6, rotation=90)
+		ax.set_ylabel("Stone")
+		ax.set_xlabel("Asset")
+	fig.savefig(file_name)
+	plt.close(fig)
+	return file_name
+
+def renderTimelinePage(file_name, title, stone_labels, bin_times, timelines):
+	plt.switch_backend('Agg')
+	fig, axs = plt.subplots(nrows=len(stone_labels), sharex=True, squeeze=False, figsize=(12, 2 * len(stone_labels)), constrained_layout=True)
+	fig.suptitle(title)
+	x = [datetime.datetime.fromtimestamp(t) for t in bin_times]
+	for row in range(0, len(stone_labels)):
+		ax = axs[row][0]
+		ax.fill_between(x, timelines[row][:, 0], timelines[row][:, 2], alpha=0.3)
+		ax.plot(x, timelines[row][:, 1], '.-')
+		ax.set_ylabel(f"stone {stone_labels[row]}")
+	axs[-1][0].xaxis.set_major_formatter(matplotlib.dates.DateFormatter('%Y-%m-%d\n%H:%M:%S'))
+	axs[-1][0].set_xlabel("Time (median and 5-95 percentile time between scans, per time bin)")
+	fig.savefig(file_name)
+	plt.close(fig)
+	return file_name
+
+def writeReport(store, output_dir, num_workers=None):
+	"""
+	Renders paged summary figures to files, without opening windows.
+
+	:param store:       AssetReportStore.
+	:param output_dir:  Directory to write the figures and a csv with statistics per pair to.
+	:param num_workers: Number of processes that render pages, None for the number of CPUs.
+	:return:            List of written files.
+	"""
+	os.makedirs(output_dir, exist_ok=True)
+	if len(store) == 0:
+		print("No asset reports")
+		return []
+	data = calcReportData(store)
+	stones = data["stones"]
+	assets = data["assets"]
+	asset_labels = [asset_report_store.assetName(asset) for asset in assets]
+
+	stats_file_name = os.path.join(output_dir, "pair_stats.csv")
+	pair_stats = asset_interval_stats.calcPairStats(store)
+	with open(stats_file_name, 'w') as stats_file:
+		stats_file.write("stone,asset,count," + ",".join(f"p{level}" for level in pair_stats["percentileLevels"]) + "\n")
+		for i in range(0, len(pair_stats["count"])):
+			stats_file.write(f"{pair_stats['stone'][i]},{asset_report_store.assetName(pair_stats['asset'][i])},{pair_stats['count'][i]}," +
+			                 ",".join(f"{value:.3f}" for value in pair_stats["percentiles"][i]) + "\n")
+	written = [stats_file_name]
+
+	with ProcessPoolExecutor(max_workers=num_workers) as executor:
+		futures = []
+		for stone_start in range(0, len(stones), REPORT_STONES_PER_PAGE):
+			stone_end = min(stone_start + REPORT_STONES_PER_PAGE, len(stones))
+			for asset_start in range(0, len(assets), REPORT_ASSETS_PER_PAGE):
+				asset_end = min(asset_start + REPORT_ASSETS_PER_PAGE, len(assets))
+				file_name = os.path.join(output_dir, f"matrix_stones{stone_start}_assets{asset_start}.png")
+				title = f"Stones {stone_start}-{stone_end - 1}, assets {asset_start}-{asset_end - 1}"
+				futures.append(executor.submit(renderMatrixPage, file_name, title,
+				                               [int(stone) for stone in stones[stone_start:stone_end]],
+				                               asset_labels[asset_start:asset_end],
+				                               data["median"][stone_start:stone_end, asset_start:asset_end],
+				                               data["coverage"][stone_start:stone_end, asset_start:asset_end]))
+		for stone_start in range(0, len(stones), REPORT_TIMELINES_PER_PAGE):
+			stone_end = min(stone_start + REPORT_TIMELINES_PER_PAGE, len(stones))
+			file_name = os.path.join(output_dir, f"timeline_stones{stone_start}.png")
+			title = f"Time between scans of stones {stone_start}-{stone_end - 1}"
+			futures.append(executor.submit(renderTimelinePage, file_name, title,
+			                               [int(stone) for stone in stones[stone_start:stone_end]],
+			                               data["binTimes"], data["timeline"][stone_start:stone_end]))
+		for future in futures:
+			written.append(future.result())
+	print("Wrote", len(written), "files to", output_dir)
+	return written
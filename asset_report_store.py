@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""
+Columnar store of asset reports.
+
+Converts ASSET_REPORT logs (see asset-log-parser.py) to arrays with one element per report:
+  stone:   Crownstone id, uint16.
+  asset:   Asset MAC address as integer, uint64.
+  rssi:    RSSI, int8.
+  channel: Channel the asset was scanned on, uint8.
+  time:    Time of the scan in ms since epoch, int64.
+
+The reports are sorted by (stone, asset, time), with an index of the start of each (stone, asset) pair,
+so that the reports of a pair are slices (views) of the arrays.
+
+The store can be saved as .npz file, so that analyses don't have to parse the raw log again.
+
+Usage:
+	./asset_report_store.py log.txt store.npz
+"""
+
+from array import array
+import datetime
+import json
+import re
+import sys
+
+import numpy as np
+
+# Assets with a MAC starting with this prefix are simulated tags, they are all stored as a single asset.
+SIMULATED_PREFIX = "FF:00"
+SIMULATED_ASSET = 0xFF0000000000
+
+def macToInt(mac):
+	return int(mac.replace(":", ""), 16)
+
+def intToMac(value):
+	value = int(value)
+	return ":".join("{:02X}".format((value >> shift) & 0xFF) for shift in range(40, -8, -8))
+
+def assetName(asset):
+	"""
+	:return: Name of an asset for printing and plotting.
+	"""
+	if asset == SIMULATED_ASSET:
+		return "Simulated tag"
+	return intToMac(asset)
+
+class AssetReportStore:
+	def __init__(self, stone, asset, rssi, channel, time):
+		"""
+		Sorts the given columns and builds the index.
+		"""
+		order = np.lexsort((time, asset, stone))
+		self.stone = np.asarray(stone, dtype=np.uint16)[order]
+		self.asset = np.asarray(asset, dtype=np.uint64)[order]
+		self.rssi = np.asarray(rssi, dtype=np.int8)[order]
+		self.channel = np.asarray(channel, dtype=np.uint8)[order]
+		self.time = np.asarray(time, dtype=np.int64)[order]
+		self._buildIndex()
+
+	def _buildIndex(self):
+		# A new pair starts where the stone or asset differs from the previous report.
+		newPair = np.ones(len(self.stone), dtype=bool)
+		newPair[1:] = (self.stone[1:] != self.stone[:-1]) | (self.asset[1:] != self.asset[:-1])
+		self.pairStarts = np.flatnonzero(newPair)
+		self.pairEnds = np.append(self.pairStarts[1:], len(self.stone))
+		self.pairStone = self.stone[self.pairStarts]
+		self.pairAsset = self.asset[self.pairStarts]
+
+	def __len__(self):
+		return len(self.stone)
+
+	def getStones(self):
+		return np.unique(self.pairStone)
+
+	def getAssets(self):
+		return np.unique(self.pairAsset)
+
+	def getNumPairs(self):
+		return len(self.pairStarts)
+
+	def findPair(self, stone, asset):
+		"""
+		:return: Index of the (stone, asset) pair, or None if there are no reports of it.
+		"""
+		# Pairs are sorted by stone, then by asset.
+		start = np.searchsorted(self.pairStone, stone, side='left')
+		end = np.searchsorted(self.pairStone, stone, side='right')
+		index = start + np.searchsorted(self.pairAsset[start:end], np.uint64(asset))
+		if index < end and self.pairAsset[index] == asset:
+			return int(index)
+		return None
+
+	def getPairSlice(self, pairIndex):
+		return slice(self.pairStarts[pairIndex], self.pairEnds[pairIndex])
+
+	def getPair(self, stone, asset):
+		"""
+		:return: Dict with the time, rssi, and channel of the reports of a (stone, asset) pair, as views.
+		"""
+		pairIndex = self.findPair(stone, asset)
+		if pairIndex is None:
+			s = slice(0, 0)
+		else:
+			s = self.getPairSlice(pairIndex)
+		return {
+			"time": self.time[s],
+			"rssi": self.rssi[s],
+			"channel": self.channel[s],
+		}
+
+	def getStoneSlice(self, stone):
+		"""
+		:return: Slice of all reports of a stone.
+		"""
+		start = np.searchsorted(self.stone, stone, side='left')
+		end = np.searchsorted(self.stone, stone, side='right')
+		return slice(start, end)
+
+	def save(self, fileName):
+		np.savez(fileName, stone=self.stone, asset=self.asset, rssi=self.rssi, channel=self.channel, time=self.time)
+
+def load(fileName):
+	"""
+	Loads a store saved with AssetReportStore.save().
+	"""
+	with np.load(fileName) as data:
+		store = AssetReportStore.__new__(AssetReportStore)
+		store.stone = data["stone"]
+		store.asset = data["asset"]
+		store.rssi = data["rssi"]
+		store.channel = data["channel"]
+		store.time = data["time"]
+	# Already sorted.
+	store._buildIndex()
+	return store
+
+def ingest(fileName):
+	"""
+	Reads an ASSET_REPORT log: one json message per line, terminated by "$$".
+	The columns are collected in typed arrays, so that memory use stays small for large logs.
+
+	:return: AssetReportStore
+	"""
+	stone = array('H')
+	asset = array('Q')
+	rssi = array('b')
+	channel = array('B')
+	time = array('q')
+	# Most logs only contain a few assets, so cache the conversion.
+	assetCache = {}
+	with open(fileName, 'r') as file:
+		for line in file:
+			line = line.strip()
+			if line.endswith("$$"):
+				line = line[0:-2]
+			if not line:
+				continue
+			message = json.loads(line)
+			if message.get("event", "ASSET_REPORT") != "ASSET_REPORT":
+				continue
+			for report in message["data"]:
+				mac = report["am"]
+				assetInt = assetCache.get(mac)
+				if assetInt is None:
+					assetInt = SIMULATED_ASSET if mac[0:5] == SIMULATED_PREFIX else macToInt(mac)
+					assetCache[mac] = assetInt
+				stone.append(report["cid"])
+				asset.append(assetInt)
+				rssi.append(report["r"])
+				channel.append(report.get("c", 0))
+				time.append(report["t"])
+	return AssetReportStore(
+		np.frombuffer(stone, dtype=np.uint16),
+		np.frombuffer(asset, dtype=np.uint64),
+		np.frombuffer(rssi, dtype=np.int8),
+		np.frombuffer(channel, dtype=np.uint8),
+		np.frombuffer(time, dtype=np.int64))
+
+def ingestBluenetLog(fileName):
+	"""
+	Reads a bluenet log, with lines like: [2021-06-28 13:42:03.142532] asset mac=60:c0:bf:27:e5:67 scanned by id=96
+	The log has no RSSI and channel, so those are 0.
+
+	:return: AssetReportStore
+	"""
+	timestampFormat = "%Y-%m-%d %H:%M:%S.%f"
+	patternAssetLine = re.compile(r"\[([^\]]+)\] asset mac=(\S+) scanned by id=(\d+)")
+	stone = array('H')
+	asset = array('Q')
+	time = array('q')
+	assetCache = {}
+	with open(fileName, 'r') as file:
+		for line in file:
+			match = patternAssetLine.match(line)
+			if not match:
+				continue
+			mac = match.group(2).upper()
+			assetInt = assetCache.get(mac)
+			if assetInt is None:
+				assetInt = SIMULATED_ASSET if mac[0:5] == SIMULATED_PREFIX else macToInt(mac)
+				assetCache[mac] = assetInt
+			stone.append(int(match.group(3)))
+			asset.append(assetInt)
+			time.append(int(round(datetime.datetime.strptime(match.group(1), timestampFormat).timestamp() * 1000)))
+	return AssetReportStore(
+		np.frombuffer(stone, dtype=np.uint16),
+		np.frombuffer(asset, dtype=np.uint64),
+		np.zeros(len(stone), dtype=np.int8),
+		np.zeros(len(stone), dtype=np.uint8),
+		np.frombuffer(time, dtype=np.int64))
+
+def loadOrIngest(fileName):
+	"""
+	Loads a store when given an .npz file, ingests the log otherwise.
+	"""
+	if fileName.endswith(".npz"):
+		return load(fileName)
+	return ingest(fileName)
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print("Usage:", sys.argv[0], "log.txt store.npz")
+		exit(1)
+	store = ingest(sys.argv[1])
+	store.save(sys.argv[2])
+	print("Stored", len(store), "reports of", store.getNumPairs(), "(stone, asset) pairs,",
+	      len(store.getStones()), "stones, and", len(store.getAssets()), "assets")
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 
+"""
+Calibrate the voltage and current multipliers, using recordings made with record.py.
+
+Usage:
+	./calibrate.py files..
+		Fit and plot the multipliers of a single Crownstone.
+
+	./calibrate.py --batch [--bootstrap N] files..
+		Fit the multipliers of each Crownstone in the files (as given by the BLE address in the file name),
+		with bootstrapped confidence intervals, and print them as a table.
+"""
+
+import argparse
 import json
-import sys
+import re
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import *
+from concurrent.futures import ProcessPoolExecutor
 
 PLOT_SAMPLES = False
 
+# Number of bootstrap resamples per job.
+BOOTSTRAP_CHUNK_SIZE = 200
+
+bleAddressPattern = re.compile("_([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})_")
+
 def calcAveragePower(fileNames, voltageMultiplier, currentMultiplier):
 	for fileName in fileNames:
 		with open(fileName, 'r') as infile:
@@ -31,17 +49,15 @@ def calcAveragePower(fileNames, voltageMultiplier, currentMultiplier):
 		return powerRms
 
 def calcAverageRms(samplesList1, samplesList2, square=True):
-	rms = []
-	for i in range(0, len(samplesList1)):
-		rms.append(calcRms(samplesList1[i], samplesList2[i], square))
+	rms = calcRms(samplesList1, samplesList2, square)
 #	print(rms)
 	return (np.mean(rms), np.std(rms))
 
 def calcRms(samples1, samples2, square=True):
-	rms = 0.0
-	for i in range(0, len(samples1)):
-		rms += samples1[i] * samples2[i]
-	rms /= len(samples1)
+	"""
+	Calculates the RMS of each buffer (the last axis) of samples.
+	"""
+	rms = np.mean(np.asarray(samples1, dtype=float) * np.asarray(samples2, dtype=float), axis=-1)
 	if (square):
 		return np.sqrt(rms)
 	else:
@@ -50,67 +66,264 @@ def calcRms(samples1, samples2, square=True):
 def calcZero(samples):
 	return np.mean(np.mean(samples))
 
+def getBleAddress(fileName, data):
+	if "bleAddress" in data:
+		return data["bleAddress"]
+	match = bleAddressPattern.search(fileName)
+	if match:
+		return match.group(1).upper()
+	return "unknown"
+
+def checkBufferLengths(fileName, name, buffers, numSamples):
+	"""
+	Checks that all buffers have the same number of samples, before they are stacked.
+
+	:param numSamples: Number of samples of the buffers of previous files, None for the first file.
+	:return:           Number of samples per buffer.
+	"""
+	for i, buffer in enumerate(buffers):
+		if numSamples is None:
+			numSamples = len(buffer)
+		if len(buffer) != numSamples:
+			raise ValueError(f"{fileName}: {name} buffer {i} has {len(buffer)} samples, all buffers should have {numSamples} samples")
+	return numSamples
+
+def loadRecordings(fileNames):
+	"""
+	Loads all recordings, and stacks the buffers of all recordings.
+
+	:return: Dict with:
+		voltageSamples, currentSamples: buffers of all recordings, shape (numBuffers, numSamples).
+		recording: index of the recording of each buffer, shape (numBuffers,).
+		voltageGroundTruth, currentGroundTruth, powerGroundTruth: shape (numRecordings,).
+		bleAddress: BLE address of each recording.
+	"""
+	voltageSamples = []
+	currentSamples = []
+	recording = []
+	numSamples = None
+	recordings = {
+		"voltageGroundTruth": [],
+		"currentGroundTruth": [],
+		"powerGroundTruth": [],
+		"bleAddress": [],
+	}
+	for fileName in fileNames:
+		with open(fileName, 'r') as infile:
+			data = json.load(infile)
+		recordings["voltageGroundTruth"].append(data["voltageGroundTruth"])
+		recordings["currentGroundTruth"].append(data["currentGroundTruth"])
+		recordings["powerGroundTruth"].append(data["powerGroundTruth"])
+		recordings["bleAddress"].append(getBleAddress(fileName, data))
+		numSamples = checkBufferLengths(fileName, "voltage", data["voltageSampes"], numSamples)
+		numSamples = checkBufferLengths(fileName, "current", data["currentSampes"], numSamples)
+		recording.extend([len(recordings["bleAddress"]) - 1] * len(data["voltageSampes"]))
+		voltageSamples.extend(data["voltageSampes"])
+		currentSamples.extend(data["currentSampes"])
+
+	for key in ["voltageGroundTruth", "currentGroundTruth", "powerGroundTruth"]:
+		recordings[key] = np.array(recordings[key], dtype=float)
+	recordings["recording"] = np.array(recording, dtype=int)
+	recordings["voltageSamples"] = np.array(voltageSamples, dtype=float)
+	recordings["currentSamples"] = np.array(currentSamples, dtype=float)
+	return recordings
+
+def calcBufferStats(recordings):
+	"""
+	Calculates the RMS voltage, RMS current and real power of all buffers of all recordings at once.
+	Samples are shifted by the average zero of their recording.
+
+	:return: Dict with voltageRms, currentRms, powerReal, each of shape (numBuffers,).
+	"""
+	recording = recordings["recording"]
+	numRecordings = len(recordings["bleAddress"])
+	numBuffers = np.bincount(recording, minlength=numRecordings)
+	numSamples = recordings["voltageSamples"].shape[1]
+	voltageZero = np.bincount(recording, recordings["voltageSamples"].sum(axis=1), numRecordings) / (numBuffers * numSamples)
+	currentZero = np.bincount(recording, recordings["currentSamples"].sum(axis=1), numRecordings) / (numBuffers * numSamples)
+	voltageSamplesShifted = recordings["voltageSamples"] - voltageZero[recording, np.newaxis]
+	currentSamplesShifted = recordings["currentSamples"] - currentZero[recording, np.newaxis]
+	return {
+		"voltageRms": calcRms(voltageSamplesShifted, voltageSamplesShifted),
+		"currentRms": calcRms(currentSamplesShifted, currentSamplesShifted),
+		"powerReal": calcRms(voltageSamplesShifted, currentSamplesShifted, False),
+	}
+
+def calcRecordingStats(values, recording, numRecordings):
+	"""
+	Calculates the mean and standard deviation of the buffer values per recording.
+	"""
+	count = np.bincount(recording, minlength=numRecordings)
+	mean = np.bincount(recording, values, numRecordings) / count
+	variance = np.bincount(recording, (values - mean[recording]) ** 2, numRecordings) / count
+	return mean, np.sqrt(variance)
+
+def fitMultipliers(voltageTruth, voltageMean, powerTruth, powerMean):
+	"""
+	Fits the multipliers, vectorized over the leading axes.
+	The last axis of the inputs are the recordings.
+
+	Voltage is fitted as: calculated = b * truth
+	Power is fitted as:   calculated = b * truth + a
+	  Higher power usage is expected to have a larger measurement error.
+	  Up to something like 10W it should all be equally precise.
+	The current fit follows from the voltage and power fit.
+
+	:return: Dict with voltageMultiplier, currentMultiplier, powerMultiplier and powerOffset.
+	"""
+	voltageSlope = np.sum(voltageTruth * voltageMean, axis=-1) / np.sum(voltageTruth * voltageTruth, axis=-1)
+
+	# Weighted linear least squares, with weights 1 / sigma^2.
+	weights = 1.0 / np.maximum(powerTruth, 10) ** 2
+	sumW = np.sum(weights, axis=-1)
+	meanX = np.sum(weights * powerTruth, axis=-1) / sumW
+	meanY = np.sum(weights * powerMean, axis=-1) / sumW
+	dx = powerTruth - meanX[..., np.newaxis]
+	dy = powerMean - meanY[..., np.newaxis]
+	powerSlope = np.sum(weights * dx * dy, axis=-1) / np.sum(weights * dx * dx, axis=-1)
+	powerOffset = meanY - powerSlope * meanX
+
+	currentSlope = -1 * powerSlope / voltageSlope
+	return {
+		"voltageMultiplier": 1.0 / voltageSlope,
+		"currentMultiplier": 1.0 / currentSlope,
+		"powerMultiplier": 1.0 / powerSlope,
+		"powerOffset": powerOffset,
+	}
+
+def bootstrapMultipliers(voltageRms, powerReal, recording, voltageTruth, powerTruth, numResamples, seed):
+	"""
+	Fits the multipliers on resampled data: the buffers of each recording are drawn with replacement.
+	To be executed by a worker process.
+
+	:return: Dict as returned by fitMultipliers(), with arrays of shape (numResamples,).
+	"""
+	rng = np.random.default_rng(seed)
+	numRecordings = len(voltageTruth)
+	voltageMean = np.empty((numResamples, numRecordings))
+	powerMean = np.empty((numResamples, numRecordings))
+	for r in range(0, numRecordings):
+		indices = np.flatnonzero(recording == r)
+		resampled = rng.choice(indices, (numResamples, len(indices)))
+		voltageMean[:, r] = np.mean(voltageRms[resampled], axis=1)
+		powerMean[:, r] = np.mean(powerReal[resampled], axis=1)
+	return fitMultipliers(voltageTruth, voltageMean, powerTruth, powerMean)
+
+def calibrateBatch(fileNames, numResamples, confidence, numWorkers=None, outputFileName=None):
+	"""
+	Fits the multipliers of each Crownstone in the files, with bootstrapped confidence intervals.
+	"""
+	recordings = loadRecordings(fileNames)
+	stats = calcBufferStats(recordings)
+	numRecordings = len(recordings["bleAddress"])
+	recording = recordings["recording"]
+	voltageMean, voltageStd = calcRecordingStats(stats["voltageRms"], recording, numRecordings)
+	currentMean, currentStd = calcRecordingStats(stats["currentRms"], recording, numRecordings)
+	powerMean, powerStd = calcRecordingStats(stats["powerReal"], recording, numRecordings)
+
+	bleAddresses = np.array(recordings["bleAddress"])
+	keys = ["voltageMultiplier", "currentMultiplier", "powerMultiplier", "powerOffset"]
+	results = {}
+	futures = {}
+	with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+		for bleAddress in sorted(set(recordings["bleAddress"])):
+			recordingIndices = np.flatnonzero(bleAddresses == bleAddress)
+			if len(recordingIndices) < 2:
+				print("/!\\ Not enough data for", bleAddress, "/!\\ ")
+				results[bleAddress] = {
+					"voltageMultiplier": recordings["voltageGroundTruth"][recordingIndices[0]] / voltageMean[recordingIndices[0]],
+					"currentMultiplier": recordings["currentGroundTruth"][recordingIndices[0]] / currentMean[recordingIndices[0]],
+				}
+				continue
+			results[bleAddress] = fitMultipliers(recordings["voltageGroundTruth"][recordingIndices], voltageMean[recordingIndices],
+			                                     recordings["powerGroundTruth"][recordingIndices], powerMean[recordingIndices])
+
+			# Only pass the buffers of this Crownstone to the workers, with the recordings renumbered from 0.
+			bufferMask = np.isin(recording, recordingIndices)
+			deviceRecording = np.searchsorted(recordingIndices, recording[bufferMask])
+			futures[bleAddress] = []
+			for start in range(0, numResamples, BOOTSTRAP_CHUNK_SIZE):
+				futures[bleAddress].append(executor.submit(
+					bootstrapMultipliers,
+					stats["voltageRms"][bufferMask], stats["powerReal"][bufferMask], deviceRecording,
+					recordings["voltageGroundTruth"][recordingIndices], recordings["powerGroundTruth"][recordingIndices],
+					min(BOOTSTRAP_CHUNK_SIZE, numResamples - start), [start, len(futures)]))
+
+		for bleAddress in futures:
+			resamples = [future.result() for future in futures[bleAddress]]
+			for key in keys:
+				values = np.concatenate([r[key] for r in resamples])
+				results[bleAddress][key + "Interval"] = np.percentile(values, [50 - confidence / 2, 50 + confidence / 2])
+
+	print("{:<20} {:>32} {:>32} {:>32}".format("address", "voltageMultiplier", "currentMultiplier", "powerOffset"))
+	for bleAddress, result in results.items():
+		columns = []
+		for key in ["voltageMultiplier", "currentMultiplier", "powerOffset"]:
+			if key not in result:
+				columns.append("")
+			elif key + "Interval" in result:
+				columns.append("{:.6g} [{:.6g}, {:.6g}]".format(result[key], *result[key + "Interval"]))
+			else:
+				columns.append("{:.6g}".format(result[key]))
+		print("{:<20} {:>32} {:>32} {:>32}".format(bleAddress, *columns))
+
+	if outputFileName is not None:
+		output = {}
+		for bleAddress, result in results.items():
+			output[bleAddress] = {key: np.asarray(value).tolist() for key, value in result.items()}
+		with open(outputFileName, 'w') as outfile:
+			json.dump(output, outfile, indent=2)
+	return results
 
 def main():
+	argParser = argparse.ArgumentParser(description="Calibrate the voltage and current multipliers")
+	argParser.add_argument('--batch', dest='batch', action='store_true',
+	                       help='Calibrate each Crownstone in the files, without plotting')
+	argParser.add_argument('--bootstrap', dest='numResamples', type=int, default=1000,
+	                       help='Number of bootstrap resamples for the confidence intervals in batch mode')
+	argParser.add_argument('--confidence', dest='confidence', type=float, default=95,
+	                       help='Confidence interval in percent')
+	argParser.add_argument('--workers', dest='numWorkers', type=int, default=None,
+	                       help='Number of worker processes, defaults to the number of CPUs')
+	argParser.add_argument('-o', '--output', dest='outputFileName', default=None,
+	                       help='Write the multipliers of batch mode to this json file')
+	argParser.add_argument('fileNames', nargs='+',
+	                       help='Files recorded with record.py')
+	args = argParser.parse_args()
+
+	fileNames = args.fileNames
+	if args.batch:
+		calibrateBatch(fileNames, args.numResamples, args.confidence, args.numWorkers, args.outputFileName)
+		return
+
 	fig, (ax1, ax2, ax3) = plt.subplots(3, sharex=False, figsize=(10, 10))
 
 	if PLOT_SAMPLES:
 		fig2, (ax21, ax22) = plt.subplots(2, sharex=True)
 		t=0
 
-	voltageTruth = []
-	voltageMean = []
-	voltageStd = []
-	currentTruth = []
-	currentMean = []
-	currentStd = []
-	powerTruth = []
-	powerMean = []
-	powerStd = []
-
-	fileNames = sys.argv[1:]
-	for fileName in fileNames:
-		with open(fileName, 'r') as infile:
-			data = json.load(infile)
-		voltageGroundTruth = data["voltageGroundTruth"]
-		currentGroundTruth = data["currentGroundTruth"]
-		powerGroundTruth = data["powerGroundTruth"]
-		voltageSamples = np.array(data["voltageSampes"])
-		currentSamples = np.array(data["currentSampes"])
+	recordings = loadRecordings(fileNames)
+	stats = calcBufferStats(recordings)
+	numRecordings = len(fileNames)
+	voltageMean, voltageStd = calcRecordingStats(stats["voltageRms"], recordings["recording"], numRecordings)
+	currentMean, currentStd = calcRecordingStats(stats["currentRms"], recordings["recording"], numRecordings)
+	powerMean, powerStd = calcRecordingStats(stats["powerReal"], recordings["recording"], numRecordings)
+	voltageTruth = recordings["voltageGroundTruth"]
+	currentTruth = recordings["currentGroundTruth"]
+	powerTruth = recordings["powerGroundTruth"]
+
+	# Plot std
+	for i in range(0, numRecordings):
+		ax1.plot([voltageTruth[i], voltageTruth[i]], [voltageMean[i] - voltageStd[i], voltageMean[i] + voltageStd[i]], '-k')
+		ax2.plot([currentTruth[i], currentTruth[i]], [currentMean[i] - currentStd[i], currentMean[i] + currentStd[i]], '-k')
+		# ax3.plot([powerTruth[i], powerTruth[i]], [powerMean[i] - powerStd[i], powerMean[i] + powerStd[i]], '-k')
 
-		# Shift the samples by average zero
-		voltageZero = calcZero(voltageSamples)
-		currentZero = calcZero(currentSamples)
-		voltageSamplesShifted = voltageSamples - voltageZero
-		currentSamplesShifted = currentSamples - currentZero
-
-		# Calculate RMS values and power
-		voltageRms = calcAverageRms(voltageSamplesShifted, voltageSamplesShifted)
-		currentRms = calcAverageRms(currentSamplesShifted, currentSamplesShifted)
-		powerRms = calcAverageRms(voltageSamplesShifted, currentSamplesShifted, False)
-
-		# Append for plot
-		voltageTruth.append(voltageGroundTruth)
-		voltageMean.append(voltageRms[0])
-		voltageStd.append(voltageRms[1])
-		currentTruth.append(currentGroundTruth)
-		currentMean.append(currentRms[0])
-		currentStd.append(currentRms[1])
-		powerTruth.append(powerGroundTruth)
-		powerMean.append(powerRms[0])
-		powerStd.append(powerRms[1])
-
-		# Plot std
-		ax1.plot([voltageGroundTruth, voltageGroundTruth], [voltageRms[0] - voltageRms[1], voltageRms[0] + voltageRms[1]], '-k')
-		ax2.plot([currentGroundTruth, currentGroundTruth], [currentRms[0] - currentRms[1], currentRms[0] + currentRms[1]], '-k')
-		# ax3.plot([powerGroundTruth, powerGroundTruth], [powerRms[0] - powerRms[1], powerRms[0] + powerRms[1]], '-k')
-
-		if PLOT_SAMPLES:
-			for i in range(0, len(voltageSamples)):
-				x = range(t, t + len(voltageSamples[i]))
-				ax21.plot(x, voltageSamples[i], '.-')
-				ax22.plot(x, currentSamples[i], '.-')
-				t += len(voltageSamples[i])
+	if PLOT_SAMPLES:
+		for i in range(0, len(recordings["voltageSamples"])):
+			x = range(t, t + len(recordings["voltageSamples"][i]))
+			ax21.plot(x, recordings["voltageSamples"][i], '.-')
+			ax22.plot(x, recordings["currentSamples"][i], '.-')
+			t += len(recordings["voltageSamples"][i])
 
 	if len(fileNames) < 2:
 		print("/!\ Not enough data /!\ ")
@@ -128,44 +341,14 @@ def main():
 	# voltageFit = np.polyfit(voltageTruth, voltageMean, 1)
 	# currentFit = np.polyfit(currentTruth, currentMean, 1)
 
-	# Fit the data: calibrated = x[0] * truth
-	optimize_func = lambda x: x[0] * np.array(voltageTruth) - np.array(voltageMean)
-	beta0 = [0]
-	lsq = least_squares(optimize_func, beta0, method='lm', loss='linear')
-	voltageFit = np.array([lsq.x[0], 0])
-
-	# Fit the data: calibrated = x[0] * truth
-	# optimize_func = lambda x: x[0] * np.array(currentTruth) - np.array(currentMean)
-	# beta0 = [0]
-	# lsq = least_squares(optimize_func, beta0, method='lm', loss='linear')
-	# currentFit = np.array([lsq.x[0], 0])
-
-
-	# Fit the data: calibrated = b * truth + sigma
-	optimize_func = lambda x, b: b * x
-
-	# Higher currents are expected to have a larger measurement error.
-	# Up to something like 0.3A it should all be equally precise.
-	sigma = np.maximum(powerTruth, 0.3)
-	popt, pcov = curve_fit(optimize_func, currentTruth, currentMean, sigma=np.maximum(currentTruth, 0.1))
-	currentFit = np.array([popt[0], 0])
-
-
-	# Fit the data: calibrated = b * truth + a
-	# Determine current multiplier on power usage.
-	optimize_func = lambda x, b, a: b * x + a
-	# Higher power usage is expected to have a larger measurement error.
-	# Up to something like 10W it should all be equally precise.
-	sigma = np.maximum(powerTruth, 10)
-	popt, pcov = curve_fit(optimize_func, powerTruth, powerMean, sigma=sigma)
-	powerFit = np.array([popt[0], popt[1]])
-	powerMultiplier = 1.0 / powerFit[0]
-
-	currentFit = np.array([-1 * powerFit[0] / voltageFit[0], 0])
-
+	multipliers = fitMultipliers(voltageTruth, voltageMean, powerTruth, powerMean)
+	voltageMultiplier = multipliers["voltageMultiplier"]
+	currentMultiplier = multipliers["currentMultiplier"]
+	powerMultiplier = multipliers["powerMultiplier"]
+	voltageFit = np.array([1.0 / voltageMultiplier, 0])
+	currentFit = np.array([1.0 / currentMultiplier, 0])
+	powerFit = np.array([1.0 / powerMultiplier, multipliers["powerOffset"]])
 
-	voltageMultiplier = 1.0 / voltageFit[0]
-	currentMultiplier = 1.0 / currentFit[0]
 	print("voltageMultiplier:", voltageMultiplier)
 	print("currentMultiplier:", currentMultiplier)
 
@@ -212,4 +395,5 @@ def main():
 	# currentMultiplier = currentMultiplier * powerMultiplier
 	# print("currentMultiplier fitted on power:", currentMultiplier)
 
-main()
+if __name__ == '__main__':
+	main()
@@ -1,84 +1,69 @@
 #!/usr/bin/env python3
 
+"""
+Record power samples of one or more Crownstones, for calibration with calibrate.py.
+
+For each ground truth step (the load you set), the power samples of all Crownstones are retrieved.
+Connections are scheduled from a job queue: while the samples of one Crownstone are being processed and
+written to file, the next Crownstone is already being connected to. Crownstones that fail to connect are
+retried at the end of the queue, so that they don't keep the others waiting.
+
+Each Crownstone and step results in a file: <outputPrefix>_<bleAddress>_<power>W.txt
+"""
+
 import argparse
-from crownstone_ble import CrownstoneBle
-from crownstone_core.protocol.BluenetTypes import PowerSamplesType
+import asyncio
+import json
+import time
 import traceback
+
 import numpy as np
-import select
-import sys
-import json
 
-parser = argparse.ArgumentParser(description='Search for any Crownstone and print their information')
-parser.add_argument('-H', '--hciIndex', dest='hciIndex', type=int, nargs='?', default=0,
-        help='The hci-index of the BLE chip')
+from crownstone_core.protocol.BluenetTypes import PowerSamplesType
+
+parser = argparse.ArgumentParser(description='Record power samples of Crownstones for calibration')
+parser.add_argument('-A', '--adapterAddress', dest='adapterAddress', type=str, default=None,
+        help='Adapter MAC address of the bluetooth chip you want to use (linux only). You can get a list by running: hcitool dev')
 parser.add_argument('-V', '--voltage', dest='voltageGroundTruth', type=float, nargs='?', default=0.0,
-        help='The ground truth RMS voltage')
+        help='The ground truth RMS voltage, when no steps are given')
 parser.add_argument('-C', '--current', dest='currentGroundTruth', type=float, nargs='?', default=0.0,
-        help='The ground truth RMS current')
+        help='The ground truth RMS current, when no steps are given')
 parser.add_argument('-P', '--power', dest='powerGroundTruth', type=float, nargs='?', default=0.0,
-        help='The ground truth RMS real power')
+        help='The ground truth RMS real power, when no steps are given')
+parser.add_argument('-S', '--step', dest='steps', type=float, nargs=3, action='append', metavar=('VOLTAGE', 'CURRENT', 'POWER'),
+        help='A ground truth step: RMS voltage, RMS current, and real power. Can be given multiple times.')
+parser.add_argument('-N', '--numBuffers', dest='numBuffers', type=int, default=20,
+        help='Number of power samples to retrieve per Crownstone per step')
+parser.add_argument('-R', '--retries', dest='retries', type=int, default=3,
+        help='Number of times to retry a Crownstone that failed')
 parser.add_argument('-O', '--outputPrefix', dest='outputPrefix', type=str, nargs='?', default="output",
         help='Output filename prefix')
+parser.add_argument('--noPrompt', dest='noPrompt', action='store_true',
+        help='Do not wait for enter before each step')
+parser.add_argument('--simulate', dest='simulate', action='store_true',
+        help='Use simulated Crownstones instead of the BLE adapter. The key file is ignored.')
 parser.add_argument('keyFile',
         help='The json file with key information, expected values: admin, member, guest, basic,' +
         'serviceDataKey, localizationKey, meshApplicationKey, and meshNetworkKey')
-parser.add_argument('bleAddress', type=str,
-        help='The BLE address of Crownstone to switch')
-
-args = parser.parse_args()
+parser.add_argument('bleAddresses', type=str, nargs='+',
+        help='The BLE addresses of the Crownstones to record')
 
 MULTIPLIER_VOLTAGE = -0.2547
 #MULTIPLIER_CURRENT = 0.0071
 MULTIPLIER_CURRENT = 0.01486
 
-class CalculatedPower:
-    voltageZero = 0.0
-    currentZero = 0.0
-    currentRms = 0.0
-    voltageRms = 0.0
-    powerReal = 0.0
-
-
 def calcPower(powerSamplesList, voltageMultiplier, currentMultiplier):
     voltageSamples = np.array(powerSamplesList[0].samples)
     currentSamples = np.array(powerSamplesList[1].samples)
-#    voltageSamples = powerSamplesList[0].samples
-#    currentSamples = powerSamplesList[1].samples
     voltageZero = calcZero(voltageSamples)
     currentZero = calcZero(currentSamples)
     voltageSamplesCorrected = (voltageSamples - voltageZero) * voltageMultiplier
     currentSamplesCorrected = (currentSamples - currentZero) * currentMultiplier
-#    voltageSamplesCorrected = []
-#    for v in voltageSamples:
-#        voltageSamplesCorrected.append((v - voltageZero) * voltageMultiplier)
-#    currentSamplesCorrected = []
-#    for c in currentSamples:
-#        currentSamplesCorrected.append((c - currentZero) * currentMultiplier)
-
-    dt = powerSamplesList[0].sampleIntervalUs / 1000.0 / 1000.0
-    powerSum = 0.0
-    currentSum = 0.0
-    voltageSum = 0.0
-    timeSum = 0.0
-    for i in range(0, len(voltageSamples)):
-        powerSum += voltageSamplesCorrected[i] * currentSamplesCorrected[i] * dt
-        currentSum += currentSamplesCorrected[i] * currentSamplesCorrected[i] * dt
-        voltageSum += voltageSamplesCorrected[i] * voltageSamplesCorrected[i] * dt
-        timeSum += dt
-    powerReal = powerSum / timeSum
-    currentRms = np.sqrt(currentSum / timeSum)
-    voltageRms = np.sqrt(voltageSum / timeSum)
-#    currentRms = (currentSum / timeSum) ** 0.5
-#    voltageRms = (voltageSum / timeSum) ** 0.5
-
-#     calculatedPower = CalculatedPower()
-#     calculatedPower.voltageZero = voltageZero
-#     calculatedPower.currentZero = currentZero
-#     calculatedPower.voltageRms = voltageRms
-#     calculatedPower.currentRms = currentRms
-#     calculatedPower.powerReal = powerReal
-#     return calculatedPower
+
+    # All samples have the same sample interval, so the time weighted averages are plain averages.
+    powerReal = np.mean(voltageSamplesCorrected * currentSamplesCorrected)
+    currentRms = np.sqrt(np.mean(currentSamplesCorrected * currentSamplesCorrected))
+    voltageRms = np.sqrt(np.mean(voltageSamplesCorrected * voltageSamplesCorrected))
     return {
         "voltageZero": voltageZero,
         "currentZero": currentZero,
@@ -89,73 +74,173 @@ def calcPower(powerSamplesList, voltageMultiplier, currentMultiplier):
 
 def calcZero(samples):
     return np.mean(samples)
-    # sumVal = 0.0
-    # for s in samples:
-    #     sumVal += s
-    # return sumVal / len(samples)
-
-def pollKeyboard():
-    # dr, dw, de = select.select([sys.stdin], [], [], 0)
-    # if not dr == []:
-    #     return sys.stdin.read(1)
-    return None
-
-# Initialize the Bluetooth Core.
-core = CrownstoneBle(hciIndex=args.hciIndex)
-core.loadSettingsFromFile(args.keyFile)
-
-try:
-    print("Connecting to", args.bleAddress)
-    core.connect(args.bleAddress)
-
-    voltageZero = []
-    currentZero = []
-    powerReal = []
-    currentRms = []
-    voltageRms = []
-
-    output = {}
-    output["voltageGroundTruth"] = args.voltageGroundTruth
-    output["currentGroundTruth"] = args.currentGroundTruth
-    output["powerGroundTruth"] = args.powerGroundTruth
-    output["calculated"] = []
-    output["voltageSampes"] = []
-    output["currentSampes"] = []
 
+class RecordJob:
+    def __init__(self, bleAddress, step, stepIndex):
+        self.bleAddress = bleAddress
+        self.step = step
+        self.stepIndex = stepIndex
+        self.attempts = 0
+
+class BleTimer:
+    """
+    Keeps up how long the adapter was busy.
+    Time spent waiting for the user, at the prompt, is not counted as idle time.
+    """
+    def __init__(self):
+        self.startTime = time.time()
+        self.busyTime = 0.0
+        self.excludedTime = 0.0
+
+    def add(self, startTime):
+        self.busyTime += time.time() - startTime
+
+    def exclude(self, startTime):
+        self.excludedTime += time.time() - startTime
+
+    def getBusyFraction(self):
+        return self.busyTime / max(time.time() - self.startTime - self.excludedTime, 1e-9)
+
+async def retrieveSamples(core, job, numBuffers, samplesQueue, bleTimer):
+    """
+    Connects to the Crownstone of the job, and puts each set of power samples on the queue as soon as it's retrieved.
+    """
+    startTime = time.time()
+    print("Connecting to", job.bleAddress)
+    await core.connect(job.bleAddress)
     try:
-        for i in range(0, 20):
-#            print("Retrieving power samples..")
-
-#            powerSamplesUnfiltered = core.debug.getPowerSamples(PowerSamplesType.NOW_UNFILTERED)
-#            power = calcPower(powerSamplesUnfiltered, MULTIPLIER_VOLTAGE, MULTIPLIER_CURRENT)
-#            print("Unfiltered:", power)
-
-            powerSamplesFiltered = core.debug.getPowerSamples(PowerSamplesType.NOW_FILTERED)
-            power = calcPower(powerSamplesFiltered, MULTIPLIER_VOLTAGE, MULTIPLIER_CURRENT)
-            print("Filtered:", power)
-
+        for i in range(0, numBuffers):
+            powerSamplesFiltered = await core.debug.getPowerSamples(PowerSamplesType.NOW_FILTERED)
+            await samplesQueue.put((job, powerSamplesFiltered))
+    finally:
+        await core.disconnect()
+        bleTimer.add(startTime)
+
+async def runJobs(core, jobQueue, numBuffers, samplesQueue, retries, bleTimer):
+    """
+    Retrieves samples for each job in the queue, retries failed jobs at the end of the queue.
+
+    :return: List of failed jobs.
+    """
+    failedJobs = []
+    while not jobQueue.empty():
+        job = jobQueue.get_nowait()
+        job.attempts += 1
+        # Start over when a job is retried.
+        await samplesQueue.put((job, None))
+        try:
+            await retrieveSamples(core, job, numBuffers, samplesQueue, bleTimer)
+            await samplesQueue.put((job, []))
+        except Exception as err:
+            print("Failed to get power samples of", job.bleAddress, ":", err)
+            if job.attempts <= retries:
+                jobQueue.put_nowait(job)
+            else:
+                failedJobs.append(job)
+    return failedJobs
+
+def writeOutput(fileName, output):
+    with open(fileName, 'w') as outfile:
+        json.dump(output, outfile)
+
+async def processSamples(samplesQueue, outputPrefix):
+    """
+    Calculates the power of the retrieved samples, and writes the output file of a job once it's done.
+
+    Queue items are (job, packets), where packets is:
+    - None:  the job (re)started, clear previous results.
+    - []:    the job is done, write the output file.
+    - Otherwise: a list of PowerSamplesPacket.
+    """
+    loop = asyncio.get_running_loop()
+    outputs = {}
+    while True:
+        item = await samplesQueue.get()
+        if item is None:
+            return
+        job, packets = item
+        if packets is None:
+            outputs[job] = {
+                "bleAddress": job.bleAddress,
+                "voltageGroundTruth": job.step[0],
+                "currentGroundTruth": job.step[1],
+                "powerGroundTruth": job.step[2],
+                "calculated": [],
+                "voltageSampes": [],
+                "currentSampes": [],
+            }
+        elif len(packets) == 0:
+            output = outputs.pop(job)
+            fileName = outputPrefix + "_" + job.bleAddress + "_" + str(job.step[2]) + "W.txt"
+            # Write in a thread, so that it doesn't hold up the retrieval.
+            await loop.run_in_executor(None, writeOutput, fileName, output)
+            print("Wrote", fileName)
+        else:
+            power = calcPower(packets, MULTIPLIER_VOLTAGE, MULTIPLIER_CURRENT)
+            output = outputs[job]
             output["calculated"].append(power)
-            output["voltageSampes"].append(powerSamplesFiltered[0].samples)
-            output["currentSampes"].append(powerSamplesFiltered[1].samples)
-
-            key = pollKeyboard()
-            if key is not None:
-                print("Pressed:", key)
-
-        fileName = args.outputPrefix + "_" + args.bleAddress + "_" + str(args.powerGroundTruth) + "W.txt"
-        with open(fileName, 'w') as outfile:
-            json.dump(output, outfile)
-
+            output["voltageSampes"].append(packets[0].samples)
+            output["currentSampes"].append(packets[1].samples)
+
+async def waitForStep(step, stepIndex, noPrompt):
+    print("Step", stepIndex, ": V={} C={} P={}".format(*step))
+    if not noPrompt:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, input, "Set the load, and press enter to start recording.")
+
+def createCore(args):
+    if args.simulate:
+        from simulated_crownstone import SimulatedCrownstoneBle, SimulatedDevice
+        devices = [SimulatedDevice(address, seed=i) for i, address in enumerate(args.bleAddresses)]
+        return SimulatedCrownstoneBle(devices)
+    from crownstone_ble import CrownstoneBle
+    core = CrownstoneBle(bleAdapterAddress=args.adapterAddress)
+    core.loadSettingsFromFile(args.keyFile)
+    return core
+
+def setSimulatedStep(core, step):
+    # Let the simulated samples match the ground truth.
+    for device in core.devices.values():
+        device.voltageAmplitude = step[0] * np.sqrt(2) / abs(MULTIPLIER_VOLTAGE)
+        device.currentAmplitude = step[1] * np.sqrt(2) / MULTIPLIER_CURRENT
+
+async def main():
+    args = parser.parse_args()
+    steps = args.steps
+    if steps is None:
+        steps = [[args.voltageGroundTruth, args.currentGroundTruth, args.powerGroundTruth]]
+
+    core = createCore(args)
+    bleTimer = BleTimer()
+    failedJobs = []
+    try:
+        for stepIndex, step in enumerate(steps):
+            promptStartTime = time.time()
+            await waitForStep(step, stepIndex, args.noPrompt)
+            bleTimer.exclude(promptStartTime)
+            if args.simulate:
+                setSimulatedStep(core, step)
+
+            jobQueue = asyncio.Queue()
+            for bleAddress in args.bleAddresses:
+                jobQueue.put_nowait(RecordJob(bleAddress, step, stepIndex))
+
+            samplesQueue = asyncio.Queue()
+            processTask = asyncio.create_task(processSamples(samplesQueue, args.outputPrefix))
+            try:
+                failedJobs.extend(await runJobs(core, jobQueue, args.numBuffers, samplesQueue, args.retries, bleTimer))
+            finally:
+                await samplesQueue.put(None)
+                await processTask
     except Exception as err:
-        print("Failed to get power samples:", err)
+        print("Failed to record:", err)
         traceback.print_exc()
 
-    print("Disconnect")
-    core.control.disconnect()
-
-except Exception as err:
-    print("Failed to connect:", err)
-
+    for job in failedJobs:
+        print("Failed to record", job.bleAddress, "at step", job.stepIndex)
+    print("BLE busy {:.1f}% of the time".format(bleTimer.getBusyFraction() * 100))
 
+    await core.shutDown()
 
-core.shutDown()
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+A local stand-in for CrownstoneBle, that serves canned power samples.
+
+Can be used to run scripts that retrieve power samples without hardware, and to benchmark them.
+Only implements the parts of the CrownstoneBle API that are used by these scripts.
+"""
+
+import asyncio
+import json
+import struct
+
+import numpy as np
+
+from crownstone_core.packets.debug.PowerSamplesPacket import PowerSamplesPacket
+from crownstone_core.protocol.BluenetTypes import PowerSamplesType
+
+SAMPLE_INTERVAL_US = 200
+NUM_SAMPLES = 100
+
+def serializePowerSamples(samplesType, index, timestamp, samples, offset=0, multiplier=1.0, sampleIntervalUs=SAMPLE_INTERVAL_US, delayUs=0):
+    """
+    Serializes samples as a power samples result payload, as sent by the firmware.
+    """
+    data = struct.pack("<BBHIHHHhf", int(samplesType), index, len(samples), timestamp & 0xFFFFFFFF,
+                       delayUs, sampleIntervalUs, 0, offset, multiplier)
+    data += struct.pack("<%dh" % len(samples), *samples)
+    return list(data)
+
+def generateSamples(amplitude, zero, phase, frequency=50, noise=3.0, numSamples=NUM_SAMPLES, rng=None):
+    """
+    Generates a buffer of sine wave samples.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    t = np.arange(numSamples) * SAMPLE_INTERVAL_US / 1000.0 / 1000.0
+    samples = amplitude * np.sin(2 * np.pi * frequency * t + phase) + zero + rng.normal(0, noise, numSamples)
+    return np.clip(np.round(samples), -32768, 32767).astype(int).tolist()
+
+def loadCannedBuffers(fileName):
+    """
+    Loads voltage and current buffers from a file recorded with calibrate-power/record.py.
+
+    :return: List of (voltageSamples, currentSamples).
+    """
+    with open(fileName, 'r') as infile:
+        data = json.load(infile)
+    return list(zip(data["voltageSampes"], data["currentSampes"]))
+
+class SimulatedDevice:
+    """
+    A simulated Crownstone, serving canned power samples.
+    """
+    def __init__(self, address, cannedBuffers=None, voltageAmplitude=1300.0, currentAmplitude=300.0, seed=None):
+        """
+        :param address:          MAC address of the simulated Crownstone.
+        :param cannedBuffers:    List of (voltageSamples, currentSamples) to serve in order.
+                                 When None, sine waves with given amplitudes are generated.
+        """
+        self.address = address
+        self.cannedBuffers = cannedBuffers
+        self.voltageAmplitude = voltageAmplitude
+        self.currentAmplitude = currentAmplitude
+        self.rng = np.random.default_rng(seed)
+        self.bufferIndex = 0
+        self.timestamp = 0
+        # A device can only be connected to one adapter at a time.
+        self.connected = False
+
+    def getPowerSamples(self, samplesType):
+        """
+        :return: List of PowerSamplesPacket: voltage followed by current.
+        """
+        if self.cannedBuffers:
+            voltageSamples, currentSamples = self.cannedBuffers[self.bufferIndex % len(self.cannedBuffers)]
+        else:
+            phase = self.rng.uniform(0, 2 * np.pi)
+            voltageSamples = generateSamples(self.voltageAmplitude, 2048, phase, rng=self.rng)
+            currentSamples = generateSamples(self.currentAmplitude, 2048, phase, rng=self.rng)
+        self.bufferIndex += 1
+        self.timestamp += 1
+        return [
+            PowerSamplesPacket(serializePowerSamples(samplesType, 0, self.timestamp, voltageSamples)),
+            PowerSamplesPacket(serializePowerSamples(samplesType, 1, self.timestamp, currentSamples)),
+        ]
+
+class SimulatedBleError(Exception):
+    pass
+
+class SimulatedDebugHandler:
+    def __init__(self, core):
+        self.core = core
+
+    async def getPowerSamples(self, samplesType: PowerSamplesType):
+        device = self.core._getConnectedDevice()
+        await asyncio.sleep(self.core.requestTime)
+        return device.getPowerSamples(samplesType)
+
+class SimulatedCrownstoneBle:
+    """
+    Replaces CrownstoneBle, with simulated devices and delays.
+    Like a real adapter, it can only be connected to one device at a time.
+    """
+    def __init__(self, devices, connectTime=0.5, requestTime=0.1, disconnectTime=0.05, connectFailureRate=0.0, seed=None):
+        """
+        :param devices:            List of SimulatedDevice. Can be shared between multiple simulated adapters.
+        :param connectTime:        Time in seconds it takes to connect.
+        :param requestTime:        Time in seconds it takes to retrieve a set of power samples.
+        :param disconnectTime:     Time in seconds it takes to disconnect.
+        :param connectFailureRate: Probability that a connect fails.
+        """
+        self.devices = {device.address.upper(): device for device in devices}
+        self.connectTime = connectTime
+        self.requestTime = requestTime
+        self.disconnectTime = disconnectTime
+        self.connectFailureRate = connectFailureRate
+        self.rng = np.random.default_rng(seed)
+        self.connectedAddress = None
+        self.debug = SimulatedDebugHandler(self)
+
+    def loadSettingsFromFile(self, path):
+        pass
+
+    async def connect(self, address, timeout=5, attempts=3, ignoreEncryption=False):
+        if self.connectedAddress is not None:
+            raise SimulatedBleError("Already connected to " + self.connectedAddress)
+        await asyncio.sleep(self.connectTime)
+        device = self.devices.get(address.upper())
+        if device is None or device.connected or self.rng.random() < self.connectFailureRate:
+            raise SimulatedBleError("Could not connect to " + address)
+        device.connected = True
+        self.connectedAddress = address.upper()
+
+    async def disconnect(self):
+        await asyncio.sleep(self.disconnectTime)
+        self._release()
+
+    async def shutDown(self):
+        self._release()
+
+    def _release(self):
+        if self.connectedAddress is not None:
+            self.devices[self.connectedAddress].connected = False
+        self.connectedAddress = None
+
+    def _getConnectedDevice(self):
+        if self.connectedAddress is None:
+            raise SimulatedBleError("Not connected")
+        return self.devices[self.connectedAddress]
@@ -3,15 +3,25 @@
 """
 Use recorded data as input, and fit a curve to that.
 
-For json: recorded data with record-voltage.py
+For json, jsonl or jsonl.gz: recorded data with record-voltage.py
 For txt of log: recorded UART logs.
+
+Usage:
+    ./curve-fit-voltage.py file1.json [file2.json ...]
+    ./curve-fit-voltage.py --benchmark file1.json [file2.json ...]
+
+The benchmark mode fits all curves of all files with every algorithm on a worker pool,
+and prints a table of speed vs accuracy per algorithm.
 """
 
 import sys
+import time
 from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.append('../record')
 import parse_recorded_voltage
+import capture_file
 import parse_uart_log
 
 import numpy as np
@@ -43,6 +53,15 @@ MAX_FREQ = 60
 
 NUM_FIT_ITERATIONS_GN = 10
 
+# Number of worker processes used in benchmark mode, None to use the number of CPUs.
+BENCHMARK_NUM_WORKERS = None
+
+# Number of curves per benchmark job.
+BENCHMARK_CHUNK_SIZE = 16
+
+# Stop iterating a curve in the batched GN fit when the parameters change less than this (relative).
+GN_BATCH_TOLERANCE = 1e-9
+
 class algoName(Enum):
     guess = 0
     truth = 1
@@ -61,51 +80,115 @@ def get_curve(t, beta):
     amp, ang_freq, phase, mean = beta
     return amp * np.sin(ang_freq * t + phase) + mean
 
-def get_phase_estimate(t, y, y_mean):
-    # Determine phase by first zero crossing
-    below = y[0] < y_mean
-#    print("below=", below)
-    guess_phase = 0.0
-    for k in range(1, len(y)):
-        if (below and y[k] > y_mean):
-            # Upward crossing found
-            # Phase = - t / T * 2*pi
-            guess_phase = -t[k] / (1 / ESTIMATED_FREQUENCY) * 2 * np.pi
-#            print("Upward crossing at k=", k, " periods=", t[k] / (1 / ESTIMATED_FREQUENCY))
-#            print("phase=", guess_phase / np.pi, "pi")
-            break
-        if (not below and y[k] < y_mean):
-            # Downward crossing found
-            # Should be at t = T * pi
-            # Phase = pi - t / T * 2pi
-            guess_phase = np.pi - t[k] / (1 / ESTIMATED_FREQUENCY) * 2 * np.pi
-#            print("Downward crossing at k=", k, " periods=", t[k] / (1 / ESTIMATED_FREQUENCY))
-#            print("phase=", guess_phase / np.pi, "pi")
-            break
+def get_phase_estimates(t, y, y_mean):
+    """
+    Estimates the phase of a batch of windows, by the first zero crossing of each window.
+
+    :param t:      Timestamps in seconds, shape (N, M).
+    :param y:      Samples, shape (N, M).
+    :param y_mean: Mean of each window, shape (N,).
+    :return:       Phases in range [-pi, pi], shape (N,). 0 for windows without a crossing.
+    """
+    t = np.atleast_2d(t)
+    y = np.atleast_2d(y)
+    y_mean = np.reshape(y_mean, (-1, 1))
+
+    # Side of the mean at which each sample is: -1 below, 1 above, 0 at the mean.
+    side = np.sign(y - y_mean)
+    below = side[:, 0] < 0
+
+    # A crossing is the first sample at the other side than the first sample.
+    crossed = np.where(below[:, np.newaxis], side > 0, side < 0)
+    crossed[:, 0] = False
+    found = crossed.any(axis=1)
+    k = np.argmax(crossed, axis=1)
+    t_crossing = t[np.arange(len(t)), k]
+
+    # Upward crossing:   phase = - t / T * 2pi
+    # Downward crossing: should be at t = T * pi, so phase = pi - t / T * 2pi
+    guess_phase = np.where(below, 0.0, np.pi) - t_crossing / (1 / ESTIMATED_FREQUENCY) * 2 * np.pi
+    guess_phase = np.where(found, guess_phase, 0.0)
+
     # Make sure phase is in range [-pi, pi]
-    while (guess_phase > np.pi):
-        guess_phase -= 2 * np.pi
-    while (guess_phase < -np.pi):
-        guess_phase += 2 * np.pi
-    return guess_phase
+    numWraps = np.where(guess_phase > np.pi, np.ceil((guess_phase - np.pi) / (2 * np.pi)), 0)
+    numWraps -= np.where(guess_phase < -np.pi, np.ceil((-np.pi - guess_phase) / (2 * np.pi)), 0)
+    return guess_phase - numWraps * 2 * np.pi
 
-def remove_peaks(t, y, mean, amplitude, part):
+def get_phase_estimate(t, y, y_mean):
+    return get_phase_estimates(t, y, [y_mean])[0]
+
+def remove_peaks_batch(t, y, mean, amplitude, part):
     """
-    Removes values that are
+    Removes values of a batch of windows that are
     - above: mean + (1 - part) * amplitude
     - below: mean - (1 - part) * amplitude
+
+    :param t:         Timestamps, shape (N, M).
+    :param y:         Samples, shape (N, M).
+    :param mean:      Mean of each window, shape (N,).
+    :param amplitude: Amplitude of each window, shape (N,).
+    :return:          Tuple (offsets, t, y), where t and y are the remaining values of all windows concatenated,
+                      and the values of window n are at [offsets[n] : offsets[n+1]].
     """
+    t = np.atleast_2d(t)
+    y = np.atleast_2d(y)
+    mean = np.reshape(mean, (-1, 1))
+    amplitude = np.reshape(amplitude, (-1, 1))
     maxY = mean + (1 - part) * amplitude
     minY = mean - (1 - part) * amplitude
-    newT = []
-    newY = []
-    for i in range(0, len(y)):
-        if (minY < y[i] < maxY):
-            newT.append(t[i])
-            newY.append(y[i])
-    return np.array(newT), np.array(newY)
-
-def fit_lm(t, y, beta0, boundaries):
+    keep = (minY < y) & (y < maxY)
+    offsets = np.zeros(len(y) + 1, dtype=int)
+    np.cumsum(np.count_nonzero(keep, axis=1), out=offsets[1:])
+    return offsets, t[keep], y[keep]
+
+def remove_peaks(t, y, mean, amplitude, part):
+    """
+    Removes values that are
+    - above: mean + (1 - part) * amplitude
+    - below: mean - (1 - part) * amplitude
+    """
+    offsets, newT, newY = remove_peaks_batch(t, y, [mean], [amplitude], part)
+    return newT, newY
+
+def ragged_to_padded(offsets, values):
+    """
+    Converts ragged values in offsets+values layout to a zero padded 2D array and a mask of the valid values.
+    """
+    sizes = np.diff(offsets)
+    mask = np.arange(max(np.max(sizes, initial=0), 1)) < sizes[:, np.newaxis]
+    padded = np.zeros(mask.shape, dtype=np.asarray(values).dtype)
+    padded[mask] = values
+    return padded, mask
+
+def preprocess_batch(t, y):
+    """
+    Determines the initial guesses and the fit input of a batch of windows.
+
+    :param t: Timestamps in seconds, shape (N, M).
+    :param y: Samples, shape (N, M).
+    :return:  Dict with:
+              - beta0: initial guesses, shape (N, 4).
+              - offsets, t_filtered, y_filtered: the samples without peaks, in offsets+values layout,
+                see remove_peaks_batch().
+    """
+    t = np.atleast_2d(np.asarray(t, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+
+    guess_mean = np.mean(y, axis=1)
+    guess_amp = np.max(y, axis=1) - guess_mean
+    guess_angular_frequency = np.full(len(y), 2 * np.pi * ESTIMATED_FREQUENCY)
+    guess_phase = get_phase_estimates(t, y, guess_mean)
+    beta0 = np.stack([guess_amp, guess_angular_frequency, guess_phase, guess_mean], axis=1)
+
+    offsets, t_filtered, y_filtered = remove_peaks_batch(t, y, guess_mean, guess_amp, REMOVE_PEAKS_PERCENTAGE / 100.0)
+    return {
+        'beta0': beta0,
+        'offsets': offsets,
+        't_filtered': t_filtered,
+        'y_filtered': y_filtered,
+    }
+
+def fit_lm(t, y, beta0, boundaries, stats=None):
     optimize_func = lambda x: x[0] * np.sin(x[1] * t + x[2]) + x[3] - y
     lsq = least_squares(optimize_func,
                         beta0,
@@ -113,9 +196,11 @@ def fit_lm(t, y, beta0, boundaries):
                         loss='linear')
     if (not lsq.success):
         print("lm status:", lsq.message)
+    if stats is not None:
+        stats['nfev'] = lsq.nfev
     return lsq.x
 
-def fit_gn(t, y, beta0, boundaries):
+def fit_gn(t, y, beta0, boundaries, stats=None):
     optimize_func = lambda x: x[0] * np.sin(x[1] * t + x[2]) + x[3] - y
     jacobian = lambda x: [
         np.sin(x[1] * t + x[2]),
@@ -126,9 +211,60 @@ def fit_gn(t, y, beta0, boundaries):
     gn = gauss_newton.gauss_newton(optimize_func,
                                    beta0,
                                    jacobian, NUM_FIT_ITERATIONS_GN)
+    if stats is not None:
+        stats['nfev'] = NUM_FIT_ITERATIONS_GN
     return gn
 
-def fit_bound(t, y, beta0, boundaries):
+def fit_gn_batch(t, y, beta0, mask=None):
+    """
+    Fits many curves at once with the batched Gauss-Newton solver.
+
+    :param t:     Timestamps, shape (N, M).
+    :param y:     Samples, shape (N, M).
+    :param beta0: Initial guesses, shape (N, 4).
+    :param mask:  Optional boolean array of shape (N, M), False for samples that should be ignored.
+                  This allows curves with a different number of samples to be fitted together.
+
+    :return: Tuple (betas, numIterations), with shapes (N, 4) and (N,).
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if mask is None:
+        weights = np.ones(y.shape)
+    else:
+        weights = np.asarray(mask, dtype=float)
+
+    def optimize_func(x, indices):
+        angle = x[:, 1:2] * t[indices] + x[:, 2:3]
+        return (x[:, 0:1] * np.sin(angle) + x[:, 3:4] - y[indices]) * weights[indices]
+
+    def jacobian(x, indices):
+        tk = t[indices]
+        angle = x[:, 1:2] * tk + x[:, 2:3]
+        cos = np.cos(angle)
+        j = np.empty(tk.shape + (4,))
+        j[..., 0] = np.sin(angle)
+        j[..., 1] = x[:, 0:1] * tk * cos
+        j[..., 2] = x[:, 0:1] * cos
+        j[..., 3] = 1
+        return j * weights[indices][..., np.newaxis]
+
+    return gauss_newton.gauss_newton_batch(optimize_func,
+                                           beta0,
+                                           jacobian, NUM_FIT_ITERATIONS_GN, GN_BATCH_TOLERANCE)
+
+def fit_gn_ragged(offsets, t, y, beta0):
+    """
+    Fits many curves at once with the batched Gauss-Newton solver,
+    with the input in offsets+values layout, as returned by preprocess_batch().
+
+    :return: Tuple (betas, numIterations), with shapes (N, 4) and (N,).
+    """
+    t, mask = ragged_to_padded(offsets, t)
+    y, mask = ragged_to_padded(offsets, y)
+    return fit_gn_batch(t, y, beta0, mask)
+
+def fit_bound(t, y, beta0, boundaries, stats=None):
     optimize_func = lambda x: x[0] * np.sin(x[1] * t + x[2]) + x[3] - y
     jacobian = lambda x: np.array([
         np.sin(x[1] * t + x[2]),
@@ -148,10 +284,209 @@ def fit_bound(t, y, beta0, boundaries):
 
     if (not lsq.success):
         print("bound status:", lsq.message)
+    if stats is not None:
+        stats['nfev'] = lsq.nfev
     return lsq.x
 
 
+def get_curves(fileNames):
+    """
+    Yields (i, t, y) of each consecutive part of the recorded files that is long enough for the truth fit.
+    The timestamps are in seconds, starting at 0, and i is the index of the part within its file.
+    """
+    for fileName in fileNames:
+
+        if (capture_file.isCaptureFile(fileName)):
+            allTimestamps, allSamples = parse_recorded_voltage.parse(fileName)
+        else:
+            parsed = parse_uart_log.parse(fileName)
+
+        for i in range(0, len(allTimestamps)):
+            if (len(allTimestamps[i]) < NUM_SAMPLES_FOR_TRUTH_FIT):
+                continue
+
+            t = np.array(allTimestamps[i][0:NUM_SAMPLES_FOR_TRUTH_FIT])
+            y = np.array(allSamples[i][0:NUM_SAMPLES_FOR_TRUTH_FIT])
+
+            # Change to seconds.
+            t /= 1000
+
+            # Let time start at 0, else we run into some numerical issues,
+            # probably cos(large_number) doesn't work too well?
+            t = t - t[0]
+            yield i, t, y
+
+def get_fit_input(t_truth, y_truth):
+    """
+    Determines the initial guess, boundaries, and filtered input of the fits for a single curve.
+    """
+    t = t_truth[0:NUM_SAMPLES_FOR_FIT]
+    y = y_truth[0:NUM_SAMPLES_FOR_FIT]
+
+    # Doesn't really matter if we use np.mean(y) or (max(y) - min(y)) / 2 + min(y)
+#    guess_mean = (max(y) - min(y)) / 2 + min(y)
+    guess_mean = np.mean(y)
+    guess_amp = max(y) - guess_mean
+    guess_angular_frequency = 2 * np.pi * ESTIMATED_FREQUENCY
+    guess_phase = get_phase_estimate(t, y, guess_mean)
+
+    boundaries = ([guess_amp * 0.5, 2 * np.pi * MIN_FREQ, -1 * np.pi, guess_mean * 0.5],
+                  [guess_amp * 1.5, 2 * np.pi * MAX_FREQ,  1 * np.pi, guess_mean * 1.5])
+
+    beta0 = [guess_amp, guess_angular_frequency, guess_phase, guess_mean]
+
+    t_filtered, y_filtered = remove_peaks(t, y, guess_mean, guess_amp, REMOVE_PEAKS_PERCENTAGE / 100.0)
+    t_truth_filtered, y_truth_filtered = remove_peaks(t_truth, y_truth, guess_mean, guess_amp, REMOVE_PEAKS_PERCENTAGE / 100.0)
+
+    return {
+        't': t,
+        'y': y,
+        'beta0': beta0,
+        'boundaries': boundaries,
+        't_filtered': t_filtered,
+        'y_filtered': y_filtered,
+        't_truth_filtered': t_truth_filtered,
+        'y_truth_filtered': y_truth_filtered,
+    }
+
+def fit_curve(algo, fitInput, stats=None):
+    """
+    Fits a single curve with given algorithm.
+
+    :param algo:     The algoName.
+    :param fitInput: Dict as returned by get_fit_input().
+    :param stats:    Optional dict, will be filled with 'nfev': the number of function evaluations.
+    :return:         The fitted beta.
+    """
+    beta0 = fitInput['beta0']
+    boundaries = fitInput['boundaries']
+    if algo == algoName.guess:
+        if stats is not None:
+            stats['nfev'] = 0
+        return beta0
+    if algo == algoName.truth:
+        return fit_lm(fitInput['t_truth_filtered'], fitInput['y_truth_filtered'], beta0, boundaries, stats)
+    fitFunc = {
+        algoName.gn: fit_gn,
+        algoName.lm: fit_lm,
+        algoName.bound: fit_bound,
+    }[algo]
+    return fitFunc(fitInput['t_filtered'], fitInput['y_filtered'], beta0, boundaries, stats)
+
+def benchmark_job(algo, curves):
+    """
+    Fits a chunk of curves with a single algorithm, to be executed by a worker process.
+
+    :param algo:   The algoName.
+    :param curves: List of (t_truth, y_truth).
+    :return:       List of (beta, time, nfev, error, preprocess time) per curve.
+                   The time of the fit excludes the preprocessing, which is timed separately.
+    """
+    results = []
+    for t_truth, y_truth in curves:
+        startTime = time.perf_counter()
+        fitInput = get_fit_input(t_truth, y_truth)
+        preprocessDuration = time.perf_counter() - startTime
+        stats = {}
+        startTime = time.perf_counter()
+        beta = fit_curve(algo, fitInput, stats)
+        duration = time.perf_counter() - startTime
+        error = get_error(fitInput['y'], get_curve(fitInput['t'], beta))
+        results.append((beta, duration, stats['nfev'], error, preprocessDuration))
+    return results
+
+def benchmark_gn_batch(curves):
+    """
+    Preprocesses and fits all curves with a single call to the batched Gauss-Newton fit.
+
+    :return: Tuple (betas, fit time, numIterations, errors, preprocess time).
+    """
+    t = np.array([t_truth[0:NUM_SAMPLES_FOR_FIT] for t_truth, y_truth in curves])
+    y = np.array([y_truth[0:NUM_SAMPLES_FOR_FIT] for t_truth, y_truth in curves], dtype=float)
+    startTime = time.perf_counter()
+    fitInput = preprocess_batch(t, y)
+    preprocessDuration = time.perf_counter() - startTime
+    startTime = time.perf_counter()
+    betas, numIterations = fit_gn_ragged(fitInput['offsets'], fitInput['t_filtered'], fitInput['y_filtered'], fitInput['beta0'])
+    duration = time.perf_counter() - startTime
+    errors = [get_error(y[n], get_curve(t[n], betas[n])) for n in range(0, len(curves))]
+    return betas, duration, numIterations, np.array(errors), preprocessDuration
+
+def print_benchmark_row(name, numCurves, times, nfevs, errors, freqDiffs):
+    print('{:<10} {:>7} {:>12.3f} {:>12.3f} {:>12.1f} {:>14.4g} {:>14.4g} {:>16.2f}'.format(
+        name,
+        numCurves,
+        np.mean(times) * 1000,
+        np.percentile(times, 95) * 1000,
+        np.mean(nfevs),
+        np.mean(errors),
+        np.median(errors),
+        np.median(freqDiffs) * 1000))
+
+def print_preprocess_row(name, numCurves, times):
+    print('{:<10} {:>7} {:>12.3f} {:>12.3f} {:>12} {:>14} {:>14} {:>16}'.format(
+        name,
+        numCurves,
+        np.mean(times) * 1000,
+        np.percentile(times, 95) * 1000,
+        '-', '-', '-', '-'))
+
+def benchmark(fileNames):
+    """
+    Fits all curves of all files with each algorithm on a worker pool,
+    and prints a table with the speed and accuracy of each algorithm.
+
+    The accuracy is given by the error with the samples, and the frequency difference with the truth fit.
+    The times of the fits exclude the preprocessing (initial guess and peak removal), which gets its own rows.
+    """
+    curves = [(t, y) for i, t, y in get_curves(fileNames)]
+    print("Benchmarking", len(curves), "curves")
+    if len(curves) == 0:
+        return
+
+    chunks = [curves[k:k + BENCHMARK_CHUNK_SIZE] for k in range(0, len(curves), BENCHMARK_CHUNK_SIZE)]
+
+    startTime = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=BENCHMARK_NUM_WORKERS) as executor:
+        futures = {}
+        for algo in algoName:
+            futures[algo] = [executor.submit(benchmark_job, algo, chunk) for chunk in chunks]
+        for algo in algoName:
+            results[algo] = []
+            for future in futures[algo]:
+                results[algo].extend(future.result())
+    wallTime = time.perf_counter() - startTime
+
+    truthFreqs = np.array([r[0][1] for r in results[algoName.truth]]) / (2 * np.pi)
+
+    print('{:<10} {:>7} {:>12} {:>12} {:>12} {:>14} {:>14} {:>16}'.format(
+        'algo', 'curves', 'mean [ms]', 'p95 [ms]', 'mean nfev', 'mean error', 'median error', 'median |Δf| mHz'))
+    for algo in algoName:
+        betas = np.array([r[0] for r in results[algo]])
+        times = np.array([r[1] for r in results[algo]])
+        nfevs = np.array([r[2] for r in results[algo]])
+        errors = np.array([r[3] for r in results[algo]])
+        freqDiffs = np.abs(betas[:, 1] / (2 * np.pi) - truthFreqs)
+        print_benchmark_row(algo.name, len(curves), times, nfevs, errors, freqDiffs)
+
+    # The preprocessing is the same for each algorithm, so only show it once.
+    print_preprocess_row('preprocess', len(curves), np.array([r[4] for r in results[algoName.guess]]))
+
+    # The batched preprocessing and fit are each timed as a whole, so show the time per curve.
+    betas, duration, numIterations, errors, preprocessDuration = benchmark_gn_batch(curves)
+    freqDiffs = np.abs(betas[:, 1] / (2 * np.pi) - truthFreqs)
+    times = np.full(len(curves), duration / len(curves))
+    print_benchmark_row('gn_batch', len(curves), times, numIterations, errors, freqDiffs)
+    print_preprocess_row('prep_batch', len(curves), np.full(len(curves), preprocessDuration / len(curves)))
+
+    print("Wall time of the worker pool: {:.3f} s".format(wallTime))
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        benchmark(sys.argv[2:])
+        return
+
     fileNames = sys.argv[1:]
 
     print(fileNames)
@@ -167,64 +502,35 @@ def main():
         betas[algo_labels[i]] = []
         errors[algo_labels[i]] = []
 
-
     for fileName in fileNames:
 
-        if (fileName.split('.')[-1] == 'json'):
-            allTimestamps, allSamples = parse_recorded_voltage.parse(fileName)
-        else:
-            parsed = parse_uart_log.parse(fileName)
-
         prevLastTime = 0
         numCurves = 0
 
-        for i in range(0, len(allTimestamps)):
-            if (len(allTimestamps[i]) < NUM_SAMPLES_FOR_TRUTH_FIT):
-                continue
+        for i, t_truth, y_truth in get_curves([fileName]):
             print("i", i)
 
-            t = np.array(allTimestamps[i][0:NUM_SAMPLES_FOR_TRUTH_FIT])
-            y = np.array(allSamples[i][0:NUM_SAMPLES_FOR_TRUTH_FIT])
-
-            # Change to seconds.
-            t /= 1000
-
-            # Let time start at 0, else we run into some numerical issues,
-            # probably cos(large_number) doesn't work too well?
-            t = t - t[0]
-
-            t_truth = t
-            y_truth = y
-            t = t[0:NUM_SAMPLES_FOR_FIT]
-            y = y[0:NUM_SAMPLES_FOR_FIT]
+            fitInput = get_fit_input(t_truth, y_truth)
+            t = fitInput['t']
+            y = fitInput['y']
             t_orig = t
+            t_filtered = fitInput['t_filtered']
+            y_filtered = fitInput['y_filtered']
+            boundaries = fitInput['boundaries']
 
-            # Doesn't really matter if we use np.mean(y) or (max(y) - min(y)) / 2 + min(y)
-#            guess_mean = (max(y) - min(y)) / 2 + min(y)
-            guess_mean = np.mean(y)
-            guess_amp = max(y) - guess_mean
-            guess_angular_frequency = 2 * np.pi * ESTIMATED_FREQUENCY
-            guess_phase = get_phase_estimate(t, y, guess_mean)
-
-            boundaries = ([guess_amp * 0.5, 2 * np.pi * MIN_FREQ, -1 * np.pi, guess_mean * 0.5],
-                          [guess_amp * 1.5, 2 * np.pi * MAX_FREQ,  1 * np.pi, guess_mean * 1.5])
-
-            beta0 = [guess_amp, guess_angular_frequency, guess_phase, guess_mean]
+            beta0 = fitInput['beta0']
             guess_curve = get_curve(t, beta0)
 
-            t_filtered, y_filtered = remove_peaks(t, y, guess_mean, guess_amp, REMOVE_PEAKS_PERCENTAGE / 100.0)
-            t_truth_filtered, y_truth_filtered = remove_peaks(t_truth, y_truth, guess_mean, guess_amp, REMOVE_PEAKS_PERCENTAGE / 100.0)
-
-            truth_beta = fit_lm(t_truth_filtered, y_truth_filtered, beta0, boundaries)
+            truth_beta = fit_curve(algoName.truth, fitInput)
             truth_curve = get_curve(t, truth_beta)
 
-            gn_beta = fit_gn(t_filtered, y_filtered, beta0, boundaries)
+            gn_beta = fit_curve(algoName.gn, fitInput)
             gn_curve = get_curve(t, gn_beta)
 
-            lm_beta = fit_lm(t_filtered, y_filtered, beta0, boundaries)
+            lm_beta = fit_curve(algoName.lm, fitInput)
             lm_curve = get_curve(t, lm_beta)
 
-            bound_beta = fit_bound(t_filtered, y_filtered, beta0, boundaries)
+            bound_beta = fit_curve(algoName.bound, fitInput)
             bound_curve = get_curve(t, bound_beta)
 
             print_beta(algoName.guess.name, beta0)
@@ -322,4 +628,5 @@ def main():
 
     plt.show()
 
-main()
+if __name__ == '__main__':
+    main()
@@ -48,4 +48,87 @@ def gauss_newton(func, beta0, jacobian, numSteps):
         j = np.array(jacobian(beta)).transpose()
         beta = step(beta, j, r)
 #        print("beta: ", beta)
-    return beta
\ No newline at end of file
+    return beta
+
+
+def step_batch(beta, jacobian, residuals):
+    """
+    Performs a single Gauss-Newton step for a stack of curves at once.
+
+    :param beta:      Current estimates, shape (N, P).
+    :param jacobian:  Jacobians, shape (N, M, P).
+    :param residuals: Residuals, shape (N, M).
+
+    :return: Tuple (nextBeta, solved), where solved is a boolean array of shape (N,)
+             that is False for curves with a singular JᵀJ (their beta is not changed).
+    """
+    jacobianT = np.swapaxes(jacobian, 1, 2)
+    jtj = jacobianT @ jacobian
+    jtr = (jacobianT @ residuals[..., np.newaxis])[..., 0]
+    delta = np.zeros_like(beta)
+    solved = np.ones(len(beta), dtype=bool)
+    try:
+        # Solve all normal equations in one call, instead of inverting JᵀJ.
+        delta = np.linalg.solve(jtj, jtr[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        # At least one system is singular: fall back to solving them one by one.
+        for n in range(0, len(beta)):
+            try:
+                delta[n] = np.linalg.solve(jtj[n], jtr[n])
+            except np.linalg.LinAlgError:
+                solved[n] = False
+    return beta - delta, solved
+
+def gauss_newton_batch(func, beta0, jacobian, numSteps, tolerance=0.0):
+    """
+    Gauss-Newton minimization of many curves at once.
+
+    Only curves that have not converged yet are evaluated and updated,
+    and the iterations stop early once all curves converged.
+
+    Parameters
+    ----------
+    func : callable
+        Function in the form of: y_i - f(x_i, beta), with beta as function input.
+        Called as func(beta, indices), where beta has shape (K, P) and indices
+        are the K curve indices to evaluate. Should return residuals of shape (K, M).
+    beta0 : ndarray
+        The starting parameters estimates for the minimization, shape (N, P).
+    jacobian : callable
+        Derivative of func with respect to beta: dfunc / dbeta
+        Called as jacobian(beta, indices), should return an array of shape (K, M, P).
+    numSteps : int
+        Maximum number of iterations.
+    tolerance : float
+        A curve is considered converged when the largest relative parameter change
+        of a step is below this value. With 0, all numSteps iterations are performed.
+
+    Returns
+    -------
+    beta : ndarray
+        The solutions (or the result of the last iteration for unsuccessful curves),
+        shape (N, P).
+    numIterations : ndarray
+        Number of iterations performed per curve, shape (N,).
+    """
+    beta = np.array(beta0, dtype=float)
+    numIterations = np.zeros(len(beta), dtype=int)
+    active = np.ones(len(beta), dtype=bool)
+    for i in range(0, numSteps):
+        indices = np.flatnonzero(active)
+        if (len(indices) == 0):
+            break
+        prevBeta = beta[indices]
+        r = func(prevBeta, indices)
+        j = jacobian(prevBeta, indices)
+        nextBeta, solved = step_batch(prevBeta, j, r)
+        beta[indices] = nextBeta
+        numIterations[indices] += 1
+
+        # Curves that can't be solved won't change anymore.
+        converged = np.logical_not(solved)
+        if (tolerance > 0):
+            change = np.abs(nextBeta - prevBeta) / np.maximum(np.abs(prevBeta), np.finfo(float).eps)
+            converged |= np.max(change, axis=1) < tolerance
+        active[indices[converged]] = False
+    return beta, numIterations
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+"""
+Track grid frequency, phase, amplitude and offset of recorded voltage in a single pass.
+
+Instead of fitting a curve to each window from scratch, a tracker keeps a running estimate,
+and updates it with each buffer of samples:
+- A linear least squares fit of a sine with the current frequency estimate gives the amplitude,
+  offset and phase of the buffer.
+- The difference between this phase and the predicted phase (a phase locked loop with a PI loop filter)
+  corrects the phase and frequency estimate.
+
+Usage:
+    ./track-frequency.py file1.json [file2.json ...]
+
+For json, jsonl or jsonl.gz: recorded data with record-voltage.py
+"""
+
+import sys
+import argparse
+
+sys.path.append('../record')
+import parse_recorded_voltage
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+ESTIMATED_FREQUENCY = 50
+
+# Number of samples per buffer, as recorded by record-voltage.py
+BUFFER_SIZE = 100
+
+# Gains of the loop filter: part of the phase error that corrects the phase, and the frequency.
+PHASE_GAIN = 0.5
+FREQUENCY_GAIN = 0.1
+
+# Default number of buffers per output value.
+DEFAULT_DECIMATION = 50
+
+class FrequencyTracker:
+    def __init__(self, frequency=ESTIMATED_FREQUENCY):
+        self.initialFrequency = frequency
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the estimate, for example when the next buffer does not directly follow the previous one.
+        """
+        self.angularFrequency = 2 * np.pi * self.initialFrequency
+        self.phase = None
+        self.amplitude = 0.0
+        self.offset = 0.0
+        self.time = None
+
+    def update(self, t, y):
+        """
+        Update the estimate with a buffer of samples.
+
+        :param t: Timestamps in seconds, shape (M,).
+        :param y: Samples, shape (M,).
+        :return:  The phase error in radians, 0 for the first buffer after a reset.
+        """
+        t = np.asarray(t, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        # Fit y = a * sin(w * tau) + b * cos(w * tau) + c, with tau the time since the start of the buffer.
+        angle = self.angularFrequency * (t - t[0])
+        a = np.empty((len(t), 3))
+        a[:, 0] = np.sin(angle)
+        a[:, 1] = np.cos(angle)
+        a[:, 2] = 1
+        try:
+            sinCoef, cosCoef, self.offset = np.linalg.solve(a.T @ a, a.T @ y)
+        except np.linalg.LinAlgError:
+            return 0.0
+        self.amplitude = np.hypot(sinCoef, cosCoef)
+        measuredPhase = np.arctan2(cosCoef, sinCoef)
+
+        if self.phase is None:
+            self.phase = measuredPhase
+            self.time = t[0]
+            return 0.0
+
+        dt = t[0] - self.time
+        predictedPhase = self.phase + self.angularFrequency * dt
+        phaseError = wrap_phase(measuredPhase - predictedPhase)
+        self.phase = wrap_phase(predictedPhase + PHASE_GAIN * phaseError)
+        self.angularFrequency += FREQUENCY_GAIN * phaseError / dt
+        self.time = t[0]
+        return phaseError
+
+    def getFrequency(self):
+        return self.angularFrequency / (2 * np.pi)
+
+def wrap_phase(phase):
+    """
+    Wraps phase to the range [-pi, pi).
+    """
+    return (phase + np.pi) % (2 * np.pi) - np.pi
+
+def track(allTimestamps, allSamples, decimation=DEFAULT_DECIMATION):
+    """
+    Runs a tracker over consecutive segments, as returned by parse_recorded_voltage.parse().
+
+    :param allTimestamps: List of timestamps in ms per segment.
+    :param allSamples:    List of samples per segment.
+    :param decimation:    Number of buffers per output value.
+    :return:              Dict with arrays: time [s], frequency [Hz], phase [rad], amplitude, offset, phaseError [rad].
+                          Amplitude, offset and phase error are averaged over the decimated buffers.
+    """
+    output = {
+        'time': [],
+        'frequency': [],
+        'phase': [],
+        'amplitude': [],
+        'offset': [],
+        'phaseError': [],
+    }
+    tracker = FrequencyTracker()
+    for timestamps, samples in zip(allTimestamps, allSamples):
+        # Each segment is consecutive, but there is a gap between segments.
+        tracker.reset()
+        t = np.asarray(timestamps, dtype=float) / 1000
+        y = np.asarray(samples, dtype=float)
+        numBuffers = len(t) // BUFFER_SIZE
+        amplitudes = []
+        offsets = []
+        phaseErrors = []
+        for i in range(0, numBuffers):
+            start = i * BUFFER_SIZE
+            phaseErrors.append(abs(tracker.update(t[start:start + BUFFER_SIZE], y[start:start + BUFFER_SIZE])))
+            amplitudes.append(tracker.amplitude)
+            offsets.append(tracker.offset)
+            if len(amplitudes) == decimation:
+                output['time'].append(tracker.time)
+                output['frequency'].append(tracker.getFrequency())
+                output['phase'].append(tracker.phase)
+                output['amplitude'].append(np.mean(amplitudes))
+                output['offset'].append(np.mean(offsets))
+                output['phaseError'].append(np.mean(phaseErrors))
+                amplitudes = []
+                offsets = []
+                phaseErrors = []
+    for key in output:
+        output[key] = np.array(output[key])
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(description='Track grid frequency, phase, amplitude and offset of recorded voltage')
+    parser.add_argument('-d', '--decimation', dest='decimation', type=int, default=DEFAULT_DECIMATION,
+            help='Number of buffers per output value')
+    parser.add_argument('-o', '--output', dest='outputFile', default=None,
+            help='Write the decimated time series to this csv file')
+    parser.add_argument('--noPlot', dest='noPlot', action='store_true',
+            help='Do not plot the results')
+    parser.add_argument('fileNames', nargs='+',
+            help='Files recorded with record-voltage.py')
+    args = parser.parse_args()
+
+    results = []
+    for fileName in args.fileNames:
+        allTimestamps, allSamples = parse_recorded_voltage.parse(fileName)
+        result = track(allTimestamps, allSamples, args.decimation)
+        print(fileName, "values:", len(result['time']),
+              "frequency: mean={:.4f} min={:.4f} max={:.4f}".format(
+                  np.mean(result['frequency']), np.min(result['frequency']), np.max(result['frequency']))
+              if len(result['time']) else "")
+        results.append((fileName, result))
+
+    if args.outputFile is not None:
+        keys = ['time', 'frequency', 'phase', 'amplitude', 'offset', 'phaseError']
+        with open(args.outputFile, 'w') as outputFile:
+            outputFile.write('file,' + ','.join(keys) + '\n')
+            for fileName, result in results:
+                for i in range(0, len(result['time'])):
+                    outputFile.write(fileName + ',' + ','.join(str(result[key][i]) for key in keys) + '\n')
+
+    if args.noPlot:
+        return
+
+    fig, axs = plt.subplots(5, sharex=True)
+    for fileName, result in results:
+        axs[0].plot(result['time'], result['frequency'], '.-', label=fileName)
+        axs[1].plot(result['time'], result['phase'], '.')
+        axs[2].plot(result['time'], result['amplitude'], '.-')
+        axs[3].plot(result['time'], result['offset'], '.-')
+        axs[4].plot(result['time'], result['phaseError'], '.-')
+    axs[0].legend()
+    axs[0].set_ylabel('Frequency')
+    axs[1].set_ylabel('Phase')
+    axs[2].set_ylabel('Amplitude')
+    axs[3].set_ylabel('Offset')
+    axs[4].set_ylabel('Phase error')
+    axs[4].set_xlabel('Time (s)')
+    plt.show()
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,227 @@
+#!/usr/bin/python3
 
+# Calculates the flash used by the mesh device state manager (dsm) and access layer, which store their data with
+# the flash manager of the mesh SDK.
+#
+# Each entry is stored with a flash manager header, aligned to words. Entries do not span pages, and each page starts
+# with the flash manager metadata, so the number of pages needed is:
+#   (DATA_SIZE + DATA_PER_PAGE - LARGEST_ENTRY - 1) / (DATA_PER_PAGE - LARGEST_ENTRY)
+# like FLASH_MANAGER_PAGE_COUNT_MINIMUM. On top of that, the flash manager uses one recovery page.
+#
+# Struct sizes and counts can be set in a json config file, and counts can be read from #defines in headers.
+# Counts can be swept over a range, all combinations are calculated at once.
+#
+# Usage:
+#   ./calc-mesh-storage-size.py
+#   ./calc-mesh-storage-size.py -c sizes.json -H nrf_mesh_config_app.h
+#   ./calc-mesh-storage-size.py -s DSM_DEVICE_MAX=1:32 -s DSM_APP_MAX=1,2,4 --maxPages 4
 
-fm_header_t = 4
-access_model_state_data_t = 20
-access_flash_subscription_list_t = 4
-dsm_local_unicast_address_t = 4
-dsm_flash_entry_addr_unicast_t = 4
-dsm_flash_entry_addr_nonvirtual_t = 2
-dsm_flash_entry_addr_virtual_t = 16
-dsm_flash_entry_subnet_t = 36
-dsm_flash_entry_devkey_t = 20
-dsm_flash_entry_appkey_t = 36
-flash_manager_metadata_t = 8
-dsm_flash_entry_t = 36
-
-WORD_SIZE = 4
-#FLASH_MANAGER_DATA_PER_PAGE = PAGE_SIZE - 
-
-ACCESS_MODEL_COUNT             = 3
-ACCESS_SUBSCRIPTION_LIST_COUNT = 1
-ACCESS_ELEMENT_COUNT           = 1
-DSM_NONVIRTUAL_ADDR_MAX        = 3
-DSM_VIRTUAL_ADDR_MAX           = 1
-DSM_SUBNET_MAX                 = 1
-DSM_DEVICE_MAX                 = 1
-DSM_APP_MAX                    = 1 
+import argparse
+import json
+import re
+
+import numpy as np
+
+DEFAULT_CONFIG = {
+	"WORD_SIZE": 4,
+	"PAGE_SIZE": 4096,
+
+	# Struct sizes in bytes.
+	"sizes": {
+		"fm_header_t": 4,
+		"flash_manager_metadata_t": 8,
+		"access_model_state_data_t": 20,
+		"access_flash_subscription_list_t": 4,
+		"access_flash_element_t": 2,
+		"dsm_flash_entry_addr_unicast_t": 4,
+		"dsm_flash_entry_addr_nonvirtual_t": 2,
+		"dsm_flash_entry_addr_virtual_t": 16,
+		"dsm_flash_entry_subnet_t": 36,
+		"dsm_flash_entry_devkey_t": 20,
+		"dsm_flash_entry_appkey_t": 36,
+	},
+
+	"counts": {
+		"ACCESS_MODEL_COUNT": 3,
+		"ACCESS_SUBSCRIPTION_LIST_COUNT": 1,
+		"ACCESS_ELEMENT_COUNT": 1,
+		"DSM_NONVIRTUAL_ADDR_MAX": 3,
+		"DSM_VIRTUAL_ADDR_MAX": 1,
+		"DSM_SUBNET_MAX": 1,
+		"DSM_DEVICE_MAX": 1,
+		"DSM_APP_MAX": 1,
+	},
+}
+
+# Per flash area: list of (struct name, count name), count name None for a single entry.
+AREAS = {
+	"dsm": [
+		("dsm_flash_entry_addr_unicast_t", None),
+		("dsm_flash_entry_addr_nonvirtual_t", "DSM_NONVIRTUAL_ADDR_MAX"),
+		("dsm_flash_entry_addr_virtual_t", "DSM_VIRTUAL_ADDR_MAX"),
+		("dsm_flash_entry_subnet_t", "DSM_SUBNET_MAX"),
+		("dsm_flash_entry_devkey_t", "DSM_DEVICE_MAX"),
+		("dsm_flash_entry_appkey_t", "DSM_APP_MAX"),
+	],
+	"access": [
+		("access_model_state_data_t", "ACCESS_MODEL_COUNT"),
+		("access_flash_subscription_list_t", "ACCESS_SUBSCRIPTION_LIST_COUNT"),
+		("access_flash_element_t", "ACCESS_ELEMENT_COUNT"),
+	],
+}
+
+# Pages used by the flash manager for recovery, shared by all areas.
+RECOVERY_PAGE_COUNT = 1
+
+patternDefine = re.compile(r"^\s*#define\s+(\w+)\s+\(?\s*(0x[0-9A-Fa-f]+|\d+)[uUlL]*\s*\)?\s*(?://.*|/\*.*)?$", re.MULTILINE)
 
 def ALIGN_VAL(dataSize, wordSize):
-	return (int(dataSize / wordSize) + (dataSize % wordSize)) * wordSize
-
-def dsm_flash_data_size():
-	DATA_SIZE =  ALIGN_VAL((fm_header_t + dsm_flash_entry_addr_unicast_t), WORD_SIZE)
-	DATA_SIZE += ALIGN_VAL((fm_header_t + dsm_flash_entry_addr_nonvirtual_t), WORD_SIZE)  * DSM_NONVIRTUAL_ADDR_MAX
-	DATA_SIZE += ALIGN_VAL((fm_header_t + dsm_flash_entry_addr_virtual_t), WORD_SIZE)     * DSM_VIRTUAL_ADDR_MAX
-	DATA_SIZE += ALIGN_VAL((fm_header_t + dsm_flash_entry_subnet_t), WORD_SIZE)           * DSM_SUBNET_MAX
-	DATA_SIZE += ALIGN_VAL((fm_header_t + dsm_flash_entry_devkey_t), WORD_SIZE)           * DSM_DEVICE_MAX
-	DATA_SIZE += ALIGN_VAL((fm_header_t + dsm_flash_entry_appkey_t), WORD_SIZE)           * DSM_APP_MAX
-	return DATA_SIZE
-
-def access_flash_data_size():
-	DATA_SIZE =  (ALIGN_VAL((fm_header_t + access_model_state_data_t), WORD_SIZE) * ACCESS_MODEL_COUNT)
-	DATA_SIZE += (ALIGN_VAL((fm_header_t + access_flash_subscription_list_t), WORD_SIZE) * ACCESS_SUBSCRIPTION_LIST_COUNT)
-	DATA_SIZE += (ALIGN_VAL((fm_header_t + 2), WORD_SIZE) * ACCESS_ELEMENT_COUNT)
-	return DATA_SIZE
-
-print("dsm data size:", dsm_flash_data_size())
-print("access data size:", access_flash_data_size())
+	"""
+	Rounds up to a multiple of the word size.
+	"""
+	return (dataSize + wordSize - 1) // wordSize * wordSize
+
+def loadConfig(fileName):
+	"""
+	:return: The default config, updated with the values in the json file.
+	"""
+	config = json.loads(json.dumps(DEFAULT_CONFIG))
+	with open(fileName, 'r') as file:
+		fileConfig = json.load(file)
+	for key, value in fileConfig.items():
+		if isinstance(value, dict):
+			config.setdefault(key, {}).update(value)
+		else:
+			config[key] = value
+	return config
+
+def readHeaderCounts(fileName, counts):
+	"""
+	Updates the counts with the values of #defines with the same name in a header file.
+	:return: List of names that were updated.
+	"""
+	with open(fileName, 'r') as file:
+		text = file.read()
+	updated = []
+	for name, value in patternDefine.findall(text):
+		if name in counts:
+			counts[name] = int(value, 0)
+			updated.append(name)
+	return updated
+
+def parseSweep(sweep):
+	"""
+	:param sweep: NAME=start:stop[:step], with stop included, or NAME=value,value,...
+	:return:      Tuple of (name, list of values).
+	"""
+	name, values = sweep.split("=", 1)
+	if ":" in values:
+		rangeValues = [int(value, 0) for value in values.split(":")]
+		step = rangeValues[2] if len(rangeValues) > 2 else 1
+		return name, list(range(rangeValues[0], rangeValues[1] + 1, step))
+	return name, [int(value, 0) for value in values.split(",")]
+
+def getSweepCounts(counts, sweeps):
+	"""
+	:param sweeps: List of (name, values).
+	:return:       Dict with all counts as numpy array: one element per combination of swept values.
+	"""
+	grids = np.meshgrid(*[np.array(values, dtype=np.int64) for name, values in sweeps], indexing='ij')
+	numCombinations = grids[0].size if grids else 1
+	sweepCounts = {name: np.full(numCombinations, value, dtype=np.int64) for name, value in counts.items()}
+	for (name, values), grid in zip(sweeps, grids):
+		sweepCounts[name] = grid.ravel()
+	return sweepCounts
+
+def calcArea(config, entries, counts):
+	"""
+	:param counts: Dict with count name as key, and numpy array of counts as value.
+	:return:       Dict with arrays of data size, padding, and number of pages, and the size of the largest entry.
+	"""
+	sizes = config["sizes"]
+	wordSize = config["WORD_SIZE"]
+	dataPerPage = config["PAGE_SIZE"] - sizes["flash_manager_metadata_t"]
+	numCombinations = len(next(iter(counts.values())))
+	dataSize = np.zeros(numCombinations, dtype=np.int64)
+	padding = np.zeros(numCombinations, dtype=np.int64)
+	largestEntry = 0
+	for structName, countName in entries:
+		entrySize = sizes["fm_header_t"] + sizes[structName]
+		alignedSize = ALIGN_VAL(entrySize, wordSize)
+		count = 1 if countName is None else counts[countName]
+		dataSize += alignedSize * count
+		padding += (alignedSize - entrySize) * count
+		largestEntry = max(largestEntry, alignedSize)
+	pages = (dataSize + dataPerPage - largestEntry - 1) // (dataPerPage - largestEntry)
+	return {"dataSize": dataSize, "padding": padding, "pages": pages, "largestEntry": largestEntry}
+
+def calcLayout(config, sweeps):
+	"""
+	:return: Tuple of (dict with counts per combination, dict with the results per area).
+	"""
+	counts = getSweepCounts(config["counts"], sweeps)
+	areas = {areaName: calcArea(config, entries, counts) for areaName, entries in AREAS.items()}
+	return counts, areas
+
+def main():
+	parser = argparse.ArgumentParser(description='Calculate flash usage of the mesh storage')
+	parser.add_argument('-c', '--config', dest='configFile', default=None,
+			help='Json file with WORD_SIZE, PAGE_SIZE, struct sizes (sizes) and counts (counts), overriding the defaults')
+	parser.add_argument('-H', '--header', dest='headerFiles', action='append', default=[],
+			help='Header file to read counts from, for example nrf_mesh_config_app.h. Can be given multiple times')
+	parser.add_argument('-s', '--sweep', dest='sweeps', action='append', default=[],
+			help='Count to sweep: NAME=start:stop[:step] (stop included) or NAME=value,value,... Can be given multiple times')
+	parser.add_argument('-m', '--maxPages', dest='maxPages', type=int, default=None,
+			help='Only print combinations that need at most this many pages in total')
+	parser.add_argument('-j', '--json', dest='json', action='store_true',
+			help='Output as json')
+	args = parser.parse_args()
+
+	config = loadConfig(args.configFile) if args.configFile else json.loads(json.dumps(DEFAULT_CONFIG))
+	for headerFile in args.headerFiles:
+		updated = readHeaderCounts(headerFile, config["counts"])
+		if not args.json:
+			print("Read from %s: %s" % (headerFile, ", ".join(updated) if updated else "nothing"))
+	sweeps = [parseSweep(sweep) for sweep in args.sweeps]
+	for name, values in sweeps:
+		if name not in config["counts"]:
+			parser.error("Unknown count: %s, options: %s" % (name, ", ".join(config["counts"].keys())))
+
+	counts, areas = calcLayout(config, sweeps)
+	totalPages = sum(area["pages"] for area in areas.values()) + RECOVERY_PAGE_COUNT
+	selected = np.ones(len(totalPages), dtype=bool) if args.maxPages is None else totalPages <= args.maxPages
+	sweepNames = [name for name, values in sweeps]
+
+	if args.json:
+		rows = []
+		for i in np.flatnonzero(selected):
+			row = {name: int(counts[name][i]) for name in sweepNames}
+			for areaName, area in areas.items():
+				row[areaName] = {"dataSize": int(area["dataSize"][i]), "padding": int(area["padding"][i]), "pages": int(area["pages"][i])}
+			row["totalPages"] = int(totalPages[i])
+			rows.append(row)
+		print(json.dumps({"counts": config["counts"], "rows": rows}, indent=2))
+		return
+
+	if not sweeps:
+		for areaName, area in areas.items():
+			print("%s data size: %i (padding %i, largest entry %i), pages: %i" % (areaName, area["dataSize"][0], area["padding"][0], area["largestEntry"], area["pages"][0]))
+		print("total pages: %i (including %i recovery page)" % (totalPages[0], RECOVERY_PAGE_COUNT))
+		return
+
+	header = list(sweepNames)
+	for areaName in areas:
+		header += [areaName + " size", areaName + " pad", areaName + " pages"]
+	header.append("total pages")
+	widths = [max(len(column), 6) for column in header]
+	print("  ".join(column.rjust(width) for column, width in zip(header, widths)))
+	for i in np.flatnonzero(selected):
+		values = [counts[name][i] for name in sweepNames]
+		for area in areas.values():
+			values += [area["dataSize"][i], area["padding"][i], area["pages"][i]]
+		values.append(totalPages[i])
+		print("  ".join(str(value).rjust(width) for value, width in zip(values, widths)))
+	print("%i of %i combinations" % (np.count_nonzero(selected), len(totalPages)))
 
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# Compares FDS records of two or more flash dumps, for example taken before and after changing config.
+# The dumps are compared in the given order, see fds_parser.py for the supported formats.
+#
+# Records are indexed by (file id, record key). When there are multiple valid copies of a record, the one with the
+# highest record id is used. For each pair of consecutive dumps, the added, changed, rewritten (same data, but a new
+# record id) and deleted records are reported.
+# For each dump, the valid and superseded (deleted or replaced by a newer copy) records and the page fill are reported.
+# A superseded record has its key set to 0, so those are only counted per file id.
+#
+# Usage:
+#   ./fds-diff.py dump1.txt dump2.txt ...
+#   ./fds-diff.py flash*.bin -b 0x6E000 --json
+
+import argparse
+import json
+from multiprocessing import Pool
+
+import fds_parser
+
+class DumpSummary:
+	def __init__(self, fileName):
+		self.fileName = fileName
+		# Dict with (fileId, key) as key, and (recordId, data) of the newest valid copy as value.
+		self.records = {}
+		self.numValid = 0
+		self.numDuplicates = 0
+		self.numSuperseded = 0
+		self.validBytes = 0
+		self.supersededBytes = 0
+		# Dict with file id as key, and number of superseded records as value.
+		self.supersededPerFile = {}
+		self.maxRecordId = 0
+		self.numPages = 0
+		self.numCorruptPages = 0
+		self.usedBytes = 0
+		self.totalBytes = 0
+
+	def toJson(self):
+		return {
+			"fileName": self.fileName,
+			"numRecords": len(self.records),
+			"numValid": self.numValid,
+			"numDuplicates": self.numDuplicates,
+			"numSuperseded": self.numSuperseded,
+			"validBytes": self.validBytes,
+			"supersededBytes": self.supersededBytes,
+			"supersededPerFile": self.supersededPerFile,
+			"maxRecordId": self.maxRecordId,
+			"numPages": self.numPages,
+			"numCorruptPages": self.numCorruptPages,
+			"usedBytes": self.usedBytes,
+			"totalBytes": self.totalBytes,
+		}
+
+def summarizeDump(fileName, baseAddress=0, pageSize=fds_parser.PAGE_SIZE):
+	"""
+	Parses a dump, and only keeps what is needed for the comparison, so that many dumps can be kept in memory.
+	"""
+	summary = DumpSummary(fileName)
+	dumpBaseAddress, buffer = fds_parser.readDump(fileName, baseAddress)
+	for page in fds_parser.parsePages(buffer, dumpBaseAddress, pageSize):
+		summary.numPages += 1
+		summary.numCorruptPages += page["corrupt"]
+		summary.usedBytes += page["usedBytes"]
+		summary.totalBytes += page["size"]
+		for record in page["records"]:
+			recordSize = fds_parser.RECORD_HEADER.size + len(record["data"])
+			summary.maxRecordId = max(summary.maxRecordId, record["recordId"])
+			if not record["valid"]:
+				summary.numSuperseded += 1
+				summary.supersededBytes += recordSize
+				summary.supersededPerFile[record["fileId"]] = summary.supersededPerFile.get(record["fileId"], 0) + 1
+				continue
+			summary.numValid += 1
+			summary.validBytes += recordSize
+			recordKey = (record["fileId"], record["key"])
+			existing = summary.records.get(recordKey)
+			if existing is not None:
+				summary.numDuplicates += 1
+				if existing[0] > record["recordId"]:
+					continue
+			summary.records[recordKey] = (record["recordId"], record["data"])
+	return summary
+
+def _summarizeDump(args):
+	return summarizeDump(*args)
+
+def diffDumps(old, new):
+	"""
+	:return: Dict with lists of (fileId, key) that were added, changed, rewritten, and deleted.
+	"""
+	diff = {"added": [], "changed": [], "rewritten": [], "deleted": []}
+	for recordKey, (recordId, data) in new.records.items():
+		oldRecord = old.records.get(recordKey)
+		if oldRecord is None:
+			diff["added"].append(recordKey)
+		elif oldRecord[1] != data:
+			diff["changed"].append(recordKey)
+		elif oldRecord[0] != recordId:
+			diff["rewritten"].append(recordKey)
+	for recordKey in old.records:
+		if recordKey not in new.records:
+			diff["deleted"].append(recordKey)
+	for recordKeys in diff.values():
+		recordKeys.sort()
+	return diff
+
+def getHistory(summaries):
+	"""
+	:return: Dict with (fileId, key) as key, and a list with per dump the index of the version of the record, or None
+	         when the record is not in that dump.
+	"""
+	history = {}
+	for dumpIndex, summary in enumerate(summaries):
+		for recordKey, (recordId, data) in summary.records.items():
+			versions = history.setdefault(recordKey, {"data": [], "perDump": [None] * len(summaries)})
+			if data not in versions["data"]:
+				versions["data"].append(data)
+			versions["perDump"][dumpIndex] = versions["data"].index(data)
+	return {recordKey: versions["perDump"] for recordKey, versions in sorted(history.items())}
+
+def formatKeys(recordKeys):
+	return " ".join("%i:%i" % recordKey for recordKey in recordKeys)
+
+def printSummary(summary):
+	fill = 100.0 * summary.usedBytes / summary.totalBytes if summary.totalBytes else 0.0
+	print("%s: pages=%i fill=%.1f%% records=%i valid=%i (%i B) duplicates=%i superseded=%i (%i B) maxRecordId=%i%s" % (
+		summary.fileName, summary.numPages, fill, len(summary.records), summary.numValid, summary.validBytes,
+		summary.numDuplicates, summary.numSuperseded, summary.supersededBytes, summary.maxRecordId,
+		" corruptPages=%i" % summary.numCorruptPages if summary.numCorruptPages else ""))
+
+def printDiff(old, new, diff):
+	# Record ids are incremented for every write, so this is the number of writes in between, also of records
+	# that were written and superseded again.
+	numWrites = new.maxRecordId - old.maxRecordId
+	print("%s -> %s: writes=%i added=%i changed=%i rewritten=%i deleted=%i superseded=%+i (%+i B)" % (
+		old.fileName, new.fileName, numWrites, len(diff["added"]), len(diff["changed"]), len(diff["rewritten"]),
+		len(diff["deleted"]), new.numSuperseded - old.numSuperseded, new.supersededBytes - old.supersededBytes))
+	if new.supersededBytes < old.supersededBytes:
+		print("  garbage collected")
+	for name, recordKeys in diff.items():
+		if recordKeys:
+			print("  %-10s %s" % (name + ":", formatKeys(recordKeys)))
+
+def printHistory(history):
+	print("fileId:key versions per dump (- = not present)")
+	for (fileId, key), perDump in history.items():
+		numVersions = len(set(version for version in perDump if version is not None))
+		print("%5i:%-5i versions=%-3i %s" % (fileId, key, numVersions, " ".join("-" if version is None else str(version) for version in perDump)))
+
+def main():
+	parser = argparse.ArgumentParser(description='Compare FDS records of flash dumps')
+	parser.add_argument('fileNames', nargs='+', help='nrfjprog or JLinkExe text dumps, or raw .bin flash images, in order')
+	parser.add_argument('-b', '--baseAddress', type=lambda x: int(x, 0), default=0,
+			help='Flash address of the start of .bin images')
+	parser.add_argument('-p', '--pageSize', type=lambda x: int(x, 0), default=fds_parser.PAGE_SIZE,
+			help='Flash page size')
+	parser.add_argument('-H', '--history', dest='history', action='store_true',
+			help='Print the version of each record in each dump')
+	parser.add_argument('-j', '--json', dest='json', action='store_true',
+			help='Output as json')
+	parser.add_argument('-n', '--processes', dest='processes', type=int, default=None,
+			help='Number of processes to parse the dumps with, by default the number of CPUs')
+	args = parser.parse_args()
+
+	jobs = [(fileName, args.baseAddress, args.pageSize) for fileName in args.fileNames]
+	if len(jobs) > 1 and args.processes != 1:
+		with Pool(args.processes) as pool:
+			summaries = pool.map(_summarizeDump, jobs)
+	else:
+		summaries = [_summarizeDump(job) for job in jobs]
+	diffs = [diffDumps(summaries[i], summaries[i + 1]) for i in range(0, len(summaries) - 1)]
+
+	if args.json:
+		output = {
+			"dumps": [summary.toJson() for summary in summaries],
+			"diffs": [{name: [list(recordKey) for recordKey in recordKeys] for name, recordKeys in diff.items()} for diff in diffs],
+		}
+		if args.history:
+			output["history"] = [{"fileId": fileId, "key": key, "versions": perDump} for (fileId, key), perDump in getHistory(summaries).items()]
+		print(json.dumps(output, indent=2))
+		return
+
+	for summary in summaries:
+		printSummary(summary)
+	for i, diff in enumerate(diffs):
+		printDiff(summaries[i], summaries[i + 1], diff)
+	if args.history:
+		printHistory(getHistory(summaries))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,153 @@
+"""
+Parses FDS (flash data storage) pages from a flash dump.
+
+A dump can be:
+- Output of nrfjprog --memrd, for example: 0x0007DF70: FFFFFFFF FFFFFFFF FFFFFFFF FFFFFFFF   |................|
+  The data is printed as 32 bit words.
+- Output of JLinkExe mem, for example: 0006E000 = DE C0 AD DE FE 01 1E F1 00 00 01 00 03 00 C6 60
+- A raw binary flash image (.bin), which is memory mapped instead of read.
+The dump is first turned into a single buffer in memory order, then the pages and records are read with struct.
+
+Each page starts with: 0xDEADC0DE 0xF11E01FF (swap page) or 0xDEADC0DE 0xF11E01FE (data page)
+FDS record:
+  2B record key, 0 when the record is deleted or superseded by a newer copy.
+  2B data length in words
+  2B file ID
+  2B CRC, of the record without the CRC field. Only set when the firmware has FDS CRC checks enabled.
+  4B record ID
+  data
+"""
+
+import binascii
+import mmap
+import re
+import struct
+
+PAGE_SIZE = 0x1000
+
+PAGE_TAG_MAGIC = 0xDEADC0DE
+PAGE_TAG_SWAP = 0xF11E01FF
+PAGE_TAG_DATA = 0xF11E01FE
+
+PAGE_HEADER = struct.Struct("<II")
+RECORD_HEADER = struct.Struct("<HHHHI")
+
+# Record key of deleted records.
+RECORD_KEY_DIRTY = 0x0000
+ERASED_HALF_WORD = 0xFFFF
+
+patternNrfjprog = re.compile(r"^0x([0-9A-Fa-f]{8}): ((?:[0-9A-Fa-f]{8} ?)+)", re.MULTILINE)
+patternJlink = re.compile(r"^([0-9A-Fa-f]{8}) = ((?:[0-9A-Fa-f]{2} ?)+)", re.MULTILINE)
+
+def parseTextDump(text):
+	"""
+	:return: Tuple of (baseAddress, buffer), where buffer is a bytearray with the dumped memory.
+	         Gaps between dumped lines are filled with 0xFF.
+	"""
+	matches = patternNrfjprog.findall(text)
+	wordSwapped = True
+	if not matches:
+		matches = patternJlink.findall(text)
+		wordSwapped = False
+	if not matches:
+		return 0, bytearray()
+
+	addresses = [int(address, 16) for address, hexData in matches]
+	hexStrings = [hexData.replace(" ", "") for address, hexData in matches]
+	data = bytearray.fromhex("".join(hexStrings))
+	if wordSwapped:
+		# nrfjprog prints words, swap to memory order.
+		data[0::4], data[1::4], data[2::4], data[3::4] = data[3::4], data[2::4], data[1::4], data[0::4]
+
+	lengths = [len(hexString) // 2 for hexString in hexStrings]
+	contiguous = all(addresses[i + 1] == addresses[i] + lengths[i] for i in range(0, len(addresses) - 1))
+	if contiguous:
+		return addresses[0], data
+
+	baseAddress = min(addresses)
+	endAddress = max(address + length for address, length in zip(addresses, lengths))
+	buffer = bytearray(b"\xFF" * (endAddress - baseAddress))
+	dataOffset = 0
+	for address, length in zip(addresses, lengths):
+		buffer[address - baseAddress:address - baseAddress + length] = data[dataOffset:dataOffset + length]
+		dataOffset += length
+	return baseAddress, buffer
+
+def readDump(fileName, baseAddress=0):
+	"""
+	:param baseAddress: Flash address of the start of a binary image. Text dumps contain the addresses.
+	:return:            Tuple of (baseAddress, buffer).
+	"""
+	if fileName.endswith(".bin"):
+		with open(fileName, 'rb') as file:
+			# The map stays valid after the file is closed.
+			return baseAddress, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+	with open(fileName, 'r') as file:
+		return parseTextDump(file.read())
+
+def parsePages(buffer, baseAddress, pageSize=PAGE_SIZE):
+	"""
+	:return: List of dicts, one per FDS page, with the page address, type, records, and number of used bytes.
+	         Pages without FDS header are skipped.
+	"""
+	pages = []
+	view = memoryview(buffer)
+	firstOffset = (-baseAddress) % pageSize
+	for pageOffset in range(firstOffset, len(buffer) - pageSize + 1, pageSize):
+		magic, tag = PAGE_HEADER.unpack_from(buffer, pageOffset)
+		if magic != PAGE_TAG_MAGIC or tag not in (PAGE_TAG_DATA, PAGE_TAG_SWAP):
+			continue
+		page = {
+			"address": baseAddress + pageOffset,
+			"type": "data" if tag == PAGE_TAG_DATA else "swap",
+			"records": [],
+			"corrupt": False,
+		}
+		offset = pageOffset + PAGE_HEADER.size
+		pageEnd = pageOffset + pageSize
+		while offset + RECORD_HEADER.size <= pageEnd:
+			key, lengthWords, fileId, crc, recordId = RECORD_HEADER.unpack_from(buffer, offset)
+			if key == ERASED_HALF_WORD and lengthWords == ERASED_HALF_WORD:
+				# The rest of the page is free.
+				break
+			dataStart = offset + RECORD_HEADER.size
+			dataEnd = dataStart + lengthWords * 4
+			if dataEnd > pageEnd:
+				page["corrupt"] = True
+				break
+			page["records"].append({
+				"address": baseAddress + offset,
+				"key": key,
+				"fileId": fileId,
+				"crc": crc,
+				"recordId": recordId,
+				"valid": key != RECORD_KEY_DIRTY,
+				"data": bytes(view[dataStart:dataEnd]),
+				"crcMatch": calcRecordCrc(view, offset, dataEnd) == crc,
+			})
+			offset = dataEnd
+		page["usedBytes"] = offset - pageOffset
+		page["size"] = pageSize
+		pages.append(page)
+	return pages
+
+def calcRecordCrc(buffer, recordOffset, recordEnd):
+	"""
+	:return: CRC-16-CCITT of a record, without the CRC field, like the FDS calculates it.
+	"""
+	crc = binascii.crc_hqx(buffer[recordOffset:recordOffset + 6], 0xFFFF)
+	return binascii.crc_hqx(buffer[recordOffset + 8:recordEnd], crc)
+
+def getRecords(pages, includeDeleted=False):
+	"""
+	:return: List of records of all pages, in order of address.
+	"""
+	return [record for page in pages for record in page["records"] if includeDeleted or record["valid"]]
+
+def recordToJson(record):
+	"""
+	:return: Dict of a record that can be serialized to json: the data as hex string.
+	"""
+	result = dict(record)
+	result["data"] = record["data"].hex()
+	return result
@@ -1,110 +1,225 @@
 #!/usr/bin/python3
 
+# Checks the code style of C and C++ files.
+#
+# Arguments can be files or directories, directories are searched for source files.
+# Results are cached per file, together with the file size, modification time, and hash of the contents.
+# Only files that changed since the last run are checked again, with a pool of worker processes.
+#
+# Usage:
+#   ./style_check.py file.cpp dir ...   Print the style errors.
+#   ./style_check.py --json dir         Print the style errors as json.
+
+import argparse
+import hashlib
+import io
+import json
 import os.path
-import sys
 import re
-
-def check_style_file(fileName):
-    # Indent
-    indentPattern = re.compile("^(\s+)(.*)")
-    multilineCommentIndentPattern = re.compile("^(\t*) \*") # Exception: multiline comments start with " *"
-    spacesAsIndentLineNrs = []
-    spacesAsIndentLines = []
-
-    # Space after comma
-    spaceAfterCommaPattern = re.compile(".*,[^ ]")
-    spaceAfterCommaLineNrs = []
-    spaceAfterCommaLines = []
-
-    # Space after if etc.
-    spaceAfterIfPattern = re.compile(".*(\s|^)(if|switch|for|while)\(")
-    spaceAfterIfLineNrs = []
-    spaceAfterIfLines = []
-
-    # Space before {
-    spaceBeforeCurlyBracketPattern = re.compile(".*([^ ]\{)")
-    curlyBracketSwitchCasePattern = re.compile(".*case .*:\{") # Exception: "case bla:{"
-    curlyBracketNewlinePattern = re.compile("^\s*\{")  # Exception: "    {"
-    curlyBracketPrefixPattern = re.compile("[{(]\{")  # Exception: " {{" or "({" or "//{"
-    curlyBrackedCommentedPattern = re.compile("^//\{")  # Exception: "//{"
-    spaceBeforeCurlyBracketLineNrs = []
-    spaceBeforeCurlyBracketLines = []
-
-    with open(fileName, 'r') as file:
-        lines = file.readlines()
-        for i in range(0, len(lines)):
-            line = lines[i].rstrip('\n')
-            lineNr = i + 1
-
-            # Indent
-            match = indentPattern.match(line)
-            if (match):
-                if (' ' in match.group(1)):
-                    if (multilineCommentIndentPattern.match(line)):
-                        pass
-                    else:
-                        spacesAsIndentLineNrs.append(lineNr)
-                        spacesAsIndentLines.append(line)
-
-            # Space after comma
-            match = spaceAfterCommaPattern.match(line)
-            if (match):
-                spaceAfterCommaLineNrs.append(lineNr)
-                spaceAfterCommaLines.append(line)
-
-            # Space after if etc.
-            match = spaceAfterIfPattern.match(line)
-            if (match):
-                spaceAfterIfLineNrs.append(lineNr)
-                spaceAfterIfLines.append(line)
-
-            # Space before {
-            match = spaceBeforeCurlyBracketPattern.match(line)
-            if (match):
-                # if (curlyBracketSwitchCasePattern.match(line)):
-                #     pass
-                if (curlyBracketNewlinePattern.match(line)):
-                    pass
-                elif (curlyBracketPrefixPattern.match(match.group(1))):
-                    pass
-                elif (curlyBrackedCommentedPattern.match(line)):
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+SOURCE_FILE_EXTENSIONS = (".c", ".cpp", ".h", ".hpp")
+
+DEFAULT_CACHE_FILE = ".style_check_cache.json"
+
+# Only start worker processes when there are at least this many files to check, as starting them takes time.
+MIN_FILES_FOR_POOL = 16
+
+# Indent
+indentPattern = re.compile(r"^(\s+)(.*)")
+multilineCommentIndentPattern = re.compile(r"^(\t*) \*") # Exception: multiline comments start with " *"
+
+# Space after comma
+spaceAfterCommaPattern = re.compile(r".*,[^ ]")
+
+# Space after if etc.
+spaceAfterIfPattern = re.compile(r".*(\s|^)(if|switch|for|while)\(")
+
+# Space before {
+spaceBeforeCurlyBracketPattern = re.compile(r".*([^ ]\{)")
+curlyBracketSwitchCasePattern = re.compile(r".*case .*:\{") # Exception: "case bla:{"
+curlyBracketNewlinePattern = re.compile(r"^\s*\{")  # Exception: "    {"
+curlyBracketPrefixPattern = re.compile(r"[{(]\{")  # Exception: " {{" or "({" or "//{"
+curlyBrackedCommentedPattern = re.compile(r"^//\{")  # Exception: "//{"
+
+# Rule name, and message that is printed before the errors of that rule.
+RULES = [
+    ("spacesAsIndent", "Space as indent on lines:"),
+    ("spaceAfterComma", "No space after comma:"),
+    ("spaceAfterIf", "No space after if:"),
+    ("spaceBeforeCurlyBracket", "No space before curly bracket:"),
+]
+
+# Changes when the rules change, so that cached results are not used anymore.
+RULES_VERSION = hashlib.sha1(" ".join(pattern.pattern for pattern in [
+    indentPattern, multilineCommentIndentPattern, spaceAfterCommaPattern, spaceAfterIfPattern,
+    spaceBeforeCurlyBracketPattern, curlyBracketNewlinePattern, curlyBracketPrefixPattern, curlyBrackedCommentedPattern
+]).encode()).hexdigest()
+
+def check_style_lines(lines):
+    """
+    :return: List of errors: [rule name, line nr, line].
+    """
+    errors = []
+    for i in range(0, len(lines)):
+        line = lines[i].rstrip('\n')
+        lineNr = i + 1
+
+        # Indent
+        match = indentPattern.match(line)
+        if (match):
+            if (' ' in match.group(1)):
+                if (multilineCommentIndentPattern.match(line)):
                     pass
                 else:
-                    spaceBeforeCurlyBracketLineNrs.append(lineNr)
-                    spaceBeforeCurlyBracketLines.append(line)
-
-#    print("Checked file", fileName)
-    fileName = fileName.split('/')[-1]
-
-    if len(spacesAsIndentLineNrs):
-        print("Space as indent on lines:")
-        for i in range(0, len(spacesAsIndentLineNrs)):
-            print("{}:{}: {}".format(fileName, spacesAsIndentLineNrs[i], spacesAsIndentLines[i]))
-
-    if len(spaceAfterCommaLineNrs):
-        print("No space after comma:")
-        for i in range(0, len(spaceAfterCommaLineNrs)):
-            print("{}:{}: {}".format(fileName, spaceAfterCommaLineNrs[i], spaceAfterCommaLines[i]))
+                    errors.append(["spacesAsIndent", lineNr, line])
+
+        # Space after comma
+        match = spaceAfterCommaPattern.match(line)
+        if (match):
+            errors.append(["spaceAfterComma", lineNr, line])
+
+        # Space after if etc.
+        match = spaceAfterIfPattern.match(line)
+        if (match):
+            errors.append(["spaceAfterIf", lineNr, line])
+
+        # Space before {
+        match = spaceBeforeCurlyBracketPattern.match(line)
+        if (match):
+            # if (curlyBracketSwitchCasePattern.match(line)):
+            #     pass
+            if (curlyBracketNewlinePattern.match(line)):
+                pass
+            elif (curlyBracketPrefixPattern.match(match.group(1))):
+                pass
+            elif (curlyBrackedCommentedPattern.match(line)):
+                pass
+            else:
+                errors.append(["spaceBeforeCurlyBracket", lineNr, line])
+    return errors
+
+def check_style_data(data):
+    """
+    :return: Tuple of (hash of the data, list of errors).
+    """
+    lines = io.StringIO(data.decode('utf-8', errors='replace'), newline=None).readlines()
+    return hashlib.sha1(data).hexdigest(), check_style_lines(lines)
 
-    if len(spaceAfterIfLineNrs):
-        print("No space after if:")
-        for i in range(0, len(spaceAfterIfLineNrs)):
-            print("{}:{}: {}".format(fileName, spaceAfterIfLineNrs[i], spaceAfterIfLines[i]))
-
-    if len(spaceBeforeCurlyBracketLineNrs):
-        print("No space before curly bracket:")
-        for i in range(0, len(spaceBeforeCurlyBracketLineNrs)):
-            print("{}:{}: {}".format(fileName, spaceBeforeCurlyBracketLineNrs[i], spaceBeforeCurlyBracketLines[i]))
-
-    return
-
-
-def check_style_all(fileNames):
+def check_style_file(fileName):
+    with open(fileName, 'rb') as file:
+        return check_style_data(file.read())
+
+def find_source_files(paths):
+    fileNames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, dirFileNames in os.walk(path):
+                dirNames[:] = sorted(dirName for dirName in dirNames if not dirName.startswith('.'))
+                for fileName in sorted(dirFileNames):
+                    if fileName.endswith(SOURCE_FILE_EXTENSIONS):
+                        fileNames.append(os.path.join(dirPath, fileName))
+        elif os.path.isfile(path):
+            fileNames.append(path)
+    return fileNames
+
+def load_cache(cacheFileName):
+    try:
+        with open(cacheFileName, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("rulesVersion") != RULES_VERSION:
+        return {}
+    return cache.get("files", {})
+
+def save_cache(cacheFileName, files):
+    tempFileName = cacheFileName + ".tmp"
+    with open(tempFileName, 'w') as file:
+        json.dump({"rulesVersion": RULES_VERSION, "files": files}, file)
+    os.replace(tempFileName, cacheFileName)
+
+def check_style_all(fileNames, cache, numWorkers=None):
+    """
+    :param cache: Dict with the absolute file name as key, and a dict with size, mtime, hash, and errors as value.
+                  Updated with the results.
+    :return:      Tuple of (dict with file name as key, and list of errors as value, number of checked files).
+    """
+    results = {}
+    toRead = []
     for fileName in fileNames:
-        if (os.path.isfile(fileName)):
-            check_style_file(fileName)
-
-
-
-fileNames = sys.argv[1:]
-check_style_all(fileNames)
\ No newline at end of file
+        path = os.path.abspath(fileName)
+        stat = os.stat(path)
+        entry = cache.get(path)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            results[fileName] = entry["errors"]
+        else:
+            toRead.append((fileName, path, stat))
+
+    # Files with a new modification time, but the same contents (for example after a checkout) are not checked again.
+    toCheck = []
+    for fileName, path, stat in toRead:
+        with open(path, 'rb') as file:
+            data = file.read()
+        entry = cache.get(path)
+        if entry is not None and entry["hash"] == hashlib.sha1(data).hexdigest():
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime_ns
+            results[fileName] = entry["errors"]
+        else:
+            toCheck.append((fileName, path, stat, data))
+
+    if len(toCheck) >= MIN_FILES_FOR_POOL and numWorkers != 1:
+        with ProcessPoolExecutor(numWorkers) as executor:
+            checked = list(executor.map(check_style_data, [data for fileName, path, stat, data in toCheck], chunksize=8))
+    else:
+        checked = [check_style_data(data) for fileName, path, stat, data in toCheck]
+
+    for (fileName, path, stat, data), (dataHash, errors) in zip(toCheck, checked):
+        cache[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": dataHash, "errors": errors}
+        results[fileName] = errors
+    return {fileName: results[fileName] for fileName in fileNames}, len(toCheck)
+
+def print_errors(fileName, errors):
+    fileName = fileName.split('/')[-1]
+    for ruleName, message in RULES:
+        ruleErrors = [error for error in errors if error[0] == ruleName]
+        if len(ruleErrors):
+            print(message)
+            for rule, lineNr, line in ruleErrors:
+                print("{}:{}: {}".format(fileName, lineNr, line))
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the code style of C and C++ files')
+    parser.add_argument('paths', nargs='*', help='Files, or directories to search for source files')
+    parser.add_argument('-c', '--cache', dest='cacheFile', default=DEFAULT_CACHE_FILE,
+                        help='File to cache the results in')
+    parser.add_argument('--noCache', dest='noCache', action='store_true',
+                        help='Check all files, and do not write the cache')
+    parser.add_argument('-j', '--jobs', dest='numWorkers', type=int, default=None,
+                        help='Number of worker processes, by default the number of CPUs')
+    parser.add_argument('--json', dest='json', action='store_true',
+                        help='Print the errors as json: a list of objects with file, line, rule, and text')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
+                        help='Print the number of checked files')
+    args = parser.parse_args()
+
+    fileNames = find_source_files(args.paths)
+    cache = {} if args.noCache else load_cache(args.cacheFile)
+    results, numChecked = check_style_all(fileNames, cache, args.numWorkers)
+    if not args.noCache:
+        save_cache(args.cacheFile, cache)
+
+    if args.json:
+        diagnostics = [{"file": fileName, "line": lineNr, "rule": rule, "text": line}
+                       for fileName, errors in results.items() for rule, lineNr, line in errors]
+        print(json.dumps(diagnostics, indent=2))
+    else:
+        for fileName, errors in results.items():
+            print_errors(fileName, errors)
+    if args.verbose:
+        print("Checked {} of {} files".format(numChecked, len(fileNames)), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,221 +1,282 @@
 #!/usr/bin/python3
+
+# Checks the UICR of stones in a cloud export against the board map.
+#
+# The cloud export is read incrementally: either a json array of stones, or one stone per line (json lines).
+# Each UICR is turned into a tuple of its values, so that identical UICRs are counted instead of stored.
+# Counts are aggregated per hardware version and per mismatch pattern: the keys that differ from the mapped UICR.
+#
+# Usage:
+#   ./uicr_map_check.py <cloud_file> <map_file> [--json report.json]
+
+import argparse
 import json
-import sys
 import re
+from collections import Counter
 
 PRINT_COMPARES = False
 
-if (len(sys.argv) < 3):
-	print(f"Usage: {sys.argv[0]} <cloud_file> <map_file>")
-	exit(1)
-cloud_file_name = sys.argv[1]
-map_file_name = sys.argv[2]
-
-board_map = json.load(open(map_file_name, 'r'))
-cloud_data = json.load(open(cloud_file_name, 'r'))
-#except Exception as e:
-#	print(f"Unable to open file: {e}")
-
-uicr_per_hardware_version = {}
-for it in board_map:
-	uicr_per_hardware_version[str(it["hardwareVersion"])] = it["uicr"]
-
-print(uicr_per_hardware_version)
-
-uicr_keys = sorted(uicr_per_hardware_version[str(board_map[0]["hardwareVersion"])].keys())
-
-
-uicr_not_matching = {}
-
-uicr_in_cloud = {}
-
-unknown_hardware_versions = []
-
-release_firmware_version_regex = re.compile("\d+\.\d+\.\d+")
-
-#release_hardware_version_regex = re.compile("\d+[A-Z0-9]{6}")
-release_hardware_version_regex = re.compile("\d{11}")
-
-for stone in cloud_data:
-	firmware_version = stone.get("firmwareVersion", None)
-	product_type = stone.get("type", None)
-	bootloader_version = stone.get("bootloaderVersion", None)
-	hardware_version = stone.get("hardwareVersion", None)
-	if hardware_version is not None:
-		hardware_version = hardware_version[0:11]
-	stone_id = stone.get("id", None)
-	sphere_id = stone.get("sphereId", None)
-
-	uicr = None
-	if "uicr" in stone:
-		uicr = stone["uicr"]
-		# uicr = {}
-		# uicr["board"] = stone_uicr["board"]
-		# uicr["hardwareMajor"] = stone_uicr["hardwareMajor"]
-		# uicr["hardwareMinor"] = stone_uicr["hardwareMinor"]
-		# uicr["hardwarePatch"] = stone_uicr["hardwarePatch"]
-		# uicr["reserved1"] = stone_uicr["reserved1"]
-		# uicr["productType"] = stone_uicr["productType"]
-		# uicr["region"] = stone_uicr["region"]
-		# uicr["productFamily"] = stone_uicr["productFamily"]
-		# uicr["reserved2"] = stone_uicr["reserved2"]
-		# uicr["productionYear"] = stone_uicr["productionYear"]
-		# uicr["productionWeek"] = stone_uicr["productionWeek"]
-		# uicr["productHousing"] = stone_uicr["productHousing"]
-		# uicr["reserved3"] = stone_uicr["reserved3"]
-
-	#print(firmware_version, bootloader_version, hardware_version, uicr)
-	if hardware_version is None:
-		print("No hardware version")
-		continue
-
-	if hardware_version not in uicr_per_hardware_version:
-		print("Unknown hardware version:", hardware_version)
-
-		if release_hardware_version_regex.match(hardware_version):
-			unknown_hardware_versions.append(hardware_version)
-
-	if uicr is None:
-		continue
-
-	# Due to a bug in the android app, the key "productionYear" was named "producitonYear" for some time.
-	# Fix this here
-	if "productionYear" not in uicr and "producitonYear" in uicr:
-		uicr["productionYear"] = uicr["producitonYear"]
-
-	uicr_keys_set = uicr_keys.copy()
-	uicr_keys_set.remove("board")
-
-	# Check if UICR is set on the crownstone.
-	uicr_set = False
-	for key in uicr_keys_set:
-		if uicr.get(key, 255) != 255:
-			uicr_set = True
-
-	if not uicr_set:
-		print("UICR not set on stone, ignore")
-		continue
-
-	if not release_firmware_version_regex.match(firmware_version):
-		print("Non-release firmware version, ignore")
-		continue
-
-	# Keep up all UICRs in the cloud.
-	if hardware_version not in uicr_in_cloud:
-		uicr_in_cloud[hardware_version] = []
-	uicr_in_cloud[hardware_version].append(uicr)
-
-	# Compare UICR from cloud with mapped UICR
-	if hardware_version not in uicr_per_hardware_version:
-		continue
-	mapped_uicr = uicr_per_hardware_version[hardware_version]
-
-	uicr_keys_compared = uicr_keys.copy()
-	uicr_keys_compared.remove("productionYear")
-	uicr_keys_compared.remove("productionWeek")
-	uicr_keys_compared.remove("productHousing")
-
-	match = True
-	for key in uicr_keys_compared:
-		if uicr.get(key) != mapped_uicr.get(key):
-			match = False
-
-	if not match:
+# Size of the chunks in which the cloud export is read.
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Keys that are not compared with the mapped UICR.
+UICR_KEYS_NOT_COMPARED = ["productionYear", "productionWeek", "productHousing"]
+
+release_firmware_version_regex = re.compile(r"\d+\.\d+\.\d+")
+
+#release_hardware_version_regex = re.compile(r"\d+[A-Z0-9]{6}")
+release_hardware_version_regex = re.compile(r"\d{11}")
+
+def iter_json_array(file):
+	"""
+	Yields the elements of a json array, without reading the whole file.
+	"""
+	decoder = json.JSONDecoder()
+	buffer = ""
+	index = 0
+	started = False
+	while True:
+		# Skip whitespace and separators.
+		while index < len(buffer) and buffer[index] in " \t\r\n,":
+			index += 1
+		if index == len(buffer):
+			buffer = file.read(READ_CHUNK_SIZE)
+			index = 0
+			if buffer == "":
+				raise ValueError("Unexpected end of json array")
+			continue
+		if not started:
+			if buffer[index] != "[":
+				raise ValueError("Expected a json array")
+			started = True
+			index += 1
+			continue
+		if buffer[index] == "]":
+			return
+		try:
+			element, index = decoder.raw_decode(buffer, index)
+		except json.JSONDecodeError:
+			# The element is not complete yet: read more.
+			chunk = file.read(READ_CHUNK_SIZE)
+			if chunk == "":
+				raise
+			buffer = buffer[index:] + chunk
+			index = 0
+			continue
+		yield element
+
+def iter_stones(file_name):
+	"""
+	Yields the stones of a cloud export: a json array, or json lines.
+	"""
+	with open(file_name, 'r') as file:
+		first_char = ""
+		while first_char.isspace() or first_char == "":
+			first_char = file.read(1)
+			if first_char == "":
+				return
+		file.seek(0)
+		if first_char == "[":
+			yield from iter_json_array(file)
+			return
+		for line in file:
+			if line.strip():
+				yield json.loads(line)
+
+class UicrCheck:
+	def __init__(self, board_map):
+		self.uicr_per_hardware_version = {}
+		for it in board_map:
+			self.uicr_per_hardware_version[str(it["hardwareVersion"])] = it["uicr"]
+		self.uicr_keys = sorted(self.uicr_per_hardware_version[str(board_map[0]["hardwareVersion"])].keys())
+		self.uicr_keys_set = [key for key in self.uicr_keys if key != "board"]
+		self.uicr_keys_compared = [key for key in self.uicr_keys if key not in UICR_KEYS_NOT_COMPARED]
+		self.mapped_uicr_tuples = {}
+		for hardware_version, mapped_uicr in self.uicr_per_hardware_version.items():
+			self.mapped_uicr_tuples[hardware_version] = tuple(mapped_uicr.get(key) for key in self.uicr_keys)
+		self.compared_indices = [self.uicr_keys.index(key) for key in self.uicr_keys_compared]
+		self.set_indices = [self.uicr_keys.index(key) for key in self.uicr_keys_set]
+
+		self.num_stones = 0
+		# Number of stones per status, and per hardware version and status.
+		self.status_counts = Counter()
+		self.status_counts_per_hardware_version = {}
+		self.unknown_hardware_versions = Counter()
+		# Number of stones per hardware version and UICR tuple.
+		self.uicr_in_cloud = {}
+		# Number of stones per hardware version and UICR tuple that does not match.
+		self.uicr_not_matching = {}
+		# Number of stones per hardware version and tuple of keys that do not match.
+		self.mismatch_patterns = {}
+
+	def add_stone(self, stone):
+		self.num_stones += 1
+		hardware_version = stone.get("hardwareVersion", None)
+		if hardware_version is not None:
+			hardware_version = hardware_version[0:11]
+		status = self._check_stone(stone, hardware_version)
+		self.status_counts[status] += 1
+		if hardware_version is not None:
+			self.status_counts_per_hardware_version.setdefault(hardware_version, Counter())[status] += 1
+		return status
+
+	def _check_stone(self, stone, hardware_version):
+		if hardware_version is None:
+			return "noHardwareVersion"
+
+		known = hardware_version in self.uicr_per_hardware_version
+		if not known and release_hardware_version_regex.match(hardware_version):
+			self.unknown_hardware_versions[hardware_version] += 1
+
+		uicr = stone.get("uicr", None)
+		if uicr is None:
+			return "noUicr" if known else "unknownHardwareVersion"
+
+		# Due to a bug in the android app, the key "productionYear" was named "producitonYear" for some time.
+		# Fix this here
+		if "productionYear" not in uicr and "producitonYear" in uicr:
+			uicr = dict(uicr, productionYear=uicr["producitonYear"])
+
+		uicr_tuple = tuple(uicr.get(key) for key in self.uicr_keys)
+
+		# Check if UICR is set on the crownstone.
+		if all(uicr_tuple[i] in (255, None) for i in self.set_indices):
+			return "uicrNotSet"
+
+		firmware_version = stone.get("firmwareVersion", None)
+		if firmware_version is None or not release_firmware_version_regex.match(firmware_version):
+			return "nonReleaseFirmware"
+
+		# Keep up all UICRs in the cloud.
+		self.uicr_in_cloud.setdefault(hardware_version, Counter())[uicr_tuple] += 1
+
+		# Compare UICR from cloud with mapped UICR
+		if not known:
+			return "unknownHardwareVersion"
+		mapped_uicr_tuple = self.mapped_uicr_tuples[hardware_version]
+		mismatch = tuple(self.uicr_keys[i] for i in self.compared_indices if uicr_tuple[i] != mapped_uicr_tuple[i])
+		if not mismatch:
+			return "match"
+
 		if PRINT_COMPARES:
 			print("UICR does not match:")
 			print("cloud:", stone)
-			for key in uicr_keys:
-				print(f"{key}: cloud={uicr.get(key)} mapped={mapped_uicr.get(key)}")
-
-		# Keep up all the non matching UICRs
-		if hardware_version not in uicr_not_matching:
-			uicr_not_matching[hardware_version] = []
-		# Store as string, so we can easily remove duplicates
-		uicr_not_matching[hardware_version].append(str(uicr))
-
-# Remove duplicates from non matching UICRs
-for key in uicr_not_matching.keys():
-	uicr_not_matching[key] = list(set(uicr_not_matching[key]))
-
-# Print all non matching UICRs
-for hardware_version in uicr_not_matching.keys():
-	mapped_uicr = uicr_per_hardware_version[hardware_version]
-	print(f"Non matching uicr for hardware version {hardware_version}:")
-	for entry in uicr_not_matching.get(hardware_version):
-		cloud = json.loads(entry.replace("'", '"'))
-		for key in sorted(uicr_per_hardware_version[hardware_version].keys()):
-			if cloud.get(key) != mapped_uicr.get(key):
-				print(f"    {key}: cloud={cloud.get(key)} mapped={mapped_uicr.get(key)}")
+			for key in self.uicr_keys:
+				print(f"{key}: cloud={uicr.get(key)} mapped={self.uicr_per_hardware_version[hardware_version].get(key)}")
+
+		self.uicr_not_matching.setdefault(hardware_version, Counter())[uicr_tuple] += 1
+		self.mismatch_patterns.setdefault(hardware_version, Counter())[mismatch] += 1
+		return "mismatch"
+
+	def get_report(self):
+		"""
+		:return: Dict with the results, that can be serialized to json.
+		"""
+		def uicr_counts(counter):
+			return [{"uicr": dict(zip(self.uicr_keys, uicr_tuple)), "count": count} for uicr_tuple, count in counter.most_common()]
+
+		return {
+			"numStones": self.num_stones,
+			"statusCounts": dict(self.status_counts),
+			"hardwareVersions": {
+				hardware_version: {
+					"statusCounts": dict(counts),
+					"mismatchPatterns": [{"keys": list(keys), "count": count} for keys, count in self.mismatch_patterns.get(hardware_version, Counter()).most_common()],
+					"uicrNotMatching": uicr_counts(self.uicr_not_matching.get(hardware_version, Counter())),
+					"uicrInCloud": uicr_counts(self.uicr_in_cloud.get(hardware_version, Counter())),
+				}
+				for hardware_version, counts in sorted(self.status_counts_per_hardware_version.items())
+			},
+			"unknownReleaseHardwareVersions": dict(self.unknown_hardware_versions.most_common()),
+		}
+
+	def print_report(self):
+		print(f"Checked {self.num_stones} stones:")
+		for status, count in self.status_counts.most_common():
+			print(f"    {status:22}: {count}")
+
+		# Print all non matching UICRs
+		for hardware_version in sorted(self.uicr_not_matching.keys()):
+			mapped_uicr_tuple = self.mapped_uicr_tuples[hardware_version]
+			counts = self.status_counts_per_hardware_version[hardware_version]
+			print("")
+			print(f"Non matching uicr for hardware version {hardware_version}: {counts['mismatch']} of {counts['match'] + counts['mismatch']} stones")
+			for keys, count in self.mismatch_patterns[hardware_version].most_common():
+				print(f"    {count} stones with different: {', '.join(keys)}")
+			for uicr_tuple, count in self.uicr_not_matching[hardware_version].most_common():
+				print(f"    {count} stones with:")
+				for i, key in enumerate(self.uicr_keys):
+					if uicr_tuple[i] != mapped_uicr_tuple[i]:
+						print(f"        {key}: cloud={uicr_tuple[i]} mapped={mapped_uicr_tuple[i]}")
+
 		print("")
+		print("All unknown release hardware version strings:")
+		print(dict(self.unknown_hardware_versions.most_common()))
 
-	# 	print(f"    cloud={entry}")
-	# print(f"    mapped={mapped_uicr}")
-	# for key in sorted(uicr_per_hardware_version[hardware_version].keys()):
-	# 	print(f"    {key}: cloud={uicr_not_matching.get(key)} mapped={mapped_uicr.get(key)}")
-
-print("")
-print("All unknown release hardware version strings:")
-print(list(set(unknown_hardware_versions)))
-
-print("Known unknown release hardware version strings:")
-print("10108000400: board=1100 aka CR01R02v4")
-print("10103020000: board=1007 aka ACR01B7B / ACR01B9C / ACR01B9E / ACR01B9F / ACR01B10A")
-print("10103010000: board=1004 aka ACR01B1E")
-print("10102010200: board=1504 aka ACR01B2F / ACR01B2G")
-
-print("")
-print("All UICR combinations found in the cloud (by hardware version):")
-for hardware_version in uicr_in_cloud:
-	# Remove duplicates
-	unique = []
-	for entry in uicr_in_cloud[hardware_version]:
-		if entry not in unique:
-			unique.append(entry)
-	uicr_in_cloud[hardware_version] = unique
-
-	print("")
-	print(hardware_version)
-	values = {}
-	for key in uicr_keys:
-		values[key] = []
-
-	for entry in uicr_in_cloud[hardware_version]:
-		for key in uicr_keys:
-			values[key].append(entry.get(key))
-
-	for key in uicr_keys:
-		valuesString = ""
-		for value in values[key]:
-			valuesString += f"{str(value):5} "
-		print(f"    {key:20}: {valuesString}")
-
-
-# Also print for the PRODUCT_NAMING.md document.
-print("")
-product_naming_boards = {}
-for hardware_version in uicr_in_cloud:
-	for entry in uicr_in_cloud[hardware_version]:
-		board = entry.get("board")
-		if board not in product_naming_boards:
-			product_naming_boards[board] = []
-
-		# There are still some entries without production year, that messes up the formatting.
-		product_naming_boards[board].append(f'| {board:4} '
-		                                    f' | {entry.get("productFamily"):1}     '
-		                                    f' | {entry.get("region"):02}    '
-		                                    f' | {entry.get("productType"):02}  '
-		                                    f' | {entry.get("hardwareMajor"):02}   '
-		                                    f' | {entry.get("hardwareMinor"):02}   '
-		                                    f' | {entry.get("hardwarePatch"):02}   '
-		                                    f' | {str(entry.get("productionYear")):2}  '
-		                                    f' | {entry.get("productionWeek"):02}  '
-		                                    f' | {entry.get("productHousing"):1}       |')
-
-print("")
-print("| Board | Family | Market | Type | Major | Minor | Patch | Year | Week | Housing |")
-print("| ----- | ------ | ------ | ---- | ----- | ----- | ----- | ---- | ---- | ------- |")
-for board in sorted(product_naming_boards.keys()):
-	product_naming_boards[board] = list(set(product_naming_boards[board]))
-	for entry in product_naming_boards[board]:
-		print(entry)
+		print("Known unknown release hardware version strings:")
+		print("10108000400: board=1100 aka CR01R02v4")
+		print("10103020000: board=1007 aka ACR01B7B / ACR01B9C / ACR01B9E / ACR01B9F / ACR01B10A")
+		print("10103010000: board=1004 aka ACR01B1E")
+		print("10102010200: board=1504 aka ACR01B2F / ACR01B2G")
 
+		print("")
+		print("All UICR combinations found in the cloud (by hardware version):")
+		for hardware_version in self.uicr_in_cloud:
+			print("")
+			print(hardware_version)
+			unique = list(self.uicr_in_cloud[hardware_version].keys())
+			print(f"    {'count':20}: {''.join(f'{count:<5} ' for count in self.uicr_in_cloud[hardware_version].values())}")
+			for i, key in enumerate(self.uicr_keys):
+				print(f"    {key:20}: {''.join(f'{str(uicr_tuple[i]):5} ' for uicr_tuple in unique)}")
+
+		# Also print for the PRODUCT_NAMING.md document.
+		print("")
+		board_index = self.uicr_keys.index("board")
+		product_naming_boards = {}
+		for hardware_version in self.uicr_in_cloud:
+			for uicr_tuple in self.uicr_in_cloud[hardware_version]:
+				entry = dict(zip(self.uicr_keys, uicr_tuple))
+				# There are still some entries without production year, that messes up the formatting.
+				product_naming_boards.setdefault(uicr_tuple[board_index], set()).add(
+				                                    f'| {entry.get("board"):4} '
+				                                    f' | {entry.get("productFamily"):1}     '
+				                                    f' | {entry.get("region"):02}    '
+				                                    f' | {entry.get("productType"):02}  '
+				                                    f' | {entry.get("hardwareMajor"):02}   '
+				                                    f' | {entry.get("hardwareMinor"):02}   '
+				                                    f' | {entry.get("hardwarePatch"):02}   '
+				                                    f' | {str(entry.get("productionYear")):2}  '
+				                                    f' | {entry.get("productionWeek"):02}  '
+				                                    f' | {entry.get("productHousing"):1}       |')
+
+		print("")
+		print("| Board | Family | Market | Type | Major | Minor | Patch | Year | Week | Housing |")
+		print("| ----- | ------ | ------ | ---- | ----- | ----- | ----- | ---- | ---- | ------- |")
+		for board in sorted(product_naming_boards.keys()):
+			for entry in product_naming_boards[board]:
+				print(entry)
+
+def main():
+	parser = argparse.ArgumentParser(description='Check UICRs of a cloud export against the board map')
+	parser.add_argument('cloud_file', help='Cloud export: a json array of stones, or one stone per line')
+	parser.add_argument('map_file', help='Board map, for example board_map.json')
+	parser.add_argument('--json', dest='json_file', default=None,
+			help='Write the report as json to this file, - for stdout instead of the text report')
+	args = parser.parse_args()
+
+	with open(args.map_file, 'r') as file:
+		board_map = json.load(file)
+	check = UicrCheck(board_map)
+	for stone in iter_stones(args.cloud_file):
+		check.add_stone(stone)
+
+	if args.json_file == "-":
+		print(json.dumps(check.get_report(), indent=2))
+		return
+	check.print_report()
+	if args.json_file is not None:
+		with open(args.json_file, 'w') as file:
+			json.dump(check.get_report(), file, indent=2)
+
+if __name__ == '__main__':
+	main()
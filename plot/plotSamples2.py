@@ -11,6 +11,7 @@ import re
 # from ..record import parse_app_files
 sys.path.append('../record')
 import parse_recorded_voltage
+import capture_file
 import parse_app_files
 
 class PowerSampleType(Enum):
@@ -84,7 +85,7 @@ def main():
 		fig.suptitle(fileName)
 
 		# Parse file
-		if (fileName.split('.')[-1] == 'json'):
+		if (capture_file.isCaptureFile(fileName)):
 			allTimestamps, allSamples = parse_recorded_voltage.parse(fileName, filterTimeJumps=False)
 		else:
 			allTimestamps, allSamples = parse_app_files.parse(fileName)
@@ -0,0 +1,158 @@
+"""
+Writes and reads capture files.
+
+Capture files consist of self-delimiting blocks of json lines, one entry per line.
+When compressed, each block is a separate gzip member, so a file that was not closed properly
+(for example after a crash) can still be read, up to the last complete line.
+
+Also reads the older format: a single json array, as written by the first version of record-voltage.py.
+"""
+
+import gzip
+import json
+import os
+import time
+import zlib
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+CAPTURE_FILE_EXTENSIONS = ('.json', '.jsonl', '.jsonl.gz')
+
+def isCaptureFile(fileName):
+    """
+    Whether the file name has the extension of a capture file.
+    """
+    return fileName.endswith(CAPTURE_FILE_EXTENSIONS)
+
+class CaptureWriter:
+    def __init__(self, fileDir, filenamePrefix, compress=True, rotateSizeBytes=100 * 1024 * 1024, rotateIntervalS=3600):
+        """
+        :param fileDir:         Directory to put the files.
+        :param filenamePrefix:  Prefix of the file names, followed by the time of creation.
+        :param compress:        Whether to gzip the blocks.
+        :param rotateSizeBytes: Start a new file when the file is larger than this. 0 to disable.
+        :param rotateIntervalS: Start a new file when the file is older than this. 0 to disable.
+        """
+        self.fileDir = fileDir
+        self.filenamePrefix = filenamePrefix
+        self.compress = compress
+        self.rotateSizeBytes = rotateSizeBytes
+        self.rotateIntervalS = rotateIntervalS
+        self.file = None
+        self.fileName = None
+        self.fileSize = 0
+        self.fileStartTime = 0
+        self.numEntries = 0
+
+    def newFile(self):
+        """
+        Closes the current file, and starts a new one.
+        """
+        self.close()
+        timeStr = time.strftime("%Y-%m-%d--%H-%M-%S")
+        extension = ".jsonl.gz" if self.compress else ".jsonl"
+        fileName = os.path.join(self.fileDir, self.filenamePrefix + "-" + timeStr + extension)
+        # Don't overwrite a file that was started in the same second.
+        index = 1
+        while os.path.exists(fileName):
+            fileName = os.path.join(self.fileDir, self.filenamePrefix + "-" + timeStr + "-" + str(index) + extension)
+            index += 1
+        self.fileName = fileName
+        self.file = open(fileName, 'wb')
+        self.fileSize = 0
+        self.fileStartTime = time.time()
+        self.numEntries = 0
+
+    def write(self, entries):
+        """
+        Writes a list of entries as a single block, and flushes it to disk.
+        Starts a new file first, when the rotate size or interval is reached.
+        """
+        if self.file is None or self._shouldRotate():
+            self.newFile()
+        self._writeBlock(entries)
+        self.numEntries += len(entries)
+
+    def close(self):
+        """
+        Closes the current file, with a footer entry that marks the end of the capture.
+        """
+        if self.file is None:
+            return
+        self._writeBlock([{'end': True, 'entries': self.numEntries}])
+        self.file.close()
+        self.file = None
+
+    def _shouldRotate(self):
+        if self.rotateSizeBytes and self.fileSize >= self.rotateSizeBytes:
+            return True
+        if self.rotateIntervalS and time.time() - self.fileStartTime >= self.rotateIntervalS:
+            return True
+        return False
+
+    def _writeBlock(self, entries):
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode()
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        self.file.write(data)
+        self.file.flush()
+        self.fileSize += len(data)
+
+def _readLines(fileName):
+    """
+    Yields the lines of a capture file, decompressing gzip blocks on the fly.
+    A trailing incomplete line or block is ignored.
+    """
+    with open(fileName, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+        f.seek(0)
+        decompressor = zlib.decompressobj(wbits=31) if compressed else None
+        remainder = b''
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            if compressed:
+                data = b''
+                while chunk:
+                    data += decompressor.decompress(chunk)
+                    if not decompressor.eof:
+                        break
+                    # The next gzip member starts with the unused data.
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+            else:
+                data = chunk
+            lines = (remainder + data).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                if line:
+                    yield line
+
+def readEntries(fileName):
+    """
+    Yields the entries of a capture file, in any of the supported formats.
+    """
+    with open(fileName, 'rb') as f:
+        start = f.read(2)
+    if start[:1] == b'[':
+        # Old format: a single json array.
+        with open(fileName, 'r') as f:
+            try:
+                entries = json.load(f)
+            except ValueError:
+                # The array was not closed, fall back to reading it with one entry per line.
+                entries = None
+        if entries is not None:
+            for entry in entries:
+                yield entry
+            return
+    for line in _readLines(fileName):
+        line = line.rstrip(b', \r')
+        if line in (b'[', b']'):
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Partially written line.
+            pass
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+Collect power samples of many Crownstones, using multiple BLE adapters at the same time.
+
+Each round, every Crownstone gets a job: connect, retrieve a number of power samples, and disconnect.
+Each adapter runs a worker that takes jobs from a shared queue, so that the Crownstones are spread over the adapters.
+A job that fails is retried with exponential backoff, so that an unreachable Crownstone doesn't keep an adapter busy.
+
+Output:
+  <outputPrefix>_samples.jsonl: one json line per set of power samples, with the calculated RMS values and power.
+  <outputPrefix>_aligned.csv:   the power of each Crownstone, interpolated to a common time grid.
+
+With --simulate, simulated adapters and Crownstones are used instead.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from crownstone_core.protocol.BluenetTypes import PowerSamplesType
+
+sys.path.append('..')
+from retry_queue import RetryQueue
+
+parser = argparse.ArgumentParser(description='Collect power samples of Crownstones with multiple BLE adapters')
+parser.add_argument('-A', '--adapterAddress', dest='adapterAddresses', type=str, action='append',
+		help='Adapter MAC address of a bluetooth chip to use, can be given multiple times. You can get a list by running: hcitool dev')
+parser.add_argument('-N', '--numBuffers', dest='numBuffers', type=int, default=5,
+		help='Number of power samples to retrieve per Crownstone per round')
+parser.add_argument('-n', '--rounds', dest='numRounds', type=int, default=1,
+		help='Number of rounds, 0 to keep going until interrupted')
+parser.add_argument('-i', '--interval', dest='roundInterval', type=float, default=0.0,
+		help='Minimal time in seconds between the start of rounds')
+parser.add_argument('-R', '--retries', dest='retries', type=int, default=3,
+		help='Number of times to retry a Crownstone that failed, per round')
+parser.add_argument('-a', '--alignInterval', dest='alignInterval', type=float, default=1.0,
+		help='Time in seconds between the points of the aligned output')
+parser.add_argument('-O', '--outputPrefix', dest='outputPrefix', type=str, default="collected",
+		help='Output filename prefix')
+parser.add_argument('--simulate', dest='simulate', action='store_true',
+		help='Use simulated adapters and Crownstones. The key file is ignored.')
+parser.add_argument('--simulatedAdapters', dest='numSimulatedAdapters', type=int, default=2,
+		help='Number of simulated adapters, when no adapter addresses are given')
+parser.add_argument('--simulatedFailureRate', dest='simulatedFailureRate', type=float, default=0.1,
+		help='Probability that connecting to a simulated Crownstone fails')
+parser.add_argument('keyFile',
+		help='The json file with key information, expected values: admin, member, guest, basic,' +
+		'serviceDataKey, localizationKey, meshApplicationKey, and meshNetworkKey')
+parser.add_argument('bleAddresses', type=str, nargs='+',
+		help='The BLE addresses of the Crownstones to collect samples from')
+
+class SampleJob:
+	def __init__(self, bleAddress, roundIndex):
+		self.bleAddress = bleAddress
+		self.roundIndex = roundIndex
+		self.attempts = 0
+
+class Adapter:
+	def __init__(self, name, core):
+		self.name = name
+		self.core = core
+		self.numJobs = 0
+		self.numFailures = 0
+		self.busyTime = 0.0
+
+def calcPower(powerSamplesList):
+	"""
+	:return: Dict with RMS voltage, RMS current and real power, after subtracting the mean.
+	"""
+	voltage = (np.array(powerSamplesList[0].samples, dtype=float) - powerSamplesList[0].offset) * powerSamplesList[0].multiplier
+	current = (np.array(powerSamplesList[1].samples, dtype=float) - powerSamplesList[1].offset) * powerSamplesList[1].multiplier
+	voltage -= np.mean(voltage)
+	current -= np.mean(current)
+	return {
+		"voltageRms": float(np.sqrt(np.mean(voltage * voltage))),
+		"currentRms": float(np.sqrt(np.mean(current * current))),
+		"powerReal": float(np.mean(voltage * current)),
+	}
+
+class Collector:
+	"""
+	Schedules sample jobs over the adapters, and keeps up the results.
+	"""
+	def __init__(self, adapters, numBuffers, retries, outputFile):
+		self.adapters = adapters
+		self.numBuffers = numBuffers
+		self.retries = retries
+		self.outputFile = outputFile
+		self.jobQueue = RetryQueue(self.retrieveSamples, retries, self.onJobError)
+		self.failedJobs = []
+		# Per Crownstone: list of (localTimestamp, powerReal).
+		self.results = {}
+
+	async def runRound(self, bleAddresses, roundIndex):
+		jobs = [SampleJob(bleAddress, roundIndex) for bleAddress in bleAddresses]
+		self.failedJobs += await self.jobQueue.run(self.adapters, jobs)
+
+	def onJobError(self, adapter, job, err, retry):
+		adapter.numFailures += 1
+		print(adapter.name, "failed to get power samples of", job.bleAddress, ":", err)
+
+	async def retrieveSamples(self, adapter, job):
+		adapter.numJobs += 1
+		startTime = time.time()
+		await adapter.core.connect(job.bleAddress)
+		try:
+			for i in range(0, self.numBuffers):
+				powerSamples = await adapter.core.debug.getPowerSamples(PowerSamplesType.NOW_FILTERED)
+				self.addResult(adapter, job, time.time(), powerSamples)
+		finally:
+			await adapter.core.disconnect()
+			adapter.busyTime += time.time() - startTime
+
+	def addResult(self, adapter, job, localTimestamp, powerSamples):
+		output = calcPower(powerSamples)
+		self.results.setdefault(job.bleAddress, []).append((localTimestamp, output["powerReal"]))
+		output["bleAddress"] = job.bleAddress
+		output["adapter"] = adapter.name
+		output["round"] = job.roundIndex
+		output["localTimestamp"] = localTimestamp
+		output["timestamp"] = powerSamples[0].timestamp
+		output["voltageSamples"] = powerSamples[0].samples
+		output["currentSamples"] = powerSamples[1].samples
+		self.outputFile.write(json.dumps(output) + "\n")
+
+	def getAligned(self, bleAddresses, alignInterval):
+		"""
+		Interpolates the power of each Crownstone to a common time grid.
+		Points outside the time range of a Crownstone are NaN.
+
+		:return: Tuple of (times, powers), with powers of shape (len(times), len(bleAddresses)).
+		"""
+		series = {}
+		for bleAddress, values in self.results.items():
+			values = np.array(sorted(values))
+			series[bleAddress] = values
+		if not series:
+			return np.zeros(0), np.zeros((0, len(bleAddresses)))
+		startTime = min(values[0, 0] for values in series.values())
+		endTime = max(values[-1, 0] for values in series.values())
+		times = np.arange(startTime, endTime + alignInterval, alignInterval)
+		powers = np.full((len(times), len(bleAddresses)), np.nan)
+		for column, bleAddress in enumerate(bleAddresses):
+			values = series.get(bleAddress)
+			if values is None:
+				continue
+			powers[:, column] = np.interp(times, values[:, 0], values[:, 1], left=np.nan, right=np.nan)
+		return times, powers
+
+def writeAligned(fileName, bleAddresses, times, powers):
+	with open(fileName, 'w') as outputFile:
+		outputFile.write("time," + ",".join(bleAddresses) + "\n")
+		for i in range(0, len(times)):
+			outputFile.write("{:.3f},".format(times[i]) + ",".join("" if np.isnan(p) else "{:.3f}".format(p) for p in powers[i]) + "\n")
+
+def createAdapters(args):
+	if args.simulate:
+		sys.path.append('../calibrate-power')
+		from simulated_crownstone import SimulatedCrownstoneBle, SimulatedDevice
+		devices = [SimulatedDevice(address, seed=i) for i, address in enumerate(args.bleAddresses)]
+		names = args.adapterAddresses or ["sim" + str(i) for i in range(0, args.numSimulatedAdapters)]
+		return [Adapter(name, SimulatedCrownstoneBle(devices, connectFailureRate=args.simulatedFailureRate, seed=i))
+		        for i, name in enumerate(names)]
+	from crownstone_ble import CrownstoneBle
+	adapters = []
+	for adapterAddress in (args.adapterAddresses or [None]):
+		core = CrownstoneBle(bleAdapterAddress=adapterAddress)
+		core.loadSettingsFromFile(args.keyFile)
+		adapters.append(Adapter(adapterAddress or "default", core))
+	return adapters
+
+async def main():
+	args = parser.parse_args()
+	adapters = createAdapters(args)
+	startTime = time.time()
+	outputFile = open(args.outputPrefix + "_samples.jsonl", 'w')
+	collector = Collector(adapters, args.numBuffers, args.retries, outputFile)
+	try:
+		roundIndex = 0
+		while args.numRounds == 0 or roundIndex < args.numRounds:
+			roundStartTime = time.time()
+			await collector.runRound(args.bleAddresses, roundIndex)
+			print("Round", roundIndex, "done in {:.2f}s".format(time.time() - roundStartTime))
+			roundIndex += 1
+			delay = roundStartTime + args.roundInterval - time.time()
+			if delay > 0:
+				await asyncio.sleep(delay)
+	except (Exception, asyncio.CancelledError) as err:
+		print("Stopped collecting:", repr(err))
+		if not isinstance(err, asyncio.CancelledError):
+			traceback.print_exc()
+	finally:
+		outputFile.close()
+
+	times, powers = collector.getAligned(args.bleAddresses, args.alignInterval)
+	writeAligned(args.outputPrefix + "_aligned.csv", args.bleAddresses, times, powers)
+
+	totalTime = time.time() - startTime
+	for job in collector.failedJobs:
+		print("Failed to collect", job.bleAddress, "in round", job.roundIndex)
+	for adapter in adapters:
+		print("Adapter {}: jobs={} failures={} busy={:.1f}%".format(
+		      adapter.name, adapter.numJobs, adapter.numFailures, adapter.busyTime / totalTime * 100))
+		await adapter.core.shutDown()
+
+if __name__ == '__main__':
+	try:
+		asyncio.run(main())
+	except KeyboardInterrupt:
+		pass
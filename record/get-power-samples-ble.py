@@ -1,23 +1,38 @@
 #!/usr/bin/env python3
 
+"""
+Connect to a Crownstone and continuously get power samples.
+
+The connection is kept alive, and power samples are requested at a target rate.
+Each set of power samples is appended as a json line to: <outputPrefix>_<bleAddress>_<date>.txt
+At the end, the achieved rate, the jitter of the request interval, and the throughput are printed.
+
+With --simulate, a simulated Crownstone is used, so that rates and throughput can be benchmarked offline.
+"""
+
 import argparse
+import asyncio
+import collections
 import time
-
-from crownstone_ble import CrownstoneBle
-from crownstone_core.packets.debug.PowerSamplesPacket import PowerSamplesPacket
-from crownstone_core.protocol.BluenetTypes import PowerSamplesType
 import traceback
-import numpy as np
-import select
-import sys
 import json
 import datetime
+import sys
+
+import numpy as np
+
+from crownstone_core.packets.debug.PowerSamplesPacket import PowerSamplesPacket
+from crownstone_core.protocol.BluenetTypes import PowerSamplesType
 
 parser = argparse.ArgumentParser(description='Connect to Crownstone and repeatedly get power samples')
-parser.add_argument('-H', '--hciIndex', dest='hciIndex', type=int, nargs='?', default=0,
-		help='The hci-index of the BLE chip')
+parser.add_argument('-A', '--adapterAddress', dest='adapterAddress', type=str, default=None,
+		help='Adapter MAC address of the bluetooth chip you want to use (linux only). You can get a list by running: hcitool dev')
 parser.add_argument('-N', '--times', dest='numTimes', type=int, nargs='?', default=10,
-        help='Number of times to get buffers')
+		help='Number of times to get buffers, 0 to keep going until interrupted')
+parser.add_argument('-r', '--rate', dest='rate', type=float, default=0.0,
+		help='Target number of requests per second, 0 to request as fast as possible')
+parser.add_argument('-R', '--reconnects', dest='reconnects', type=int, default=3,
+		help='Number of times to reconnect after failed requests in a row')
 parser.add_argument('-V', '--voltage', dest='voltageGroundTruth', type=float, nargs='?', default=0.0,
 		help='The ground truth RMS voltage')
 parser.add_argument('-C', '--current', dest='currentGroundTruth', type=float, nargs='?', default=0.0,
@@ -26,37 +41,37 @@ parser.add_argument('-P', '--power', dest='powerGroundTruth', type=float, nargs=
 		help='The ground truth RMS real power')
 parser.add_argument('-O', '--outputPrefix', dest='outputPrefix', type=str, nargs='?', default="output",
 		help='Output filename prefix')
+parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
+		help='Do not print the RMS of every set of samples')
+parser.add_argument('--simulate', dest='simulate', action='store_true',
+		help='Use a simulated Crownstone instead of the BLE adapter. The key file is ignored.')
+parser.add_argument('--simulatedRequestTime', dest='simulatedRequestTime', type=float, default=0.1,
+		help='Time in seconds a simulated request takes')
 parser.add_argument('keyFile',
 		help='The json file with key information, expected values: admin, member, guest, basic,' +
 		'serviceDataKey, localizationKey, meshApplicationKey, and meshNetworkKey')
 parser.add_argument('bleAddress', type=str,
-		help='The BLE address of Crownstone to switch')
+		help='The BLE address of Crownstone to get power samples from')
 
-args = parser.parse_args()
+# Flush the output file at least this often.
+FLUSH_INTERVAL_S = 5.0
 
-def calcCurrentOrVoltageRms(samples, zero):
-	rms = calcRms(samples - zero, samples - zero)
-	return rms
+# Number of most recent request intervals to calculate the interval percentile over.
+STATS_WINDOW = 10000
 
-def calcRms(samples1, samples2, squareRoot=True):
-	rms = 0.0
-	for i in range(0, len(samples1)):
-		rms += samples1[i] * samples2[i]
-	rms /= len(samples1)
-	if (squareRoot):
-		return np.sqrt(rms)
-	else:
-		return rms
+def calcStats(samples):
+	"""
+	:param samples: Array of samples.
+	:return:        Tuple of (rms, zero, rms with the zero subtracted).
+	"""
+	samples = np.asarray(samples, dtype=float)
+	zero = np.mean(samples)
+	meanSquare = np.mean(samples * samples)
+	# Var = E[x^2] - E[x]^2, clip negative values caused by rounding.
+	return np.sqrt(meanSquare), zero, np.sqrt(max(meanSquare - zero * zero, 0.0))
 
-def calcZero(samples):
-	return np.mean(samples)
-
-
-def pollKeyboard():
-	# dr, dw, de = select.select([sys.stdin], [], [], 0)
-	# if not dr == []:
-	#     return sys.stdin.read(1)
-	return None
+def getCorrectedSamples(powerSamplesPacket: PowerSamplesPacket):
+	return (np.array(powerSamplesPacket.samples, dtype=float) - powerSamplesPacket.offset) * powerSamplesPacket.multiplier
 
 def getMap(powerSamplesPacket: PowerSamplesPacket):
 	powerSamplesMap = {}
@@ -67,68 +82,191 @@ def getMap(powerSamplesPacket: PowerSamplesPacket):
 	powerSamplesMap["samples"] = powerSamplesPacket.samples
 	return powerSamplesMap
 
-# Initialize the Bluetooth Core.
-core = CrownstoneBle(hciIndex=args.hciIndex)
-core.loadSettingsFromFile(args.keyFile)
+class OutputWriter:
+	"""
+	Keeps the output file open, and starts a new file when the date changes.
+	"""
+	def __init__(self, outputPrefix, bleAddress):
+		self.outputPrefix = outputPrefix
+		self.bleAddress = bleAddress
+		self.file = None
+		self.fileName = None
+		self.lastFlushTime = time.time()
 
-try:
-	print("Connecting to", args.bleAddress)
-	core.connect(args.bleAddress)
+	def write(self, output):
+		fileName = self.outputPrefix + "_" + self.bleAddress + "_" + datetime.datetime.now().strftime("%Y-%m-%d") + ".txt"
+		if fileName != self.fileName:
+			self.close()
+			self.fileName = fileName
+			self.file = open(fileName, 'a')
+		self.file.write(json.dumps(output) + "\n")
+		if time.time() - self.lastFlushTime > FLUSH_INTERVAL_S:
+			self.file.flush()
+			self.lastFlushTime = time.time()
 
-	try:
-		for i in range(0, args.numTimes):
-			output = {}
-			output["voltageGroundTruth"] = args.voltageGroundTruth
-			output["currentGroundTruth"] = args.currentGroundTruth
-			output["powerGroundTruth"] = args.powerGroundTruth
-
-#            print("Retrieving power samples..")
-
-#            powerSamplesUnfiltered = core.debug.getPowerSamples(PowerSamplesType.NOW_UNFILTERED)
-#            power = calcPower(powerSamplesUnfiltered)
-#            print("Unfiltered:", power)
-
-			powerSamplesFiltered = core.debug.getPowerSamples(PowerSamplesType.NOW_FILTERED)
-			voltageSamples = np.array(powerSamplesFiltered[0].samples)
-			voltageSamples = (voltageSamples - powerSamplesFiltered[0].offset) * powerSamplesFiltered[0].multiplier
-			currentSamples = np.array(powerSamplesFiltered[1].samples)
-			currentSamples = (currentSamples - powerSamplesFiltered[1].offset) * powerSamplesFiltered[1].multiplier
-			print("Vrms={:8.2f} Voffset={:8.2f} Vrms-corrected={:8.2f}".format(
-			      calcCurrentOrVoltageRms(voltageSamples, 0),
-			      calcZero(voltageSamples),
-			      calcCurrentOrVoltageRms(voltageSamples, calcZero(voltageSamples))
-			      ))
-			print("Irms={:8.2f} Ioffset={:8.2f} Irms-corrected={:8.2f}".format(
-			      calcCurrentOrVoltageRms(currentSamples, 0),
-			      calcZero(currentSamples),
-			      calcCurrentOrVoltageRms(currentSamples, calcZero(currentSamples))
-			      ))
-			print("")
-
-			output["localTime"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-			output["localTimestamp"] = time.time()
-			output["voltage"] = getMap(powerSamplesFiltered[0])
-			output["current"] = getMap(powerSamplesFiltered[1])
-
-			key = pollKeyboard()
-			if key is not None:
-				print("Pressed:", key)
-
-			fileName = args.outputPrefix + "_" + args.bleAddress + "_" + datetime.datetime.now().strftime("%Y-%m-%d") + ".txt"
-			with open(fileName, 'a') as outfile:
-				json.dump(output, outfile)
-				outfile.write("\n")
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+class PollStats:
+	"""
+	Keeps up running statistics of the requests, so that memory use doesn't grow on unbounded runs.
+	The interval percentile is calculated over the last STATS_WINDOW intervals.
+	"""
+	def __init__(self):
+		self.numRequests = 0
+		self.firstStartTime = None
+		self.lastStartTime = None
+		self.lastEndTime = None
+		self.numSamples = 0
+		self.failures = 0
+		self.intervalSum = 0.0
+		self.intervalSquareSum = 0.0
+		self.intervalMin = float('inf')
+		self.intervalMax = 0.0
+		self.recentIntervals = collections.deque(maxlen=STATS_WINDOW)
+		self.durationSum = 0.0
+		self.durationMax = 0.0
+
+	def add(self, startTime, duration, numSamples):
+		if self.lastStartTime is not None:
+			interval = startTime - self.lastStartTime
+			self.intervalSum += interval
+			self.intervalSquareSum += interval * interval
+			self.intervalMin = min(self.intervalMin, interval)
+			self.intervalMax = max(self.intervalMax, interval)
+			self.recentIntervals.append(interval)
+		else:
+			self.firstStartTime = startTime
+		self.lastStartTime = startTime
+		self.lastEndTime = startTime + duration
+		self.numRequests += 1
+		self.durationSum += duration
+		self.durationMax = max(self.durationMax, duration)
+		self.numSamples += numSamples
+
+	def print(self, targetRate):
+		numRequests = self.numRequests
+		print("Requests:", numRequests, "failed:", self.failures)
+		if numRequests < 2:
+			return
+		numIntervals = numRequests - 1
+		totalTime = self.lastEndTime - self.firstStartTime
+		meanInterval = self.intervalSum / numIntervals
+		meanSquareInterval = self.intervalSquareSum / numIntervals
+		print("Rate: {:.2f}/s (target {})".format(numIntervals / (self.lastStartTime - self.firstStartTime),
+		      "{:.2f}/s".format(targetRate) if targetRate > 0 else "max"))
+		print("Interval: mean={:.4f}s std={:.4f}s min={:.4f}s max={:.4f}s p99={:.4f}s".format(
+		      meanInterval, np.sqrt(max(meanSquareInterval - meanInterval * meanInterval, 0.0)),
+		      self.intervalMin, self.intervalMax, np.percentile(self.recentIntervals, 99)))
+		if targetRate > 0:
+			# E[(x - T)^2] = E[x^2] - 2 T E[x] + T^2
+			targetInterval = 1.0 / targetRate
+			meanSquareJitter = meanSquareInterval - 2 * targetInterval * meanInterval + targetInterval * targetInterval
+			print("Jitter: mean={:.4f}s rms={:.4f}s".format(meanInterval - targetInterval, np.sqrt(max(meanSquareJitter, 0.0))))
+		print("Request duration: mean={:.4f}s max={:.4f}s".format(self.durationSum / numRequests, self.durationMax))
+		print("Throughput: {:.1f} samples/s".format(self.numSamples / totalTime))
+
+def processSamples(args, powerSamplesFiltered, writer):
+	voltageSamples = getCorrectedSamples(powerSamplesFiltered[0])
+	currentSamples = getCorrectedSamples(powerSamplesFiltered[1])
+	if not args.quiet:
+		print("Vrms={:8.2f} Voffset={:8.2f} Vrms-corrected={:8.2f}".format(*calcStats(voltageSamples)))
+		print("Irms={:8.2f} Ioffset={:8.2f} Irms-corrected={:8.2f}".format(*calcStats(currentSamples)))
+		print("")
 
+	output = {}
+	output["voltageGroundTruth"] = args.voltageGroundTruth
+	output["currentGroundTruth"] = args.currentGroundTruth
+	output["powerGroundTruth"] = args.powerGroundTruth
+	output["localTime"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+	output["localTimestamp"] = time.time()
+	output["voltage"] = getMap(powerSamplesFiltered[0])
+	output["current"] = getMap(powerSamplesFiltered[1])
+	writer.write(output)
+
+async def reconnect(core, bleAddress):
+	print("Reconnecting to", bleAddress)
+	try:
+		await core.disconnect()
 	except Exception as err:
-		print("Failed to get power samples:", err)
-		traceback.print_exc()
+		print("Failed to disconnect:", err)
+	await core.connect(bleAddress)
+
+async def poll(core, args, writer, stats):
+	"""
+	Requests power samples at the target rate, until the number of times is reached.
+	When a request takes longer than the interval, the next request starts right away, without trying to catch up.
+	After a failed request, the next attempt reconnects first. The polling stops after more than the given number of
+	reconnects in a row.
+	"""
+	interval = 1.0 / args.rate if args.rate > 0 else 0.0
+	# Number of failed requests or reconnects since the last successful request.
+	consecutiveFailures = 0
+	i = 0
+	nextTime = time.time()
+	while args.numTimes == 0 or i < args.numTimes:
+		delay = nextTime - time.time()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		startTime = time.time()
+		nextTime = max(nextTime + interval, startTime)
+		try:
+			if consecutiveFailures > 0:
+				await reconnect(core, args.bleAddress)
+				startTime = time.time()
+			powerSamplesFiltered = await core.debug.getPowerSamples(PowerSamplesType.NOW_FILTERED)
+		except Exception as err:
+			print("Failed to get power samples:", err)
+			stats.failures += 1
+			if consecutiveFailures >= args.reconnects:
+				raise
+			consecutiveFailures += 1
+			nextTime = time.time()
+			continue
+		consecutiveFailures = 0
+		stats.add(startTime, time.time() - startTime, len(powerSamplesFiltered[0].samples) + len(powerSamplesFiltered[1].samples))
+		processSamples(args, powerSamplesFiltered, writer)
+		i += 1
 
-	print("Disconnect")
-	core.control.disconnect()
+def createCore(args):
+	if args.simulate:
+		sys.path.append('../calibrate-power')
+		from simulated_crownstone import SimulatedCrownstoneBle, SimulatedDevice
+		return SimulatedCrownstoneBle([SimulatedDevice(args.bleAddress)], requestTime=args.simulatedRequestTime)
+	from crownstone_ble import CrownstoneBle
+	core = CrownstoneBle(bleAdapterAddress=args.adapterAddress)
+	core.loadSettingsFromFile(args.keyFile)
+	return core
 
-except Exception as err:
-	print("Failed to connect:", err)
+async def main():
+	args = parser.parse_args()
 
+	core = createCore(args)
+	writer = OutputWriter(args.outputPrefix, args.bleAddress)
+	stats = PollStats()
+	try:
+		print("Connecting to", args.bleAddress)
+		await core.connect(args.bleAddress)
+		try:
+			await poll(core, args, writer, stats)
+		except Exception as err:
+			print("Failed to get power samples:", err)
+			traceback.print_exc()
+		finally:
+			print("Disconnect")
+			await core.disconnect()
+	except Exception as err:
+		print("Failed to connect:", err)
+	finally:
+		writer.close()
+		stats.print(args.rate)
 
+	await core.shutDown()
 
-core.shutDown()
+if __name__ == '__main__':
+	try:
+		asyncio.run(main())
+	except KeyboardInterrupt:
+		pass
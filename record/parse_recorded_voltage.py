@@ -1,7 +1,8 @@
 import numpy as np
-import json
 import sys, os
 
+from capture_file import readEntries
+
 """
 Parses a file recorded with record-voltage.py
 Returns a list of consecutive (uninterrupted) timestamps and samples.
@@ -12,7 +13,7 @@ def parse(fileName, filterTimeJumps=True, fix10BitData=True):
     Parses a file recorded with record-voltage.py
     Returns a list of consecutive (uninterrupted) timestamps and samples.
 
-    :param fileName:        Name of the file to parse.
+    :param fileName:        Name of the file to parse. Can be compressed, and doesn't have to be closed properly.
     :param filterTimeJumps: True to consider curves with a time jump between them as not consecutive.
     :param fix10BitData:    Some data was recorded with 10bit ADC resolution, instead of 12bit.
                             Enabling this will change the range of the data if it's never outside the 10 bit range.
@@ -28,8 +29,7 @@ def parse(fileName, filterTimeJumps=True, fix10BitData=True):
     # Max deviation of sample time, before considering it a time jump
     SAMPLE_TIME_US_MAX_DEVIATION = 20
 
-    f = open(fileName, 'r')
-    data = json.load(f)
+    data = readEntries(fileName)
 
     i = 0
 
@@ -54,6 +54,9 @@ def parse(fileName, filterTimeJumps=True, fix10BitData=True):
     for entry in data:
         if ('restart' in entry):
             restarted = True
+        elif ('trigger' in entry):
+            # Start of a window recorded in trigger mode, not consecutive with the previous window.
+            restarted = True
         elif ('uartNoise' in entry):
             uartNoise = True
         elif ('samples' in entry):
@@ -121,8 +124,6 @@ def parse(fileName, filterTimeJumps=True, fix10BitData=True):
             # if i > 3:
             #     break
 
-    f.close()
-
     if (len(consecutiveBuffers)):
         allConsecutiveBuffers.append(consecutiveBuffers)
         allConsecutiveTimestamps.append(consecutiveTimestamps)
@@ -8,23 +8,77 @@ Assumes there is a file "config.json" with optional:
   baudrate:             UART baudrate.
   outputFilenamePrefix: Prefix of the output file names.
   outputFileDir:        Directory to put the output files.
-  readStdin:            Whether to read std input
+  compress:             Whether to gzip the output files.
+  rotateSizeBytes:      Start a new output file when it's larger than this, 0 to disable.
+  rotateIntervalS:      Start a new output file when it's older than this, 0 to disable.
+  readStdin:            Whether to read std input, a new output file is started on enter.
+  printSamples:         Whether to print every voltage buffer.
+  triggerMode:          Only write a window around triggers, instead of all samples. See trigger_capture.py.
+  preTriggerS:          Seconds before a trigger to write.
+  postTriggerS:         Seconds after a trigger to write.
+  triggerOnRestart:     Whether an ADC restart is a trigger.
+  triggerOnDetector:    Whether a switch detected by the switchcraft algorithm is a trigger.
+  triggerPatterns:      List of regular expressions, a UART log or message that matches is a trigger.
+In trigger mode, pressing enter is a trigger as well, instead of starting a new output file.
+
+Entries are written to file in batches by a separate thread, so that a slow disk doesn't stall the UART.
+The number of dropped and late entries is printed periodically.
+
+Each batch is written as a self-delimiting block (see capture_file.py), so the output can be read even
+when the script didn't exit properly.
 """
 
 import time, signal
 import json
+import re
 import select, sys
+import queue
+import threading
 
 from crownstone_uart import CrownstoneUart, UartEventBus, UartTopics
 from crownstone_uart.topics.DevTopics import DevTopics
 
+from capture_file import CaptureWriter
+from trigger_capture import TriggerCapture, ENTRY_RESTART, ENTRY_UART_NOISE
+
+# Max number of entries waiting to be written. When the queue is full, new entries are dropped.
+MAX_QUEUE_SIZE = 5000
+
+# Max number of entries written at once.
+MAX_BATCH_SIZE = 100
+
+# Entries that are written later than this after they were received, are counted as late.
+MAX_WRITE_LATENCY_S = 1.0
+
+# Interval at which the writer stats are printed.
+STATS_INTERVAL_S = 60.0
+
 # Declare vars so they can be used globally
 crownstone = None
-outputFile = None
-wroteFirstEntry = False
-sigInt = False
-outputFilenamePrefix = None
-outputFileDir = None
+captureWriter = None
+stopEvent = threading.Event()
+printSamples = False
+triggerCapture = None
+triggerOnDetector = False
+triggerPatterns = []
+
+# Entries to be written by the writer thread: (entry, receivedTime), or a command string.
+entryQueue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+NEW_FILE_COMMAND = "newFile"
+STOP_COMMAND = "stop"
+
+class WriterStats:
+	def __init__(self):
+		self.written = 0
+		self.dropped = 0
+		self.late = 0
+		self.maxLatency = 0.0
+
+	def __str__(self):
+		return "written={} dropped={} late={} maxLatency={:.3f}s queued={}".format(
+			self.written, self.dropped, self.late, self.maxLatency, entryQueue.qsize())
+
+writerStats = WriterStats()
 
 def main():
 	# Read config file
@@ -34,15 +88,34 @@ def main():
 	# Get optional configs from file
 	device =               jsonConfigData.get('device', '/dev/ttyUSB0')
 	baudrate =             jsonConfigData.get('baudrate', 230400)
-	global outputFilenamePrefix
 	outputFilenamePrefix = jsonConfigData.get('outputFilenamePrefix', 'voltage')
-	global outputFileDir
 	outputFileDir =        jsonConfigData.get('outputFileDir', '.')
+	compress =             jsonConfigData.get('compress', True)
+	rotateSizeBytes =      jsonConfigData.get('rotateSizeBytes', 100 * 1024 * 1024)
+	rotateIntervalS =      jsonConfigData.get('rotateIntervalS', 3600)
 	readStdin =            jsonConfigData.get('readStdin', True)
+	global printSamples
+	printSamples =         jsonConfigData.get('printSamples', False)
+	triggerMode =          jsonConfigData.get('triggerMode', False)
+	preTriggerS =          jsonConfigData.get('preTriggerS', 5.0)
+	postTriggerS =         jsonConfigData.get('postTriggerS', 5.0)
+	triggerOnRestart =     jsonConfigData.get('triggerOnRestart', True)
+	global triggerOnDetector
+	triggerOnDetector =    jsonConfigData.get('triggerOnDetector', False)
+	global triggerPatterns
+	triggerPatterns =      [re.compile(pattern) for pattern in jsonConfigData.get('triggerPatterns', [])]
 
 	jsonConfigFile.close()
 
-	newOutputFile()
+	global captureWriter
+	captureWriter = CaptureWriter(outputFileDir, outputFilenamePrefix, compress, rotateSizeBytes, rotateIntervalS)
+	captureWriter.newFile()
+	writerThread = threading.Thread(target=writerLoop, name="writer")
+	writerThread.start()
+
+	global triggerCapture
+	if triggerMode:
+		triggerCapture = TriggerCapture(preTriggerS, postTriggerS, queueEntries)
 
 	# Create new instance of Crownstone UART.
 	global crownstone
@@ -53,31 +126,48 @@ def main():
 	UartEventBus.subscribe(DevTopics.newAdcConfigPacket, onAdcConfig)
 	UartEventBus.subscribe(DevTopics.adcRestarted, onAdcRestarted)
 	UartEventBus.subscribe(DevTopics.uartNoise, onUartNoise)
+	if triggerCapture is not None:
+		if triggerOnRestart:
+			UartEventBus.subscribe(DevTopics.adcRestarted, onTriggerRestart)
+		if triggerPatterns:
+			UartEventBus.subscribe(UartTopics.uartMessage, onUartMessage)
+			UartEventBus.subscribe(UartTopics.log, onUartLog)
 
 	# start listener for SIGINT kill command
 	signal.signal(signal.SIGINT, stopAll)
 
-	# Start up the USB bridge
-	crownstone.initialize_usb_sync()
-
-	# Need to sleep for some reason
-	time.sleep(1)
-
-	# Enable voltage logs
-	crownstone._usbDev.setSendVoltageSamples(True)
-
-	while not sigInt:
-		if (readStdin):
-			inputStr = pollKeyboardEnter()
-			if inputStr is not None:
-				newOutputFile()
-
-
-
-def pollKeyboardEnter():
-	# Polls for keyboard input
+	try:
+		# Start up the USB bridge
+		crownstone.initialize_usb_sync()
+
+		# Need to sleep for some reason
+		time.sleep(1)
+
+		# Enable voltage logs
+		crownstone._usbDev.setSendVoltageSamples(True)
+
+		while not stopEvent.is_set():
+			if (readStdin):
+				inputStr = waitForKeyboardEnter(1.0)
+				if inputStr is not None:
+					if triggerCapture is not None:
+						triggerCapture.trigger('keypress', time.time())
+					else:
+						entryQueue.put(NEW_FILE_COMMAND)
+			else:
+				stopEvent.wait(1.0)
+	finally:
+		entryQueue.put(STOP_COMMAND)
+		writerThread.join()
+		print("Writer:", writerStats)
+		if triggerCapture is not None:
+			print("Trigger windows:", triggerCapture.numWindows)
+
+
+
+def waitForKeyboardEnter(timeout):
+	# Waits for keyboard input, returns None on timeout.
 	# I have no idea how this works, got it from: https://stackoverflow.com/questions/292095/polling-the-keyboard-detect-a-keypress-in-python
-	timeout = 0.0001
 	try:
 		i,o,e = select.select([sys.stdin], [], [], timeout)
 		for s in i:
@@ -91,40 +181,89 @@ def pollKeyboardEnter():
 
 
 
-def newOutputFile():
-	global outputFile
-
-	closeOutputFile()
-
-	timeStr = time.strftime("%Y-%m-%d--%H-%M-%S")
-	outputFilename = outputFilenamePrefix + "-" + timeStr + ".json"
-	outputFile = open(outputFileDir + '/' + outputFilename, 'w') # 'w' for overwrite, 'a' for append
-	outputFile.write('[\n')
-	global wroteFirstEntry
-	wroteFirstEntry = False
-
-
+def writeEntries(entries, receivedTimes):
+	"""
+	Writes a batch of entries, and updates the latency stats after the write returned, so that slow writes are counted.
+	"""
+	try:
+		captureWriter.write(entries)
+		writerStats.written += len(entries)
+	except (ValueError, OSError) as err:
+		print("Failed to write", len(entries), "entries:", err)
+	writtenTime = time.time()
+	writerStats.maxLatency = max(writerStats.maxLatency, writtenTime - min(receivedTimes))
+	writerStats.late += sum(1 for receivedTime in receivedTimes if writtenTime - receivedTime > MAX_WRITE_LATENCY_S)
+
+
+
+def writerLoop():
+	"""
+	Writes the queued entries to file in batches, until the stop command.
+	Runs in a separate thread, so that the UART callbacks never wait for file I/O.
+	"""
+	lastStatsTime = time.time()
+	stop = False
+	while not stop:
+		try:
+			item = entryQueue.get(timeout=1.0)
+		except queue.Empty:
+			item = None
+		batch = []
+		batchReceivedTimes = []
+		while item is not None:
+			if item == STOP_COMMAND:
+				stop = True
+				break
+			elif item == NEW_FILE_COMMAND:
+				if batch:
+					writeEntries(batch, batchReceivedTimes)
+					batch = []
+					batchReceivedTimes = []
+				captureWriter.newFile()
+			else:
+				entry, receivedTime = item
+				batch.append(entry)
+				batchReceivedTimes.append(receivedTime)
+			if len(batch) >= MAX_BATCH_SIZE:
+				break
+			try:
+				item = entryQueue.get_nowait()
+			except queue.Empty:
+				item = None
+		if batch:
+			writeEntries(batch, batchReceivedTimes)
+
+		if time.time() - lastStatsTime > STATS_INTERVAL_S:
+			lastStatsTime = time.time()
+			print("Writer:", writerStats)
+	captureWriter.close()
+
+
+
+def queueEntry(entry):
+	try:
+		entryQueue.put_nowait((entry, time.time()))
+	except queue.Full:
+		# Don't print here, that would only make it worse: the dropped entries are in the writer stats.
+		writerStats.dropped += 1
 
-def closeOutputFile():
-	if outputFile is not None:
-		outputFile.write('\n]\n')
-		outputFile.close()
+def queueEntries(entries):
+	print("Trigger window of", len(entries), "entries")
+	for entry in entries:
+		queueEntry(entry)
 
 
 
 def onSamples(data):
-	print("onSamples:", data)
-	jsonStr = json.dumps({'samples': data['data'], 'timestamp': data['timestamp']})
-	# json.dump(jsonData, outputFile)
-	try:
-		global wroteFirstEntry
-		if (wroteFirstEntry):
-			outputFile.write(',\n')
-		wroteFirstEntry = True
-
-		outputFile.write(jsonStr)
-	except ValueError:
-		print("Failed to write samples")
+	if printSamples:
+		print("onSamples:", data)
+	if triggerCapture is None:
+		queueEntry({'samples': data['data'], 'timestamp': data['timestamp']})
+		return
+	receivedTime = time.time()
+	triggerCapture.addSamples(data['data'], data['timestamp'], receivedTime)
+	if triggerOnDetector and triggerCapture.detectSwitch():
+		triggerCapture.trigger('detector', receivedTime)
 
 
 
@@ -133,36 +272,37 @@ def onAdcConfig(data):
 
 def onAdcRestarted(data):
 	print("onAdcRestart")
-	jsonStr = json.dumps({'restart': True})
-	try:
-		global wroteFirstEntry
-		if (wroteFirstEntry):
-			outputFile.write(',\n')
-		wroteFirstEntry = True
-
-		outputFile.write(jsonStr)
-	except ValueError:
-		print("Failed to write")
+	if triggerCapture is None:
+		queueEntry({'restart': True})
+	else:
+		triggerCapture.addEvent(ENTRY_RESTART, time.time())
 
 def onUartNoise(data):
 	print("onUartNoise")
-	jsonStr = json.dumps({'uartNoise': True})
-	try:
-		global wroteFirstEntry
-		if (wroteFirstEntry):
-			outputFile.write(',\n')
-		wroteFirstEntry = True
+	if triggerCapture is None:
+		queueEntry({'uartNoise': True})
+	else:
+		triggerCapture.addEvent(ENTRY_UART_NOISE, time.time())
+
+def onTriggerRestart(data):
+	triggerCapture.trigger('adcRestarted', time.time())
+
+def onUartMessage(data):
+	checkTriggerPatterns(data.get('string', ''))
+
+def onUartLog(data):
+	checkTriggerPatterns(str(data))
 
-		outputFile.write(jsonStr)
-	except ValueError:
-		print("Failed to write")
+def checkTriggerPatterns(text):
+	for pattern in triggerPatterns:
+		if pattern.search(text):
+			triggerCapture.trigger('pattern: ' + pattern.pattern, time.time())
+			return
 
 # make sure everything is killed and cleaned up on abort.
 def stopAll(signal, frame):
-	global sigInt
-	sigInt = True
+	stopEvent.set()
 	crownstone.stop()
-	closeOutputFile()
 
 # Call main
 main()
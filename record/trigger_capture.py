@@ -0,0 +1,205 @@
+"""
+Keeps the last seconds of voltage buffers in memory, and only hands out a window around a trigger.
+
+The buffers are stored in a preallocated ring, so that recording for days doesn't grow memory or disk usage.
+When a trigger fires, the window from preTriggerS before, until postTriggerS after the trigger is passed on,
+preceded by an entry {'trigger': [reasons], 'time': triggerTime}.
+Triggers that fire while a window is pending extend that window.
+
+The entries have the same format as written by record-voltage.py.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+SAMPLES_PER_BUFFER = 100
+
+# Expected number of buffers per second: 100 samples with a sample interval of 200us.
+BUFFERS_PER_SECOND = 50
+
+# The ring holds this many times the expected number of buffers of a window, to allow for a higher rate.
+RING_MARGIN = 2
+
+ENTRY_SAMPLES = 0
+ENTRY_RESTART = 1
+ENTRY_UART_NOISE = 2
+
+# Thresholds of the switch detector, as in switchcraft2.py
+DETECTOR_NUM_BUFFERS = 4
+THRESHOLD_DIFFERENT = 500000
+THRESHOLD_SIMILAR = 500000
+
+class SampleRing:
+    def __init__(self, capacity, samplesPerBuffer=SAMPLES_PER_BUFFER):
+        """
+        :param capacity:         Max number of entries kept.
+        :param samplesPerBuffer: Max number of samples per buffer, additional samples are cut off.
+        """
+        self.capacity = capacity
+        self.samples = np.zeros((capacity, samplesPerBuffer), dtype=np.int16)
+        self.lengths = np.zeros(capacity, dtype=np.int32)
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.receivedTimes = np.zeros(capacity)
+        self.kinds = np.zeros(capacity, dtype=np.int8)
+        # Total number of entries pushed, also the sequence number of the next entry.
+        self.count = 0
+
+    def push(self, kind, receivedTime, samples=None, timestamp=0):
+        index = self.count % self.capacity
+        self.kinds[index] = kind
+        self.receivedTimes[index] = receivedTime
+        self.timestamps[index] = timestamp
+        if samples is not None:
+            length = min(len(samples), self.samples.shape[1])
+            self.samples[index, :length] = samples[:length]
+            self.lengths[index] = length
+        else:
+            self.lengths[index] = 0
+        self.count += 1
+
+    def getOldestSeq(self):
+        return max(0, self.count - self.capacity)
+
+    def findSeq(self, receivedTime):
+        """
+        :return: Sequence number of the first kept entry that was received at or after the given time.
+        """
+        oldest = self.getOldestSeq()
+        indices = np.arange(oldest, self.count) % self.capacity
+        return oldest + int(np.searchsorted(self.receivedTimes[indices], receivedTime))
+
+    def getEntries(self, startSeq, endSeq):
+        """
+        :return: List of entries from startSeq until endSeq, entries that are no longer kept are skipped.
+        """
+        entries = []
+        for seq in range(max(startSeq, self.getOldestSeq()), endSeq):
+            index = seq % self.capacity
+            kind = self.kinds[index]
+            if kind == ENTRY_SAMPLES:
+                entries.append({
+                    'samples': self.samples[index, :self.lengths[index]].tolist(),
+                    'timestamp': int(self.timestamps[index]),
+                })
+            elif kind == ENTRY_RESTART:
+                entries.append({'restart': True})
+            elif kind == ENTRY_UART_NOISE:
+                entries.append({'uartNoise': True})
+        return entries
+
+    def getLastBuffers(self, numBuffers):
+        """
+        :return: The last numBuffers sample buffers as 2D array, or None when they are not consecutive.
+        """
+        if self.count < numBuffers:
+            return None
+        indices = np.arange(self.count - numBuffers, self.count) % self.capacity
+        if np.any(self.kinds[indices] != ENTRY_SAMPLES):
+            return None
+        if np.any(self.lengths[indices] != self.samples.shape[1]):
+            return None
+        return self.samples[indices].astype(np.int64)
+
+class TriggerCapture:
+    def __init__(self, preTriggerS, postTriggerS, onWindow):
+        """
+        :param preTriggerS:  Seconds before a trigger to capture.
+        :param postTriggerS: Seconds after a trigger to capture.
+        :param onWindow:     Called with a list of entries for each captured window.
+                             Long windows may be passed on in multiple parts.
+        """
+        self.preTriggerS = preTriggerS
+        self.postTriggerS = postTriggerS
+        self.onWindow = onWindow
+        capacity = int(math.ceil((preTriggerS + postTriggerS) * BUFFERS_PER_SECOND * RING_MARGIN)) + 1
+        self.ring = SampleRing(capacity)
+        # Entries can be added and triggers can fire from different threads.
+        self.lock = threading.Lock()
+        self.pendingReasons = None
+        self.wroteTriggerEntry = False
+        self.triggerTime = 0.0
+        self.windowStartSeq = 0
+        # Entries before this sequence number have already been passed on.
+        self.passedSeq = 0
+        self.windowEndTime = 0.0
+        self.numWindows = 0
+
+    def addSamples(self, samples, timestamp, receivedTime):
+        with self.lock:
+            self.ring.push(ENTRY_SAMPLES, receivedTime, samples, timestamp)
+            self._checkWindow(receivedTime)
+
+    def addEvent(self, kind, receivedTime):
+        with self.lock:
+            self.ring.push(kind, receivedTime)
+            self._checkWindow(receivedTime)
+
+    def trigger(self, reason, triggerTime):
+        with self.lock:
+            if self.pendingReasons is None:
+                self.pendingReasons = [reason]
+                self.wroteTriggerEntry = False
+                self.triggerTime = triggerTime
+                self.windowStartSeq = max(self.passedSeq, self.ring.findSeq(triggerTime - self.preTriggerS))
+                self.numWindows += 1
+            elif reason not in self.pendingReasons:
+                self.pendingReasons.append(reason)
+            self.windowEndTime = max(self.windowEndTime, triggerTime + self.postTriggerS)
+
+    def detectSwitch(self):
+        """
+        Runs the switchcraft detector on the last buffers.
+
+        :return: True when a switch was detected.
+        """
+        with self.lock:
+            buffers = self.ring.getLastBuffers(DETECTOR_NUM_BUFFERS)
+        if buffers is None:
+            return False
+        return detectSwitch(buffers)
+
+    def _checkWindow(self, now):
+        if self.pendingReasons is None:
+            return
+        done = now >= self.windowEndTime
+        # Pass on the window in parts, before the ring overwrites the start of it.
+        full = self.ring.count - self.windowStartSeq >= self.ring.capacity - 1
+        if not (done or full):
+            return
+        entries = self.ring.getEntries(self.windowStartSeq, self.ring.count)
+        if not self.wroteTriggerEntry:
+            entries.insert(0, {'trigger': list(self.pendingReasons), 'time': self.triggerTime})
+            self.wroteTriggerEntry = True
+        self.windowStartSeq = self.ring.count
+        self.passedSeq = self.ring.count
+        if done:
+            self.pendingReasons = None
+        self.onWindow(entries)
+
+def detectSwitch(buffers):
+    """
+    Vectorized version of the switch detection of switchcraft2.py.
+    The scores of all middle buffers and all parts are calculated at once.
+
+    :param buffers: Array of DETECTOR_NUM_BUFFERS consecutive buffers, shape (DETECTOR_NUM_BUFFERS, N).
+    :return:        True when any score indicates a switch.
+    """
+    buffers = np.asarray(buffers, dtype=float)
+    bufferSize = buffers.shape[1]
+    halfSize = bufferSize // 2
+    quarter = bufferSize // 4
+    # One row per part: first half, middle half, second half.
+    partMask = np.zeros((3, bufferSize))
+    partMask[0, 0:halfSize] = 1
+    partMask[1, quarter:quarter + halfSize] = 1
+    partMask[2, halfSize:bufferSize] = 1
+    first = buffers[0]
+    middle = buffers[1:-1]
+    last = buffers[-1]
+    # Scores of shape (number of middle buffers, number of parts).
+    score12 = ((middle - first) ** 2) @ partMask.T
+    score23 = ((last - middle) ** 2) @ partMask.T
+    score13 = ((last - first) ** 2) @ partMask.T
+    return bool(np.any((score12 > THRESHOLD_DIFFERENT) & (score23 > THRESHOLD_DIFFERENT) & (score13 < THRESHOLD_SIMILAR)))
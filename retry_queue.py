@@ -0,0 +1,82 @@
+"""
+A queue of jobs that is shared by multiple workers, for example one per BLE adapter.
+
+Each worker takes jobs from the queue. A job that fails is retried with exponential backoff: it is put back in the
+queue after a delay, without holding up the worker, so that an unreachable Crownstone doesn't keep an adapter busy.
+Jobs need an attempts attribute, which is incremented for each attempt.
+"""
+
+import asyncio
+
+# Delay before retrying a failed job: BACKOFF_BASE_S * 2^(attempts - 1), limited to BACKOFF_MAX_S.
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 30.0
+
+class NonRetryableError(Exception):
+	"""
+	Raise this from a job handler when retrying the job will not help.
+	"""
+	pass
+
+class RetryQueue:
+	def __init__(self, handleJob, retries=3, onError=None, backoffBase=BACKOFF_BASE_S, backoffMax=BACKOFF_MAX_S):
+		"""
+		:param handleJob: Async function(worker, job), that raises an exception when the job failed.
+		:param retries:   Number of times to retry a job that failed.
+		:param onError:   Function(worker, job, error, retry), called when a job failed. Retry is False when the job
+		                  will not be retried anymore.
+		"""
+		self.handleJob = handleJob
+		self.retries = retries
+		self.onError = onError
+		self.backoffBase = backoffBase
+		self.backoffMax = backoffMax
+		self.queue = None
+		# Requeue tasks are kept, as the event loop only keeps a weak reference to tasks.
+		self.requeueTasks = set()
+
+	async def run(self, workers, jobs):
+		"""
+		Runs until all jobs are done, or failed too often.
+		:return: List of jobs that failed.
+		"""
+		self.queue = asyncio.Queue()
+		failedJobs = []
+		for job in jobs:
+			self.queue.put_nowait(job)
+		workerTasks = [asyncio.create_task(self._runWorker(worker, failedJobs)) for worker in workers]
+		try:
+			await self.queue.join()
+		finally:
+			tasks = workerTasks + list(self.requeueTasks)
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+		return failedJobs
+
+	async def _runWorker(self, worker, failedJobs):
+		while True:
+			job = await self.queue.get()
+			job.attempts += 1
+			try:
+				await self.handleJob(worker, job)
+			except asyncio.CancelledError:
+				raise
+			except Exception as err:
+				retry = job.attempts <= self.retries and not isinstance(err, NonRetryableError)
+				if self.onError is not None:
+					self.onError(worker, job, err, retry)
+				if retry:
+					delay = min(self.backoffBase * 2 ** (job.attempts - 1), self.backoffMax)
+					task = asyncio.create_task(self._requeueLater(job, delay))
+					self.requeueTasks.add(task)
+					task.add_done_callback(self.requeueTasks.discard)
+					continue
+				failedJobs.append(job)
+			self.queue.task_done()
+
+	async def _requeueLater(self, job, delay):
+		await asyncio.sleep(delay)
+		self.queue.put_nowait(job)
+		# Only now mark the failed attempt as done, so that the run doesn't end before the retry.
+		self.queue.task_done()
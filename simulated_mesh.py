@@ -0,0 +1,102 @@
+"""
+A simulated mesh of Crownstones, to test asset filter tools without hardware.
+
+Each simulated Crownstone keeps its filters in a MockFilterEndpoint (see asset_filter_sync.py).
+When filters are committed at a Crownstone, the mesh copies them to the other Crownstones after a delay, when their
+master version is lower, like the Crownstones sync filters over the mesh.
+
+SimulatedMeshBle replaces CrownstoneBle: it connects to one simulated Crownstone at a time, and its control is the
+filter endpoint of that Crownstone.
+"""
+
+import asyncio
+
+import numpy as np
+
+from asset_filter_sync import MockFilterEndpoint
+
+class SimulatedMeshError(Exception):
+	pass
+
+class SimulatedMesh:
+	def __init__(self, addresses, propagationDelay=None, bytesPerSecond=None, commandDelay=0.0):
+		"""
+		:param addresses:        MAC addresses of the simulated Crownstones.
+		:param propagationDelay: Time in seconds for committed filters to reach the other Crownstones, None for no mesh sync.
+		:param bytesPerSecond:   Emulated transfer speed of a connection.
+		:param commandDelay:     Emulated time in seconds it takes a Crownstone to handle a command.
+		"""
+		self.propagationDelay = propagationDelay
+		self.stones = {}
+		for address in addresses:
+			self.stones[address.upper()] = MockFilterEndpoint(bytesPerSecond=bytesPerSecond, commandDelay=commandDelay, onCommit=self._onCommit)
+		# Addresses that are connected, a Crownstone can only be connected to one adapter at a time.
+		self.connected = set()
+		self.numMeshUpdates = 0
+		self._tasks = set()
+
+	def getStone(self, address):
+		stone = self.stones.get(address.upper())
+		if stone is None:
+			raise SimulatedMeshError("Unknown Crownstone " + address)
+		return stone
+
+	def _onCommit(self, source):
+		if self.propagationDelay is None:
+			return
+		for stone in self.stones.values():
+			if stone is not source:
+				task = asyncio.get_event_loop().create_task(self._propagate(source.filters, source.masterVersion, source.masterCrc, stone))
+				self._tasks.add(task)
+				task.add_done_callback(self._tasks.discard)
+
+	async def _propagate(self, filters, masterVersion, masterCrc, stone):
+		await asyncio.sleep(self.propagationDelay)
+		if stone.masterVersion < masterVersion:
+			stone.filters = dict(filters)
+			stone.masterVersion = masterVersion
+			stone.masterCrc = masterCrc
+			self.numMeshUpdates += 1
+
+class SimulatedMeshBle:
+	"""
+	Replaces CrownstoneBle, with the Crownstones of a simulated mesh.
+	"""
+	def __init__(self, mesh, connectTime=0.5, disconnectTime=0.05, connectFailureRate=0.0, seed=None):
+		self.mesh = mesh
+		self.connectTime = connectTime
+		self.disconnectTime = disconnectTime
+		self.connectFailureRate = connectFailureRate
+		self.rng = np.random.default_rng(seed)
+		self.connectedAddress = None
+
+	@property
+	def control(self):
+		if self.connectedAddress is None:
+			raise SimulatedMeshError("Not connected")
+		return self.mesh.getStone(self.connectedAddress)
+
+	def loadSettingsFromFile(self, path):
+		pass
+
+	async def connect(self, address, timeout=5, attempts=3, ignoreEncryption=False):
+		if self.connectedAddress is not None:
+			raise SimulatedMeshError("Already connected to " + self.connectedAddress)
+		await asyncio.sleep(self.connectTime)
+		self.mesh.getStone(address)
+		if address.upper() in self.mesh.connected or self.rng.random() < self.connectFailureRate:
+			raise SimulatedMeshError("Could not connect to " + address)
+		self.mesh.connected.add(address.upper())
+		self.connectedAddress = address.upper()
+
+	async def disconnect(self):
+		await asyncio.sleep(self.disconnectTime)
+		self._release()
+
+	async def shutDown(self):
+		self._release()
+
+	def _release(self):
+		if self.connectedAddress is not None:
+			self.mesh.connected.discard(self.connectedAddress)
+		self.connectedAddress = None
@@ -9,6 +9,7 @@ import sys, os
 sys.path.append('../record')
 sys.path.append('../parse')
 import parse_recorded_voltage
+import capture_file
 import parse_app_files
 
 ######################
@@ -86,7 +87,7 @@ def main():
 		largestDiffScores = [0, 0, 0, 0, 0]  # List of highest min(score12, score23) - score13: [min(score12, score23) - score13, score12, score23, score13, ratio], where score12, score23 > score13
 
 		# Parse file
-		if (fileName.split('.')[-1] == 'json'):
+		if (capture_file.isCaptureFile(fileName)):
 			allTimestamps, allSamples = parse_recorded_voltage.parse(fileName, filterTimeJumps=False)
 		else:
 			allTimestamps, allSamples, allMetadata = parse_app_files.parse(fileName)